@@ -1,13 +1,28 @@
+import os
+import sys
+import time
+import importlib
 import streamlit as st
 import urllib.parse
 import json
 
-# 各ページの描画関数をインポート
-from views.search_interface import display_search_interface
-from views.full_treaty_page import display_full_treaty_page
-from views.analysis_page import display_analysis_page
-from views.term_search_page import display_term_search_results_page
-from views.check_page import display_check_page
+# 起動時間の内訳（ビューのインポート・初回描画）を標準エラー出力に記録するか（計測時のみ有効にする）
+ROUTE_TIMING_LOG = os.getenv("ROUTE_TIMING_LOG", "false").lower() in ("1", "true", "yes")
+
+def render_route(module_name: str, function_name: str, *args):
+    """
+    表示するページのビューだけをインポートして描画する。
+    各ビューは必要なモジュール（NLP・検索クライアントなど）をそれぞれインポートするため、
+    他のページの重い依存関係を読み込まずに済む。プロセス内で初めて開いたページはインポートと描画の所要時間を記録する。
+    """
+    cold = module_name not in sys.modules
+    t0 = time.perf_counter()
+    view = getattr(importlib.import_module(module_name), function_name)
+    t1 = time.perf_counter()
+    view(*args)
+    t2 = time.perf_counter()
+    if cold and ROUTE_TIMING_LOG:
+        print(f"[startup] {module_name}: インポート {(t1 - t0) * 1000:.0f} ms / 描画 {(t2 - t1) * 1000:.0f} ms", file=sys.stderr, flush=True)
 
 # ==============================================================================
 # --- メインロジック：表示モードの切り替え ---
@@ -30,6 +45,11 @@ st.markdown("""
         background-color: #FFFF00; /* 黄色の背景色 */
         font-style: normal;      /* イタリック体を解除 */
     }
+    /* 他方の言語で一致した箇所に対応する句 */
+    span.aligned {
+        background-color: #FFF3B0;
+        border-bottom: 2px solid #E0B000;
+    }
 </style>
 """, unsafe_allow_html=True)
 
@@ -44,20 +64,20 @@ reference_treaties_encoded = query_params.get("reference_treaties")
 
 # パラメータに応じて描画するページを切り替え
 if treaty_id_to_display:
-    display_full_treaty_page(treaty_id_to_display)
+    render_route("views.full_treaty_page", "display_full_treaty_page", treaty_id_to_display)
 elif text_to_analyze_encoded:
     decoded_text = urllib.parse.unquote(text_to_analyze_encoded)
-    display_analysis_page(decoded_text)
+    render_route("views.analysis_page", "display_analysis_page", decoded_text)
 elif term_to_search_encoded:
     decoded_term = urllib.parse.unquote(term_to_search_encoded)
-    display_term_search_results_page(decoded_term)
+    render_route("views.term_search_page", "display_term_search_results_page", decoded_term)
 elif text_to_check_encoded:
     decoded_text = urllib.parse.unquote(text_to_check_encoded)
     original_text = urllib.parse.unquote(original_text_encoded)
     decoded_references = []
     if reference_treaties_encoded:
         decoded_references = json.loads(urllib.parse.unquote(reference_treaties_encoded))
-    display_check_page(decoded_text, original_text, decoded_references)
+    render_route("views.check_page", "display_check_page", decoded_text, original_text, decoded_references)
 else:
     # デフォルトはメインの検索インターフェース
-    display_search_interface()
\ No newline at end of file
+    render_route("views.search_interface", "display_search_interface")
\ No newline at end of file
@@ -0,0 +1,140 @@
+import os
+import re
+from array import array
+import numpy as np
+from core.cache import EMBED_BATCH_SIZE
+from core.resilience import execute, ENDPOINT_EMBEDDINGS
+from utils import _escape_html
+
+ALIGN_MIN_SIMILARITY = float(os.getenv("ALIGN_MIN_SIMILARITY", "0.45"))
+ALIGN_POSITION_WEIGHT = float(os.getenv("ALIGN_POSITION_WEIGHT", "0.1"))
+ALIGN_BATCH_LINES = int(os.getenv("ALIGN_BATCH_LINES", "200"))
+_MAX_OFFSET = 0xFFFF
+
+_EN_CLAUSE_BREAK = re.compile(r"(?<=[,;:.])\s+")
+_JA_CLAUSE_BREAK = re.compile(r"(?<=[、。；：，])")
+_EM_PATTERN = re.compile(r"<em>(.+?)</em>")
+
+def split_clauses(text: str, is_en: bool) -> list[tuple[int, int]]:
+    """行を句読点で句単位に分割し、前後の空白を除いた (開始, 終了) の文字位置のリストを返す"""
+    spans, start = [], 0
+    for m in (_EN_CLAUSE_BREAK if is_en else _JA_CLAUSE_BREAK).finditer(text):
+        spans.append((start, m.start()))
+        start = m.end()
+    spans.append((start, len(text)))
+    result = []
+    for s, e in spans:
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if e - s >= 2:
+            result.append((s, e))
+    return result
+
+def _align_clauses(en_spans, ja_spans, en_vecs: np.ndarray, ja_vecs: np.ndarray) -> list[tuple[int, int, int, int]]:
+    """英語の各句に最も類似する日本語の句を対応付ける（語順の近さを弱く加味する）"""
+    en_vecs = en_vecs / np.maximum(np.linalg.norm(en_vecs, axis=1, keepdims=True), 1e-12)
+    ja_vecs = ja_vecs / np.maximum(np.linalg.norm(ja_vecs, axis=1, keepdims=True), 1e-12)
+    sims = en_vecs @ ja_vecs.T
+    en_pos = np.linspace(0, 1, len(en_spans))[:, None]
+    ja_pos = np.linspace(0, 1, len(ja_spans))[None, :]
+    scores = sims + ALIGN_POSITION_WEIGHT * (1 - np.abs(en_pos - ja_pos))
+    pairs = []
+    for i, j in enumerate(np.argmax(scores, axis=1)):
+        if sims[i, j] >= ALIGN_MIN_SIMILARITY:
+            pairs.append((*en_spans[i], *ja_spans[j]))
+    return pairs
+
+def _embed_clauses(aoai_client, embed_model: str, texts: list[str]) -> np.ndarray:
+    """
+    句の埋め込みをバッチAPIで直接作成する（管理コマンド用）。
+    対話的なクエリ用の埋め込みキャッシュは使わず、1回の実行内で重複する句だけをまとめる。
+    """
+    unique = list(dict.fromkeys(texts))
+    vectors = {}
+    for start in range(0, len(unique), EMBED_BATCH_SIZE):
+        batch = unique[start:start + EMBED_BATCH_SIZE]
+        response = execute(lambda: aoai_client.embeddings.create(model=embed_model, input=batch), ENDPOINT_EMBEDDINGS)
+        for text, item in zip(batch, sorted(response.data, key=lambda d: d.index)):
+            vectors[text] = item.embedding
+    return np.asarray([vectors[t] for t in texts], dtype=np.float32)
+
+def build_line_alignments(aoai_client, embed_model: str, lines: list[dict]) -> list[tuple[int, list]]:
+    """
+    条約の行ごとに英語と日本語の句の対応を求め、(行番号, [(英開始, 英終了, 日開始, 日終了), ...]) のリストを返す。
+    句の埋め込みは複数行をまとめてバッチで作成する。どちらかの言語が1句しかない行は対象外とする。
+    """
+    targets = []
+    for line in lines:
+        en_text, ja_text = line.get("en_text") or "", line.get("jp_text") or ""
+        en_spans, ja_spans = split_clauses(en_text, True), split_clauses(ja_text, False)
+        if len(en_spans) >= 2 and len(ja_spans) >= 2 and max(len(en_text), len(ja_text)) <= _MAX_OFFSET:
+            targets.append((line["line_number"], en_text, ja_text, en_spans, ja_spans))
+
+    results = []
+    for start in range(0, len(targets), ALIGN_BATCH_LINES):
+        batch = targets[start:start + ALIGN_BATCH_LINES]
+        texts = [en[s:e] for _, en, _, en_spans, _ in batch for s, e in en_spans]
+        texts += [ja[s:e] for _, _, ja, _, ja_spans in batch for s, e in ja_spans]
+        vectors = _embed_clauses(aoai_client, embed_model, texts)
+        en_offset, ja_offset = 0, sum(len(t[3]) for t in batch)
+        for line_number, _, _, en_spans, ja_spans in batch:
+            en_vecs = vectors[en_offset:en_offset + len(en_spans)]
+            ja_vecs = vectors[ja_offset:ja_offset + len(ja_spans)]
+            en_offset += len(en_spans)
+            ja_offset += len(ja_spans)
+            results.append((line_number, _align_clauses(en_spans, ja_spans, en_vecs, ja_vecs)))
+    return results
+
+def pack_alignment(pairs: list[tuple[int, int, int, int]]) -> bytes:
+    """句の対応を16ビット整数の配列として保存用のバイト列に変換する"""
+    return array("H", [offset for pair in pairs for offset in pair]).tobytes()
+
+def unpack_alignment(blob: bytes) -> list[tuple[int, int, int, int]]:
+    values = array("H")
+    values.frombytes(blob)
+    return [tuple(values[i:i + 4]) for i in range(0, len(values), 4)]
+
+def load_alignments(store, results: list[dict]) -> dict:
+    """検索結果の各行に対する句の対応を条約ストアから一括で読み込む"""
+    blobs = store.get_alignments([(r.get("sourceFile"), r.get("line_number")) for r in results])
+    return {key: unpack_alignment(blob) for key, blob in blobs.items()}
+
+def find_hit_spans(text: str, highlight_snippets: list[str], query: str) -> list[tuple[int, int]]:
+    """サーバーのハイライト（なければクエリ文字列）が本文中で一致する文字位置を返す"""
+    if not text:
+        return []
+    hits = {m.group(1) for snip in highlight_snippets or [] for m in _EM_PATTERN.finditer(snip)}
+    if not hits and query and query.strip().strip('"'):
+        hits = {query.strip().strip('"')}
+    folded = text.casefold()
+    spans = []
+    for hit in hits:
+        needle, pos = hit.casefold(), 0
+        while needle and (pos := folded.find(needle, pos)) != -1:
+            spans.append((pos, pos + len(needle)))
+            pos += len(needle)
+    return spans
+
+def aligned_highlight_html(source_hits: list[tuple[int, int]], target_text: str, pairs: list, source_is_en: bool) -> str:
+    """
+    一方の言語の一致位置に対応するもう一方の言語の句を <span class="aligned"> で囲んだHTMLを返す。
+    対応する句がない場合はエスケープした本文をそのまま返す。
+    """
+    target_spans = set()
+    for en_s, en_e, ja_s, ja_e in pairs or []:
+        src_s, src_e, tgt = (en_s, en_e, (ja_s, ja_e)) if source_is_en else (ja_s, ja_e, (en_s, en_e))
+        if any(hit_s < src_e and src_s < hit_e for hit_s, hit_e in source_hits):
+            target_spans.add(tgt)
+    if not target_spans:
+        return _escape_html(target_text)
+    out, pos = [], 0
+    for s, e in sorted(target_spans):
+        if s < pos:
+            continue
+        out.append(_escape_html(target_text[pos:s]))
+        out.append(f'<span class="aligned">{_escape_html(target_text[s:e])}</span>')
+        pos = e
+    out.append(_escape_html(target_text[pos:]))
+    return "".join(out)
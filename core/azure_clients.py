@@ -1,26 +1,109 @@
 import os
+import httpx
+import requests
 import streamlit as st
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from openai import AzureOpenAI
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
 from azure.search.documents import SearchClient
 
 # .envファイルから環境変数をロード
 load_dotenv()
 
-@st.cache_resource
-def get_clients():
-    """Azure SearchとAzure OpenAIのクライアントを初期化して返す"""
-    search = SearchClient(
+# 検索バックエンド: "azure"（Azure AI Search）または "local"（プロセス内のローカル検索エンジン）
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "azure").lower()
+# 非同期クライアントを使用するか（一括検索を共有イベントループ上で実行する）
+USE_ASYNC_CLIENTS = os.getenv("AZURE_ASYNC_CLIENTS", "false").lower() in ("1", "true", "yes")
+
+# HTTP接続プールの設定（同期・非同期クライアント共通）
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "16"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60"))
+
+def _openai_settings() -> dict:
+    return dict(
+        api_key=os.getenv("AZURE_AIS_OPENAI_API_KEY"),
+        # 再試行は core.resilience に一元化するため、SDK側の再試行は無効にする（検索クライアントは retry_total=0）
+        max_retries=0,
+        azure_endpoint=os.getenv("AZURE_AIS_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_AIS_OPENAI_API_VERSION")
+    )
+
+def _search_settings() -> dict:
+    return dict(
         endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
         index_name=os.getenv("AZURE_SEARCH_INDEX"),
         credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_API_KEY")),
     )
-    aoai = AzureOpenAI(
-        api_key=os.getenv("AZURE_AIS_OPENAI_API_KEY"),
-        azure_endpoint=os.getenv("AZURE_AIS_OPENAI_ENDPOINT"),
-        api_version=os.getenv("AZURE_AIS_OPENAI_API_VERSION")
+
+def _openai_enabled() -> bool:
+    # ローカル検索ではAzure OpenAIが未設定でも起動できるようにする（ベクトル検索・翻訳は利用不可）
+    return not (SEARCH_BACKEND == "local" and not os.getenv("AZURE_AIS_OPENAI_API_KEY"))
+
+def _httpx_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
     )
+
+@st.cache_resource
+def _get_local_search_client():
+    from core.local_search import LocalSearchClient
+    return LocalSearchClient()
+
+def _create_sync_clients():
+    """接続プールを調整した同期クライアントを作成する"""
+    if SEARCH_BACKEND == "local":
+        search = _get_local_search_client()
+    else:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS, pool_maxsize=HTTP_MAX_CONNECTIONS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        search = SearchClient(**_search_settings(), transport=RequestsTransport(session=session, session_owner=False), retry_total=0)
+    aoai = None
+    if _openai_enabled():
+        aoai = AzureOpenAI(**_openai_settings(), http_client=httpx.Client(limits=_httpx_limits(), timeout=HTTP_TIMEOUT_SECONDS))
+    return search, aoai
+
+async def _create_async_clients():
+    """
+    共有イベントループ上で非同期クライアントを作成する。
+    aiohttpのセッションは作成したイベントループに結び付くため、必ず共有ループ内で呼び出す。
+    """
+    import aiohttp
+    from openai import AsyncAzureOpenAI
+    from azure.core.pipeline.transport import AioHttpTransport
+    from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+    if SEARCH_BACKEND == "local":
+        from core.local_search import AsyncLocalSearchClient
+        search = AsyncLocalSearchClient(_get_local_search_client())
+    else:
+        connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS, keepalive_timeout=HTTP_KEEPALIVE_SECONDS)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS))
+        search = AsyncSearchClient(**_search_settings(), transport=AioHttpTransport(session=session, session_owner=False), retry_total=0)
+    aoai = None
+    if _openai_enabled():
+        aoai = AsyncAzureOpenAI(**_openai_settings(), http_client=httpx.AsyncClient(limits=_httpx_limits(), timeout=HTTP_TIMEOUT_SECONDS))
+    return search, aoai
+
+@st.cache_resource
+def get_clients(async_mode: bool = False):
+    """
+    検索バックエンドとAzure OpenAIのクライアントを初期化して返す。
+    async_mode=True の場合は azure.search.documents.aio と AsyncAzureOpenAI のクライアントを返す。
+    非同期クライアントは core.concurrency の共有イベントループに属するため、run_async / submit_async で利用する。
+    """
+    if async_mode:
+        from core.concurrency import run_async
+        search, aoai = run_async(_create_async_clients())
+    else:
+        search, aoai = _create_sync_clients()
     gpt_model = os.getenv("AZURE_AIS_OPENAI_GPT_DEPLOYMENT")
     embed_model = os.getenv("AZURE_AIS_OPENAI_EMBED_DEPLOYMENT")
-    return search, aoai, gpt_model, embed_model
\ No newline at end of file
+    return search, aoai, gpt_model, embed_model
@@ -0,0 +1,257 @@
+import os
+import re
+import time
+import sqlite3
+import json
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+import streamlit as st
+from core.resilience import execute, ENDPOINT_EMBEDDINGS
+
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "2048"))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "200000"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+TRANSLATION_CACHE_TTL_DAYS = float(os.getenv("TRANSLATION_CACHE_TTL_DAYS", "30"))
+TRANSLATION_CACHE_MAX_ITEMS = int(os.getenv("TRANSLATION_CACHE_MAX_ITEMS", "20000"))
+PARSE_CACHE_MAX_ITEMS = int(os.getenv("PARSE_CACHE_MAX_ITEMS", "50000"))
+# SQLiteのプレースホルダー数の上限を超えないよう、まとめて参照するキーの数を制限する
+SQLITE_LOOKUP_CHUNK = 500
+
+def _cache_db_path(file_name: str) -> str:
+    """キャッシュ用SQLiteファイルのパスを返す（既定では glossary.db と同じディレクトリ）"""
+    db_dir = os.path.dirname(os.path.abspath(os.getenv("DATABASE_PATH") or "glossary.db"))
+    return os.getenv("CACHE_DB_PATH") or os.path.join(db_dir, file_name)
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用にテキストを正規化する（NFKC・空白の畳み込み）"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+class EmbeddingCache:
+    """(埋め込みモデル, 正規化テキスト) をキーとする2層（メモリLRU + SQLite）の埋め込みキャッシュ"""
+
+    def __init__(self, db_path: str, memory_items: int = EMBED_CACHE_MEMORY_ITEMS, disk_items: int = EMBED_CACHE_DISK_ITEMS):
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(embed_model: str, text: str) -> str:
+        return hashlib.sha256(f"{embed_model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """キャッシュからベクトルを取得する。見つからない場合はNoneを返す"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            vector = array("f", row[0]).tolist()
+            self._remember(key, vector)
+            self.hits += 1
+            self.disk_hits += 1
+            return vector
+
+    def put(self, key: str, embed_model: str, vector: list[float]):
+        """ベクトルを両方の層に保存し、上限を超えた分を古い順に削除する"""
+        with self._lock:
+            self._remember(key, vector)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                (key, embed_model, array("f", vector).tobytes(), time.time())
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.disk_items
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+    def _remember(self, key: str, vector: list[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """ヒット・ミス件数を返す"""
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "memory_items": len(self._memory)}
+
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    """埋め込みキャッシュを初期化して返す"""
+    return EmbeddingCache(_cache_db_path("embedding_cache.db"))
+
+def get_embeddings(aoai_client, embed_model: str, texts: list[str]) -> list[list[float]]:
+    """キャッシュを参照しつつ、未取得のテキストだけをまとめて埋め込みAPIに送る"""
+    cache = get_embedding_cache()
+    keys = [EmbeddingCache.make_key(embed_model, t) for t in texts]
+    vectors = [cache.get(k) for k in keys]
+
+    # 同一テキストの重複を除いてからAPIに送る
+    missing = {}
+    for idx, (key, vec) in enumerate(zip(keys, vectors)):
+        if vec is None:
+            missing.setdefault(key, []).append(idx)
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), EMBED_BATCH_SIZE):
+        batch_keys = missing_keys[start:start + EMBED_BATCH_SIZE]
+        batch_texts = [texts[missing[k][0]] for k in batch_keys]
+        response = execute(lambda: aoai_client.embeddings.create(model=embed_model, input=batch_texts), ENDPOINT_EMBEDDINGS)
+        for key, item in zip(batch_keys, sorted(response.data, key=lambda d: d.index)):
+            cache.put(key, embed_model, item.embedding)
+            for idx in missing[key]:
+                vectors[idx] = item.embedding
+    return vectors
+
+def get_embedding(aoai_client, embed_model: str, text: str) -> list[float]:
+    """単一テキストの埋め込みをキャッシュ経由で取得する"""
+    return get_embeddings(aoai_client, embed_model, [text])[0]
+
+class TranslationCache:
+    """(モデル, 正規化した原文, 参照文のハッシュ, 用語集) をキーに最良の翻訳とスコアを保存するSQLiteキャッシュ"""
+
+    def __init__(self, db_path: str, ttl_days: float = TRANSLATION_CACHE_TTL_DAYS, max_items: int = TRANSLATION_CACHE_MAX_ITEMS):
+        self.ttl_seconds = ttl_days * 86400
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                score REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_access ON translations (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(gpt_model: str, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict) -> str:
+        references_hash = hashlib.sha256(f"{context_english}\x00{context_japanese}".encode("utf-8")).hexdigest()
+        payload = json.dumps([gpt_model, normalize_text(text_to_translate), references_hash, sorted((glossary or {}).items())], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """有効期限内の (翻訳, スコア) を返す。見つからない場合はNoneを返す"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT translation, score, created_at FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE translations SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, key: str, gpt_model: str, translation: str, score: float):
+        """翻訳を保存し、期限切れと上限超過分を削除する"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, model, translation, score, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, gpt_model, translation, score, now, now)
+            )
+            self._conn.execute("DELETE FROM translations WHERE created_at < ?", (now - self.ttl_seconds,))
+            overflow = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0] - self.max_items
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """ヒット・ミス件数を返す"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+@st.cache_resource
+def get_translation_cache() -> TranslationCache:
+    """翻訳キャッシュを初期化して返す"""
+    return TranslationCache(_cache_db_path("translation_cache.db"))
+
+class ParseCache:
+    """文のハッシュをキーに係り受け解析結果（単語の辞書のリスト）を保存するSQLiteキャッシュ"""
+
+    def __init__(self, db_path: str, max_items: int = PARSE_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS parses (
+                key TEXT PRIMARY KEY,
+                words TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_parses_last_access ON parses (last_access)")
+        self._conn.commit()
+
+    def get_many(self, keys: list[str]) -> dict:
+        """キャッシュ済みの解析結果を {キー: 単語のリスト} で返す"""
+        keys = list(dict.fromkeys(keys))
+        rows, now = [], time.time()
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_LOOKUP_CHUNK):
+                chunk = keys[start:start + SQLITE_LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows += self._conn.execute(f"SELECT key, words FROM parses WHERE key IN ({placeholders})", chunk).fetchall()
+                self._conn.execute(f"UPDATE parses SET last_access = ? WHERE key IN ({placeholders})", [now, *chunk])
+            self._conn.commit()
+        return {key: json.loads(words) for key, words in rows}
+
+    def put_many(self, parses: dict):
+        """解析結果をまとめて保存し、上限を超えた分を古い順に削除する"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parses (key, words, last_access) VALUES (?, ?, ?)",
+                [(key, json.dumps(words, ensure_ascii=False), now) for key, words in parses.items()]
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM parses").fetchone()[0] - self.max_items
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM parses WHERE key IN (SELECT key FROM parses ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+@st.cache_resource
+def get_parse_cache() -> ParseCache:
+    """係り受け解析キャッシュを初期化して返す"""
+    return ParseCache(_cache_db_path("parse_cache.db"))
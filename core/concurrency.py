@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.resilience import execute, ENDPOINT_CHAT
+
+AOAI_MAX_CONCURRENCY = int(os.getenv("AOAI_MAX_CONCURRENCY", "3"))
+AOAI_REQUESTS_PER_MINUTE = float(os.getenv("AOAI_REQUESTS_PER_MINUTE", "30"))
+AOAI_MAX_RETRIES = int(os.getenv("AOAI_MAX_RETRIES", "5"))
+
+class TokenBucket:
+    """トークンバケット方式のレートリミッター"""
+
+    def __init__(self, rate_per_sec: float, capacity: float = None):
+        self.rate = rate_per_sec
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_sec)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """トークンが利用可能になるまで待機して消費する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+def call_with_rate_limit(fn, limiter: TokenBucket = None, max_retries: int = AOAI_MAX_RETRIES, base_delay: float = 1.0, max_delay: float = 60.0):
+    """レートリミッターを通してチャットAPIを呼び出す（再試行・サーキットブレーカーは core.resilience に委譲）"""
+    return execute(fn, ENDPOINT_CHAT, limiter=limiter, max_retries=max_retries, base_delay=base_delay, max_delay=max_delay)
+
+def run_concurrently(fn, items: list, max_workers: int = AOAI_MAX_CONCURRENCY):
+    """
+    各要素に対して関数を並列実行し、完了した順に (インデックス, 結果) を返すジェネレーター。
+    関数内で発生した例外はそのまま呼び出し元に伝播する。
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(fn, item): idx for idx, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """非同期クライアントが共有する、バックグラウンドスレッドで動作するイベントループを返す"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-clients", daemon=True).start()
+            _event_loop = loop
+    return _event_loop
+
+def submit_async(coro):
+    """コルーチンを共有イベントループに投入し、concurrent.futures.Future を返す"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+def run_async(coro, timeout: float = None):
+    """コルーチンを共有イベントループで実行し、完了するまで待って結果を返す"""
+    return submit_async(coro).result(timeout)
@@ -1,14 +1,20 @@
 import os
-import re
 import sqlite3
 import streamlit as st
 import pandas as pd
+from core.glossary_matcher import GlossaryMatcher
+from core.glossary_schema import migrate_glossary_schema, has_fts
 
 @st.cache_resource
 def init_db():
     """データベース接続を初期化し、コネクションを返す"""
     db_path = os.getenv("DATABASE_PATH")
-    return sqlite3.connect(db_path, check_same_thread=False)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        migrate_glossary_schema(conn)
+    except sqlite3.OperationalError as e:
+        st.warning(f"用語集のスキーマ移行に失敗しました: {e}")
+    return conn
 
 @st.cache_data
 def load_all_terms(_conn):
@@ -17,70 +23,111 @@ def load_all_terms(_conn):
     cursor.execute("SELECT english_term, japanese_term FROM terms")
     return cursor.fetchall()
 
+def lookup_terms(conn, english_term: str) -> list[tuple]:
+    """英語表記（大文字小文字を区別しない）で用語を検索する"""
+    return conn.execute(
+        "SELECT id, english_term, japanese_term FROM terms WHERE english_term = ? COLLATE NOCASE",
+        (english_term.strip(),)
+    ).fetchall()
+
+def reverse_lookup_terms(conn, japanese_term: str) -> list[tuple]:
+    """日本語訳から英語表記を逆引きする"""
+    return conn.execute(
+        "SELECT id, english_term, japanese_term FROM terms WHERE japanese_term = ?",
+        (japanese_term.strip(),)
+    ).fetchall()
+
+def _term_filter(conn, query: str) -> tuple[str, list]:
+    """部分一致検索用のWHERE句とパラメータを組み立てる（FTS5が利用できる場合は索引を使用）"""
+    query = (query or "").strip()
+    if not query:
+        return "", []
+    # trigramトークナイザーは3文字未満のクエリに一致しないため、その場合はLIKEで検索する
+    if len(query) >= 3 and has_fts(conn):
+        return "WHERE id IN (SELECT rowid FROM terms_fts WHERE terms_fts MATCH ?)", ['"' + query.replace('"', '""') + '"']
+    like_query = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return "WHERE english_term LIKE ? ESCAPE '\\' OR japanese_term LIKE ? ESCAPE '\\'", [like_query, like_query]
+
+def count_terms(conn, query: str = "") -> int:
+    """検索条件に一致する用語数を返す"""
+    where, params = _term_filter(conn, query)
+    return conn.execute(f"SELECT COUNT(*) FROM terms {where}", params).fetchone()[0]
+
+def fetch_terms_page(conn, query: str = "", limit: int = 100, offset: int = 0) -> pd.DataFrame:
+    """検索条件に一致する用語を英語表記順に1ページ分取得する"""
+    where, params = _term_filter(conn, query)
+    return pd.read_sql_query(
+        f"SELECT id, english_term, japanese_term FROM terms {where} ORDER BY english_term LIMIT ? OFFSET ?",
+        conn, params=[*params, limit, offset]
+    )
+
+def search_terms(conn, query: str, limit: int = 50) -> list[tuple]:
+    """英語・日本語のいずれかに部分一致する用語を検索する"""
+    if not (query or "").strip():
+        return []
+    return list(fetch_terms_page(conn, query, limit).itertuples(index=False, name=None))
+
+@st.cache_resource
+def get_glossary_matcher(_conn) -> GlossaryMatcher:
+    """全用語から照合用のマッチャーを構築する（更新時は差分のみ反映）"""
+    return GlossaryMatcher(load_all_terms(_conn))
+
 def find_glossary_terms(text: str, conn) -> dict:
     """与えられたテキスト内から用語集の英単語を検索し、辞書で返す"""
-    all_terms = load_all_terms(conn)
-    if not all_terms:
-        return {}
-
-    term_map = {}
-    for en_term, ja_term in all_terms:
-        if en_term not in term_map:
-            term_map[en_term] = []
-        term_map[en_term].append(ja_term)
-
-    sorted_terms = sorted(term_map.keys(), key=len, reverse=True)
-    pattern = r'\b(' + '|'.join(re.escape(term) for term in sorted_terms) + r')\b'
-    matches = re.finditer(pattern, text, re.IGNORECASE)
-
-    found_terms = {}
-    lower_term_map = {en.lower(): (en, ja_list) for en, ja_list in term_map.items()}
-
-    for match in matches:
-        matched_text_lower = match.group(1).lower()
-        if matched_text_lower in lower_term_map:
-            original_en, ja_list = lower_term_map[matched_text_lower]
-            if original_en not in found_terms:
-                found_terms[original_en] = ja_list
-    return found_terms
-
-def update_glossary_db(conn, edited_df, db_df):
-    """データエディタでの変更をデータベースに反映する"""
-    cursor = conn.cursor()
-    
-    orig_ids = set(db_df['id'])
-    edited_ids = set(edited_df['id'].dropna())
-    
+    return get_glossary_matcher(conn).find(text)
+
+def find_glossary_terms_batch(texts: list[str], conn) -> list[dict]:
+    """複数のテキストから用語集の英単語をまとめて検索する"""
+    return get_glossary_matcher(conn).find_many(texts)
+
+def update_glossary_db(conn, changes: dict, page_df: pd.DataFrame):
+    """データエディタの変更セット（追加・編集・削除された行）を1つのトランザクションでデータベースに反映する"""
+    term_cols = ['english_term', 'japanese_term']
+    deleted_positions = list(changes.get("deleted_rows", []))
+    edited_rows = {int(k): v for k, v in changes.get("edited_rows", {}).items() if int(k) not in deleted_positions}
+
     # 1. 削除された行
-    deleted_ids = orig_ids - edited_ids
-    if deleted_ids:
-        cursor.executemany("DELETE FROM terms WHERE id = ?", [(id,) for id in deleted_ids])
-        st.write(f"🗑️ {len(deleted_ids)}件の用語を削除しました。")
+    deleted_df = page_df.iloc[deleted_positions]
 
     # 2. 追加された行
-    new_rows = edited_df[edited_df['id'].isna()]
-    if not new_rows.empty:
-        insert_data = [
-            (row['english_term'], row['japanese_term'])
-            for _, row in new_rows.iterrows()
-            if pd.notna(row['english_term']) and pd.notna(row['japanese_term'])
-        ]
-        if insert_data:
-            cursor.executemany("INSERT INTO terms (english_term, japanese_term) VALUES (?, ?)", insert_data)
-            st.write(f"✨ {len(insert_data)}件の用語を追加しました。")
-
-    # 3. 変更された行
-    comparison_df = pd.merge(db_df, edited_df, on='id', how='inner', suffixes=('_orig', '_new'))
-    update_mask = (comparison_df['english_term_orig'] != comparison_df['english_term_new']) | \
-                  (comparison_df['japanese_term_orig'] != comparison_df['japanese_term_new'])
-    updated_rows = comparison_df[update_mask]
-    if not updated_rows.empty:
-        update_data = [
-            (row['english_term_new'], row['japanese_term_new'], row['id'])
-            for _, row in updated_rows.iterrows()
-        ]
-        cursor.executemany("UPDATE terms SET english_term = ?, japanese_term = ? WHERE id = ?", update_data)
-        st.write(f"✏️ {len(update_data)}件の用語を更新しました。")
-
-    conn.commit()
-    load_all_terms.clear() # キャッシュをクリア
\ No newline at end of file
+    added_df = pd.DataFrame(changes.get("added_rows", []), columns=term_cols).dropna(subset=term_cols)
+
+    # 3. 変更された行（編集された列だけを上書きする。空にされたセルもそのまま反映し、用語が空の行は更新しない）
+    updated_df = page_df.iloc[list(edited_rows)].copy()
+    for idx, edits in zip(updated_df.index, edited_rows.values()):
+        for col, value in edits.items():
+            if col in term_cols:
+                updated_df.loc[idx, col] = value
+    cleared_count = len(updated_df)
+    updated_df = updated_df.dropna(subset=term_cols)
+    cleared_count -= len(updated_df)
+    original_updated_df = page_df.loc[updated_df.index]
+
+    with conn:
+        if not deleted_df.empty:
+            conn.executemany("DELETE FROM terms WHERE id = ?", [(int(id),) for id in deleted_df['id']])
+        if not added_df.empty:
+            conn.executemany("INSERT INTO terms (english_term, japanese_term) VALUES (?, ?)", added_df[term_cols].itertuples(index=False, name=None))
+        if not updated_df.empty:
+            conn.executemany(
+                "UPDATE terms SET english_term = ?, japanese_term = ? WHERE id = ?",
+                [(en, ja, int(id)) for en, ja, id in updated_df[[*term_cols, 'id']].itertuples(index=False, name=None)]
+            )
+
+    if not deleted_df.empty:
+        st.write(f"🗑️ {len(deleted_df)}件の用語を削除しました。")
+    if not added_df.empty:
+        st.write(f"✨ {len(added_df)}件の用語を追加しました。")
+    if not updated_df.empty:
+        st.write(f"✏️ {len(updated_df)}件の用語を更新しました。")
+    if cleared_count:
+        st.warning(f"英語・日本語のいずれかが空の{cleared_count}件は更新しませんでした。")
+
+    load_all_terms.clear() # キャッシュをクリア
+
+    # マッチャーは作り直さず、変更された用語だけを反映する
+    matcher = get_glossary_matcher(conn)
+    for en_term, ja_term in [*deleted_df[term_cols].itertuples(index=False, name=None), *original_updated_df[term_cols].itertuples(index=False, name=None)]:
+        matcher.remove(en_term, ja_term)
+    for en_term, ja_term in [*added_df[term_cols].itertuples(index=False, name=None), *updated_df[term_cols].itertuples(index=False, name=None)]:
+        matcher.add(en_term, ja_term)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+from functools import lru_cache
+import numpy as np
+
+RRF_K = 60
+RRF_WINDOW = 50
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+
+def reciprocal_rank_fusion(rankings: list, weights: list[float] = None, k: int = RRF_K, window: int = RRF_WINDOW) -> tuple[np.ndarray, np.ndarray]:
+    """
+    整数IDのランキング（上位から順）を重み付きReciprocal Rank Fusionで統合し、(ID, スコア) をスコアの降順で返す。
+    各ランキングは上位 window 件までを統合に使う。
+    """
+    weights = weights or [1.0] * len(rankings)
+    rankings = [np.asarray(r, dtype=np.int64)[:window] for r in rankings]
+    if not any(len(r) for r in rankings):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    all_ids = np.concatenate(rankings)
+    contributions = np.concatenate([w / (k + np.arange(1, len(r) + 1)) for r, w in zip(rankings, weights)])
+    ids, inverse = np.unique(all_ids, return_inverse=True)
+    scores = np.bincount(inverse, weights=contributions)
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
+
+def _result_key(result: dict):
+    return result.get("sourceFile"), result.get("line_number")
+
+def fuse_results(result_lists: list[list[dict]], weights: list[float] = None, k: int = RRF_K) -> list[dict]:
+    """
+    検索結果のリストを (sourceFile, line_number) で同一視して重み付きRRFで統合する。
+    同じ文書のハイライトは先に現れた結果（テキスト検索）のものを引き継ぐ。
+    """
+    merged, key_ids, rankings = [], {}, []
+    for results in result_lists:
+        ranking = []
+        for result in results:
+            key = _result_key(result)
+            if key not in key_ids:
+                key_ids[key] = len(merged)
+                merged.append(dict(result))
+            elif not merged[key_ids[key]].get("@search.highlights") and result.get("@search.highlights"):
+                merged[key_ids[key]]["@search.highlights"] = result["@search.highlights"]
+            ranking.append(key_ids[key])
+        rankings.append(ranking)
+    window = max((len(r) for r in rankings), default=0)
+    ids, scores = reciprocal_rank_fusion(rankings, weights, k=k, window=window)
+    fused = []
+    for doc_id, score in zip(ids.tolist(), scores.tolist()):
+        merged[doc_id]["@search.score"] = score
+        fused.append(merged[doc_id])
+    return fused
+
+@lru_cache(maxsize=None)
+def get_cross_encoder(model_name: str = RERANK_MODEL):
+    """CPUで動作するクロスエンコーダーをロードする。sentence-transformers が未インストールの場合はNoneを返す"""
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        return None
+    return CrossEncoder(model_name, device="cpu")
+
+def rerank(cross_encoder, query_text: str, results: list[dict], text_field: str) -> list[dict]:
+    """クエリと各結果の本文の組をクロスエンコーダーで採点し、スコアの降順に並べ替える"""
+    if cross_encoder is None or not results:
+        return results
+    scores = cross_encoder.predict([(query_text, r.get(text_field) or "") for r in results])
+    for result, score in zip(results, scores):
+        result["@search.rerankerScore"] = float(score)
+    return sorted(results, key=lambda r: -r["@search.rerankerScore"])
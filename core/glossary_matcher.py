@@ -0,0 +1,103 @@
+import threading
+
+_END = object()
+
+def _is_word_char(ch: str) -> bool:
+    """正規表現の \\w と同等の判定"""
+    return ch.isalnum() or ch == "_"
+
+def _fold(text: str) -> str:
+    """長さを変えずに大文字小文字を畳み込む（re.IGNORECASE と同様の1文字単位の変換）"""
+    return "".join(c if len(lc := c.lower()) != 1 else lc for c in text)
+
+class GlossaryMatcher:
+    """
+    用語集の英語表記を文字トライに保持し、語境界（\\b）と大文字小文字を無視した照合を行うマッチャー。
+    照合結果は「長い用語を優先する正規表現の選択」と同じく、左から順に重ならない最長一致を返す。
+    """
+
+    def __init__(self, terms=()):
+        self._root = {}
+        self._lock = threading.Lock()
+        for en_term, ja_term in terms:
+            self.add(en_term, ja_term)
+
+    def add(self, en_term: str, ja_term: str):
+        """用語を1件追加する"""
+        if not en_term:
+            return
+        with self._lock:
+            node = self._root
+            for ch in _fold(en_term):
+                node = node.setdefault(ch, {})
+            entries = node.setdefault(_END, {})
+            ja_list = entries.setdefault(en_term, [])
+            if ja_term not in ja_list:
+                ja_list.append(ja_term)
+
+    def remove(self, en_term: str, ja_term: str = None):
+        """用語を削除する。ja_term を省略した場合は英語表記に対応する訳語をすべて削除する"""
+        if not en_term:
+            return
+        with self._lock:
+            path, node = [], self._root
+            for ch in _fold(en_term):
+                if ch not in node:
+                    return
+                path.append((node, ch))
+                node = node[ch]
+            entries = node.get(_END, {})
+            if en_term not in entries:
+                return
+            if ja_term is None:
+                del entries[en_term]
+            elif ja_term in entries[en_term]:
+                entries[en_term].remove(ja_term)
+                if not entries[en_term]:
+                    del entries[en_term]
+            if not entries:
+                node.pop(_END, None)
+            # 不要になったノードを末尾から刈り込む
+            for parent, ch in reversed(path):
+                if parent[ch]:
+                    break
+                del parent[ch]
+
+    def find(self, text: str) -> dict:
+        """テキスト内の用語を検索し、{英語表記: [日本語訳, ...]} を返す"""
+        with self._lock:
+            return self._find(text)
+
+    def find_many(self, texts: list[str]) -> list[dict]:
+        """複数のテキストを1回のロック取得でまとめて検索する"""
+        with self._lock:
+            return [self._find(text) for text in texts]
+
+    def _find(self, text: str) -> dict:
+        found = {}
+        if not text:
+            return found
+        folded = _fold(text)
+        n = len(text)
+
+        def is_boundary(i: int) -> bool:
+            return (i > 0 and _is_word_char(text[i - 1])) != (i < n and _is_word_char(text[i]))
+
+        pos = 0
+        while pos < n:
+            match_end, match_entries = -1, None
+            # \b が成立する位置からのみ照合を開始する
+            if is_boundary(pos):
+                node, i = self._root, pos
+                while i < n and folded[i] in node:
+                    node = node[folded[i]]
+                    i += 1
+                    if _END in node and is_boundary(i):
+                        match_end, match_entries = i, node[_END]
+            if match_entries:
+                for en_term, ja_list in match_entries.items():
+                    found.setdefault(en_term, list(ja_list))
+                pos = match_end
+            else:
+                pos += 1
+        return found
@@ -0,0 +1,54 @@
+import sqlite3
+
+SCHEMA_VERSION = 1
+
+_MIGRATIONS = {
+    1: [
+        "CREATE INDEX IF NOT EXISTS idx_terms_english_term_nocase ON terms (english_term COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_terms_japanese_term ON terms (japanese_term)",
+    ],
+}
+
+_FTS_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS terms_fts USING fts5(
+        english_term, japanese_term, content='terms', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS terms_fts_ai AFTER INSERT ON terms BEGIN
+        INSERT INTO terms_fts(rowid, english_term, japanese_term) VALUES (new.id, new.english_term, new.japanese_term);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS terms_fts_ad AFTER DELETE ON terms BEGIN
+        INSERT INTO terms_fts(terms_fts, rowid, english_term, japanese_term) VALUES ('delete', old.id, old.english_term, old.japanese_term);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS terms_fts_au AFTER UPDATE ON terms BEGIN
+        INSERT INTO terms_fts(terms_fts, rowid, english_term, japanese_term) VALUES ('delete', old.id, old.english_term, old.japanese_term);
+        INSERT INTO terms_fts(rowid, english_term, japanese_term) VALUES (new.id, new.english_term, new.japanese_term);
+    END""",
+]
+
+def has_fts(conn) -> bool:
+    """全文検索用のシャドウテーブルが存在するかを返す"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'terms_fts'").fetchone() is not None
+
+def migrate_glossary_schema(conn) -> bool:
+    """
+    terms テーブルにインデックスとFTS5シャドウテーブル（トリガーで同期）を追加する。
+    FTS5（trigramトークナイザー）が利用できない環境ではインデックスのみ作成し、Falseを返す。
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target_version in sorted(v for v in _MIGRATIONS if v > version):
+        for statement in _MIGRATIONS[target_version]:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {target_version}")
+    conn.commit()
+
+    if has_fts(conn):
+        return True
+    try:
+        for statement in _FTS_STATEMENTS:
+            conn.execute(statement)
+        conn.execute("INSERT INTO terms_fts(terms_fts) VALUES ('rebuild')")
+        conn.commit()
+        return True
+    except sqlite3.OperationalError:
+        conn.rollback()
+        return False
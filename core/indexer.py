@@ -0,0 +1,294 @@
+import os
+import csv
+import json
+import base64
+import hashlib
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from core.resilience import execute, ENDPOINT_EMBEDDINGS, ENDPOINT_INDEXING
+
+INDEX_KEY_FIELD = os.getenv("AZURE_SEARCH_KEY_FIELD", "id")
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "100"))
+INDEX_CONCURRENCY = int(os.getenv("INDEX_CONCURRENCY", "4"))
+_HASHED_FIELDS = ["sourceFile", "line_number", "en_text", "jp_text", "jp_title", "valid_date", "country_area"]
+
+def normalize_valid_date(value: str):
+    """効力発生日をAzure SearchのEdm.DateTimeOffset形式（ISO 8601, UTC）に揃える"""
+    if not value or not str(value).strip():
+        return None
+    value = str(value).strip()
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%Y年%m月%d日"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%dT00:00:00Z")
+        except ValueError:
+            continue
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def segment_row(en_text: str, jp_text: str) -> list[tuple[str, str]]:
+    """
+    1行の対訳を改行単位の対訳ペアに分割する。
+    英語と日本語の段落数が一致しない場合は対応関係が崩れるため、分割せずに1組として返す。
+    """
+    en_parts = [p.strip() for p in (en_text or "").splitlines() if p.strip()]
+    jp_parts = [p.strip() for p in (jp_text or "").splitlines() if p.strip()]
+    if len(en_parts) > 1 and len(en_parts) == len(jp_parts):
+        return list(zip(en_parts, jp_parts))
+    if not en_parts and not jp_parts:
+        return []
+    return [((en_text or "").strip(), (jp_text or "").strip())]
+
+def make_document_key(source_file: str, line_number: int) -> str:
+    """sourceFile と行番号から検索インデックスのキー（URLセーフなBase64）を作成する"""
+    return base64.urlsafe_b64encode(f"{source_file}#{line_number}".encode("utf-8")).decode("ascii")
+
+def parse_document_key(key: str) -> tuple[str, int]:
+    """make_document_key で作成したキーから (sourceFile, 行番号) を取り出す"""
+    source_file, _, line_number = base64.urlsafe_b64decode(key.encode("ascii")).decode("utf-8").rpartition("#")
+    return source_file, int(line_number)
+
+def content_hash(doc: dict) -> str:
+    """ベクトル以外の内容から文書のハッシュを計算する"""
+    payload = json.dumps([doc.get(f) for f in _HASHED_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_metadata_csv(path: str) -> dict:
+    """sourceFile ごとの条約名・効力発生日・国地域名を記したCSVを読み込む"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return {row["sourceFile"]: row for row in csv.DictReader(f)}
+
+def iter_documents(csv_paths: list[str], metadata: dict = None, en_column: str = "en_text", jp_column: str = "jp_text"):
+    """対訳CSVを1行ずつ読み込み、分割済みのインデックス文書を順次返すジェネレーター"""
+    metadata = metadata or {}
+    for path in csv_paths:
+        source_file = os.path.basename(path)
+        file_meta = metadata.get(source_file, {})
+        line_number = 0
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                for en_text, jp_text in segment_row(row.get(en_column, ""), row.get(jp_column, "")):
+                    line_number += 1
+                    doc = {
+                        INDEX_KEY_FIELD: make_document_key(source_file, line_number),
+                        "sourceFile": source_file,
+                        "line_number": line_number,
+                        "en_text": en_text,
+                        "jp_text": jp_text,
+                        "jp_title": row.get("jp_title") or file_meta.get("jp_title", ""),
+                        "valid_date": normalize_valid_date(row.get("valid_date") or file_meta.get("valid_date")),
+                        "country_area": row.get("country_area") or file_meta.get("country_area", ""),
+                    }
+                    yield doc
+
+class Checkpoint:
+    """
+    アップロード済み文書の内容ハッシュを記録し、中断後の再開と未変更行のスキップに使うチェックポイント。
+    ファイルはバッチごとに {キー: ハッシュ} を1行追記するJSON Lines形式で、削除した文書はハッシュをnullとして記録する。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._hashes = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries = json.loads(line)
+                    except ValueError:
+                        # 書き込み中に中断された末尾の行は無視する
+                        continue
+                    for key, value in entries.items():
+                        if value is None:
+                            self._hashes.pop(key, None)
+                        else:
+                            self._hashes[key] = value
+
+    def is_unchanged(self, doc: dict) -> bool:
+        return self._hashes.get(doc[INDEX_KEY_FIELD]) == content_hash(doc)
+
+    def keys(self) -> list[str]:
+        """記録されている文書のキーの一覧を返す"""
+        with self._lock:
+            return list(self._hashes)
+
+    def _append(self, entries: dict):
+        if not self.path or not entries:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entries) + "\n")
+
+    def mark_uploaded(self, docs: list[dict]):
+        """アップロードが完了した文書を記録し、そのバッチ分だけをファイルへ追記する"""
+        entries = {doc[INDEX_KEY_FIELD]: content_hash(doc) for doc in docs}
+        with self._lock:
+            self._hashes.update(entries)
+            self._append(entries)
+
+    def mark_deleted(self, keys: list[str]):
+        """インデックスから削除した文書の記録を取り除く"""
+        with self._lock:
+            for key in keys:
+                self._hashes.pop(key, None)
+            self._append(dict.fromkeys(keys))
+
+    def compact(self):
+        """追記された記録を現在の内容1行にまとめて書き直す"""
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(self._hashes) + "\n")
+            os.replace(tmp_path, self.path)
+
+class LocalIndexClient:
+    """
+    ファイルに保存するローカルの検索インデックス代替。テスト用のアップロード先として使用する。
+    文書は sourceFile ごとのJSON Linesファイルに保存される。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, source_file: str) -> str:
+        return os.path.join(self.directory, f"{source_file}.jsonl")
+
+    def load_documents(self, source_file: str) -> dict:
+        path = self._path(source_file)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            docs = (json.loads(line) for line in f if line.strip())
+            return {doc[INDEX_KEY_FIELD]: doc for doc in docs}
+
+    def iter_documents(self):
+        """保存されている全文書を順次返す"""
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.endswith(".jsonl"):
+                yield from self.load_documents(file_name[:-len(".jsonl")]).values()
+
+    def merge_or_upload_documents(self, documents: list[dict]) -> list:
+        """既存の文書とフィールド単位でマージし、存在しない文書は追加する"""
+        by_file = {}
+        for doc in documents:
+            by_file.setdefault(doc["sourceFile"], []).append(doc)
+        with self._lock:
+            for source_file, docs in by_file.items():
+                stored = self.load_documents(source_file)
+                for doc in docs:
+                    stored[doc[INDEX_KEY_FIELD]] = {**stored.get(doc[INDEX_KEY_FIELD], {}), **doc}
+                ordered = sorted(stored.values(), key=lambda d: d.get("line_number", 0))
+                with open(self._path(source_file), "w", encoding="utf-8") as f:
+                    for doc in ordered:
+                        f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        return [_UploadResult(doc[INDEX_KEY_FIELD]) for doc in documents]
+
+    def delete_documents(self, documents: list[dict]) -> list:
+        """キーが一致する文書を削除する"""
+        by_file = {}
+        for doc in documents:
+            by_file.setdefault(parse_document_key(doc[INDEX_KEY_FIELD])[0], set()).add(doc[INDEX_KEY_FIELD])
+        with self._lock:
+            for source_file, keys in by_file.items():
+                stored = self.load_documents(source_file)
+                with open(self._path(source_file), "w", encoding="utf-8") as f:
+                    for doc in sorted(stored.values(), key=lambda d: d.get("line_number", 0)):
+                        if doc[INDEX_KEY_FIELD] not in keys:
+                            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        return [_UploadResult(doc[INDEX_KEY_FIELD]) for doc in documents]
+
+class _UploadResult:
+    def __init__(self, key: str):
+        self.key = key
+        self.succeeded = True
+        self.error_message = None
+
+def _embed_batch(aoai_client, embed_model: str, docs: list[dict]):
+    """文書の英語・日本語テキストをそれぞれ1回のAPI呼び出しで埋め込む"""
+    for text_field, vector_field in (("en_text", "englishVector"), ("jp_text", "japaneseVector")):
+        targets = [doc for doc in docs if doc.get(text_field)]
+        if not targets:
+            continue
+        response = execute(lambda: aoai_client.embeddings.create(model=embed_model, input=[doc[text_field] for doc in targets]), ENDPOINT_EMBEDDINGS)
+        for doc, item in zip(targets, sorted(response.data, key=lambda d: d.index)):
+            doc[vector_field] = item.embedding
+
+def _batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _delete_stale_documents(upload_client, checkpoint: Checkpoint, stale_keys: list[str], batch_size: int) -> list[str]:
+    """チェックポイントにあって今回の文書に含まれないキーをインデックスから削除し、削除できたキーを返す"""
+    deleted = []
+    for batch in _batched(stale_keys, batch_size):
+        results = execute(lambda: upload_client.delete_documents(documents=[{INDEX_KEY_FIELD: key} for key in batch]), ENDPOINT_INDEXING)
+        succeeded = [r.key for r in results if r.succeeded]
+        checkpoint.mark_deleted(succeeded)
+        deleted += succeeded
+    return deleted
+
+def run_indexer(documents, upload_client, aoai_client, embed_model: str, checkpoint: Checkpoint, batch_size: int = INDEX_BATCH_SIZE, concurrency: int = INDEX_CONCURRENCY, on_progress=None, prune_all: bool = False) -> dict:
+    """
+    文書を読み込みながらバッチ単位で埋め込みとアップロードを行う。
+    未変更の文書はスキップし、アップロードに成功したバッチごとにチェックポイントへ追記する。
+    同時に処理するバッチ数は concurrency 件までに制限する。
+    すべてのバッチが完了した後、今回の文書に含まれなくなったキー（行数が減った条約の末尾の行など）をインデックスから削除する。
+    削除の対象は既定では今回読み込んだ sourceFile の文書に限り、prune_all を指定するとインデックス全体を対象とする。
+    戻り値の "changed_files" は、文書をアップロードまたは削除した sourceFile の一覧（条約ストアの無効化に使う）。
+    """
+    stats = {"skipped": 0, "uploaded": 0, "failed": 0, "deleted": 0}
+    stats_lock = threading.Lock()
+    seen_keys, seen_files, changed_files = set(), set(), set()
+
+    def changed_documents():
+        for doc in documents:
+            seen_keys.add(doc[INDEX_KEY_FIELD])
+            seen_files.add(doc["sourceFile"])
+            if checkpoint.is_unchanged(doc):
+                stats["skipped"] += 1
+                continue
+            yield doc
+
+    def process(batch: list[dict]):
+        _embed_batch(aoai_client, embed_model, batch)
+        results = execute(lambda: upload_client.merge_or_upload_documents(documents=batch), ENDPOINT_INDEXING)
+        succeeded_keys = {r.key for r in results if r.succeeded}
+        succeeded = [doc for doc in batch if doc[INDEX_KEY_FIELD] in succeeded_keys]
+        checkpoint.mark_uploaded(succeeded)
+        with stats_lock:
+            changed_files.update(doc["sourceFile"] for doc in succeeded)
+            stats["uploaded"] += len(succeeded)
+            stats["failed"] += len(batch) - len(succeeded)
+        if on_progress:
+            on_progress(dict(stats))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pending = set()
+        for batch in _batched(changed_documents(), batch_size):
+            # 読み込みが先行しすぎないよう、処理中のバッチ数を制限する
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(process, batch))
+        for future in pending:
+            future.result()
+
+    stale_keys = [key for key in checkpoint.keys() if key not in seen_keys and (prune_all or parse_document_key(key)[0] in seen_files)]
+    if stale_keys:
+        deleted = _delete_stale_documents(upload_client, checkpoint, stale_keys, batch_size)
+        changed_files.update(parse_document_key(key)[0] for key in deleted)
+        stats["deleted"] = len(deleted)
+        if on_progress:
+            on_progress(dict(stats))
+    checkpoint.compact()
+    return {**stats, "changed_files": sorted(changed_files)}
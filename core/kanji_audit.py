@@ -0,0 +1,107 @@
+import numpy as np
+import streamlit as st
+
+# 文字の分類コード
+NOT_KANJI, JOYO, NON_JOYO = 0, 1, 2
+# 漢字として扱う範囲（CJK統合漢字・拡張A・互換漢字、および補助漢字面の拡張B以降）
+KANJI_BMP_RANGES = [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF)]
+KANJI_SUPPLEMENTARY_RANGE = (0x20000, 0x3FFFF)
+CONTEXT_CHARS = 8
+
+@st.cache_resource
+def get_joyo_table():
+    """
+    基本多言語面の全コードポイントに対する分類コード（NOT_KANJI / JOYO / NON_JOYO）の参照表を作成する。
+    常用漢字ファイルが読み込めない場合はNoneを返す。
+    """
+    from utils import load_joyo_kanji
+    joyo = load_joyo_kanji()
+    if not joyo:
+        return None
+    table = np.full(0x10000, NOT_KANJI, dtype=np.uint8)
+    for start, end in KANJI_BMP_RANGES:
+        table[start:end + 1] = NON_JOYO
+    codepoints = np.fromiter((ord(c) for c in joyo if ord(c) < 0x10000), dtype=np.int64)
+    # ファイル中の漢字以外の文字（括弧・改行など）は対象外とする
+    codepoints = codepoints[table[codepoints] == NON_JOYO]
+    table[codepoints] = JOYO
+    return table
+
+def _classify(codepoints: np.ndarray, table: np.ndarray) -> np.ndarray:
+    classes = table[np.minimum(codepoints, 0xFFFF)]
+    supplementary = (codepoints >= KANJI_SUPPLEMENTARY_RANGE[0]) & (codepoints <= KANJI_SUPPLEMENTARY_RANGE[1])
+    classes[supplementary] = NON_JOYO
+    classes[(codepoints > 0xFFFF) & ~supplementary] = NOT_KANJI
+    return classes
+
+def _to_codepoints(text: str) -> np.ndarray:
+    # UTF-32の各要素は1文字に対応するため、配列の添字がそのまま文字列の位置になる
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+def _build_audit(chars: np.ndarray, positions: np.ndarray, total_kanji: int) -> dict:
+    """常用外の漢字のコードポイントと位置から、文字ごとの出現回数と位置の一覧をまとめる"""
+    unique, inverse, counts = np.unique(chars, return_inverse=True, return_counts=True)
+    grouped = np.split(positions[np.argsort(inverse, kind="stable")], np.cumsum(counts)[:-1])
+    non_joyo = {chr(c): {"count": int(n), "positions": group.tolist()} for c, n, group in zip(unique.tolist(), counts.tolist(), grouped)}
+    return {"total_kanji": total_kanji, "non_joyo_count": int(len(positions)), "non_joyo": non_joyo}
+
+def audit_kanji(text: str) -> dict:
+    """
+    テキスト中の常用漢字以外の漢字を1回のベクトル演算で検出する。
+    {"total_kanji": 漢字数, "non_joyo_count": 常用外の出現数, "non_joyo": {文字: {"count": 回数, "positions": [位置, ...]}}} を返す。
+    常用漢字ファイルが読み込めない場合はNoneを返す。
+    """
+    table = get_joyo_table()
+    if table is None:
+        return None
+    codepoints = _to_codepoints(text)
+    classes = _classify(codepoints, table)
+    positions = np.flatnonzero(classes == NON_JOYO)
+    return _build_audit(codepoints[positions], positions, int(np.count_nonzero(classes)))
+
+def audit_kanji_batch(texts: list[str]) -> list[dict]:
+    """
+    複数のテキスト（条約全文・コーパス全体など）を連結して一括で分類し、テキストごとの監査結果を返す。
+    位置は各テキスト内の文字位置。常用漢字ファイルが読み込めない場合はNoneを返す。
+    """
+    table = get_joyo_table()
+    if table is None:
+        return None
+    codepoints = _to_codepoints("".join(texts))
+    classes = _classify(codepoints, table)
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    # テキストごとの漢字数は、文字ごとの真偽値をテキストの区間単位で合計して求める（コーパス全体の累積和は作らない）
+    # reduceat は区間が空の場合に開始位置の要素を返すため、空でないテキストの開始位置だけで区切り、空のテキストは0とする
+    totals = np.zeros(len(texts), dtype=np.int64)
+    non_empty = lengths > 0
+    if non_empty.any():
+        totals[non_empty] = np.add.reduceat(classes != NOT_KANJI, bounds[:-1][non_empty], dtype=np.int64)
+    non_joyo = np.flatnonzero(classes == NON_JOYO)
+    split_at = np.searchsorted(non_joyo, bounds)
+    audits = []
+    for i in range(len(texts)):
+        positions = non_joyo[split_at[i]:split_at[i + 1]]
+        audits.append(_build_audit(codepoints[positions], positions - bounds[i], int(totals[i])))
+    return audits
+
+def merge_frequencies(audits: list[dict]) -> dict:
+    """テキストごとの監査結果から、常用外の漢字ごとの出現回数の合計を多い順に返す"""
+    totals = {}
+    for audit in audits:
+        for char, info in audit["non_joyo"].items():
+            totals[char] = totals.get(char, 0) + info["count"]
+    return dict(sorted(totals.items(), key=lambda item: (-item[1], item[0])))
+
+def format_kanji_audit(text: str, audit: dict, context_chars: int = CONTEXT_CHARS) -> str:
+    """監査結果を、文字ごとの出現回数と最初の出現箇所の前後の文脈を含むレポートにする（LLMレビューへの入力にも使う）"""
+    if audit is None:
+        return "常用漢字の一覧を読み込めなかったため、確認できませんでした。"
+    if not audit["non_joyo"]:
+        return "常用漢字以外の漢字は見つかりませんでした。"
+    lines = [f"常用漢字以外の漢字が見つかりました ({len(audit['non_joyo'])}字・{audit['non_joyo_count']}箇所):"]
+    for char, info in sorted(audit["non_joyo"].items(), key=lambda item: item[1]["positions"][0]):
+        pos = info["positions"][0]
+        context = text[max(0, pos - context_chars):pos + context_chars + 1].replace("\n", " ")
+        lines.append(f"- {char}（{info['count']}回）: 「{context}」")
+    return "\n".join(lines)
@@ -0,0 +1,357 @@
+import os
+import re
+import json
+import math
+from datetime import datetime
+from typing import Protocol
+import numpy as np
+from core.fusion import RRF_WINDOW, reciprocal_rank_fusion
+
+LOCAL_SEARCH_INDEX_DIR = os.getenv("LOCAL_SEARCH_INDEX_DIR", "local_index")
+LOCAL_SEARCH_NPROBE = int(os.getenv("LOCAL_SEARCH_NPROBE", "8"))
+LOCAL_SEARCH_IVF_MIN_DOCS = int(os.getenv("LOCAL_SEARCH_IVF_MIN_DOCS", "20000"))
+TEXT_FIELDS = ["en_text", "jp_text", "jp_title"]
+VECTOR_FIELDS = ["englishVector", "japaneseVector"]
+BM25_K1, BM25_B = 1.2, 0.75
+
+_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+|[぀-ヿ㐀-鿿豈-﫿]+")
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-鿿豈-﫿]")
+_FILTER_CLAUSE = re.compile(r"^\s*(\w+)\s+(eq|ne|gt|ge|lt|le)\s+('(?:[^']|'')*'|\S+)\s*$")
+# 引用符の外にある and だけで区切る（後ろに続く ' の数が偶数の位置は文字列リテラルの外側。'' のエスケープも2個として数えられる）
+_FILTER_AND = re.compile(r"\s+and\s+(?=(?:[^']*'[^']*')*[^']*$)")
+
+class SearchBackend(Protocol):
+    """perform_search が利用する検索バックエンドのインターフェース（azure.search.documents.SearchClient 互換）"""
+
+    def search(self, search_text: str = None, **kwargs): ...
+
+def tokenize(text: str):
+    """英数字は小文字の単語、日本語は文字バイグラム（1文字の場合はユニグラム）に分割し、(語, 開始, 終了) を返す"""
+    for m in _TOKEN_PATTERN.finditer(text or ""):
+        token, start = m.group(0), m.start()
+        if not _CJK_PATTERN.match(token):
+            yield token.lower(), start, m.end()
+        elif len(token) == 1:
+            yield token, start, start + 1
+        else:
+            for i in range(len(token) - 1):
+                yield token[i:i + 2], start + i, start + i + 2
+
+def _parse_datetime(value: str):
+    return np.datetime64(datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None), "s")
+
+def _kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """IVF用の粗量子化器（球面k-means）のセントロイドを学習する"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+    return centroids
+
+def build_local_index(documents, out_dir: str, quantize: bool = False, nlist: int = None) -> int:
+    """
+    文書（ベクトルを含む辞書）のイテラブルからローカル検索用のインデックスを作成する。
+    ベクトルは正規化したfloat32（quantize=Trueの場合はint8と行ごとのスケール）の .npy として保存し、
+    文書数が多い場合はIVF用のセントロイドと割り当ても保存する。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    vectors = {field: [] for field in VECTOR_FIELDS}
+    count = 0
+    with open(os.path.join(out_dir, "documents.jsonl"), "w", encoding="utf-8") as f:
+        for doc in documents:
+            for field in VECTOR_FIELDS:
+                vectors[field].append(doc.get(field))
+            f.write(json.dumps({k: v for k, v in doc.items() if k not in VECTOR_FIELDS}, ensure_ascii=False) + "\n")
+            count += 1
+
+    manifest = {"count": count, "quantized": quantize, "vector_fields": []}
+    for field, rows in vectors.items():
+        dim = next((len(v) for v in rows if v), 0)
+        if not dim:
+            continue
+        matrix = np.zeros((count, dim), dtype=np.float32)
+        for i, v in enumerate(rows):
+            if v:
+                matrix[i] = v
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        if quantize:
+            scale = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+            np.save(os.path.join(out_dir, f"{field}.int8.npy"), np.round(matrix / scale[:, None]).astype(np.int8))
+            np.save(os.path.join(out_dir, f"{field}.scale.npy"), scale.astype(np.float32))
+        else:
+            np.save(os.path.join(out_dir, f"{field}.npy"), matrix)
+        if count >= LOCAL_SEARCH_IVF_MIN_DOCS:
+            centroids = _kmeans(matrix, nlist or int(math.sqrt(count)))
+            assign = np.concatenate([np.argmax(matrix[s:s + 8192] @ centroids.T, axis=1) for s in range(0, count, 8192)])
+            np.savez(os.path.join(out_dir, f"{field}.ivf.npz"), centroids=centroids, assign=assign.astype(np.int32))
+        manifest["vector_fields"].append(field)
+
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return count
+
+class _BM25Field:
+    """1フィールド分の転置インデックスとBM25スコアラー"""
+
+    def __init__(self, texts: list[str]):
+        postings = {}
+        self.doc_len = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tf = {}
+            for term, _, _ in tokenize(text):
+                tf[term] = tf.get(term, 0) + 1
+            self.doc_len[doc_id] = sum(tf.values())
+            for term, freq in tf.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(freq)
+        self.postings = {t: (np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32)) for t, (ids, tfs) in postings.items()}
+        self.avgdl = float(self.doc_len.mean()) if len(texts) else 0.0
+        self.num_docs = len(texts)
+
+    def score(self, terms: list[str]) -> np.ndarray:
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / max(self.avgdl, 1e-9))
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            idf = math.log(1 + (self.num_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[ids])
+        return scores
+
+class _VectorField:
+    """1フィールド分の埋め込み行列（メモリマップ）と任意のIVFインデックス"""
+
+    def __init__(self, index_dir: str, field: str, quantized: bool):
+        if quantized:
+            self.matrix = np.load(os.path.join(index_dir, f"{field}.int8.npy"), mmap_mode="r")
+            self.scale = np.load(os.path.join(index_dir, f"{field}.scale.npy"))
+        else:
+            self.matrix = np.load(os.path.join(index_dir, f"{field}.npy"), mmap_mode="r")
+            self.scale = None
+        self.centroids = self.order = self.offsets = None
+        ivf_path = os.path.join(index_dir, f"{field}.ivf.npz")
+        if os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            self.centroids = ivf["centroids"]
+            self.order = np.argsort(ivf["assign"], kind="stable").astype(np.int32)
+            self.offsets = np.searchsorted(ivf["assign"][self.order], np.arange(len(self.centroids) + 1))
+
+    def _similarity(self, ids, query: np.ndarray) -> np.ndarray:
+        rows = self.matrix if ids is None else self.matrix[ids]
+        if self.scale is None:
+            return rows @ query
+        scale = self.scale if ids is None else self.scale[ids]
+        return (rows.astype(np.float32) @ query) * scale
+
+    def knn(self, query: list[float], k: int, mask: np.ndarray = None, nprobe: int = LOCAL_SEARCH_NPROBE) -> tuple[np.ndarray, np.ndarray]:
+        """コサイン類似度の上位k件を返す（IVFがある場合は近傍のリストのみを探索する近似検索）"""
+        q = np.asarray(query, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        if self.centroids is not None:
+            probes = np.argsort(-(self.centroids @ q))[:nprobe]
+            ids = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+        else:
+            ids = np.arange(self.matrix.shape[0], dtype=np.int32)
+        # 行列全体をそのままの行順で計算できるのは、全件探索で候補が 0..N-1 の並びのままの場合に限る
+        # （IVFの候補は全件を含んでいてもリスト順に並び替えられている）
+        full_scan = self.centroids is None and mask is None
+        if mask is not None:
+            ids = ids[mask[ids]]
+        if not len(ids):
+            return ids, np.zeros(0, dtype=np.float32)
+        sims = self._similarity(None if full_scan else ids, q)
+        top = np.argsort(-sims)[:k] if len(sims) <= k else np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return ids[top], sims[top]
+
+class _Results(list):
+    def __init__(self, items, count, facets=None):
+        super().__init__(items)
+        self._count = count
+        self._facets = facets
+
+    def get_count(self):
+        return self._count
+
+    def get_facets(self):
+        return self._facets
+
+class LocalSearchClient:
+    """
+    メモリ上で動作する検索バックエンド。SearchClient.search と同じ引数
+    （テキスト検索・ベクトル検索・ハイブリッド融合・フィルター・並べ替え・ハイライト・件数）を扱う。
+    """
+
+    def __init__(self, index_dir: str = LOCAL_SEARCH_INDEX_DIR):
+        with open(os.path.join(index_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(index_dir, "documents.jsonl"), "r", encoding="utf-8") as f:
+            self.documents = [json.loads(line) for line in f if line.strip()]
+        self.text_fields = {field: _BM25Field([d.get(field) or "" for d in self.documents]) for field in TEXT_FIELDS}
+        self.vector_fields = {field: _VectorField(index_dir, field, manifest["quantized"]) for field in manifest["vector_fields"]}
+        self._valid_dates = np.array(
+            [_parse_datetime(d["valid_date"]) if d.get("valid_date") else np.datetime64("NaT") for d in self.documents],
+            dtype="datetime64[s]"
+        )
+        self._columns = {}
+
+    def _column(self, field: str, kind) -> np.ndarray:
+        """フィルター用に文字列・数値の列を配列化してキャッシュする"""
+        if (field, kind) not in self._columns:
+            if kind is str:
+                values = np.array([str(d.get(field) or "") for d in self.documents], dtype=object)
+            else:
+                values = np.array([d.get(field) if d.get(field) is not None else np.nan for d in self.documents], dtype=float)
+            self._columns[(field, kind)] = values
+        return self._columns[(field, kind)]
+
+    def _filter_mask(self, odata_filter: str):
+        """'field op value' を and で連結した単純なODataフィルターを評価する"""
+        if not odata_filter:
+            return None
+        mask = np.ones(len(self.documents), dtype=bool)
+        ops = {"eq": np.equal, "ne": np.not_equal, "gt": np.greater, "ge": np.greater_equal, "lt": np.less, "le": np.less_equal}
+        for clause in _FILTER_AND.split(odata_filter.strip()):
+            m = _FILTER_CLAUSE.match(clause)
+            if not m:
+                raise ValueError(f"サポートされていないフィルター式です: {clause}")
+            field, op, raw = m.groups()
+            if field == "valid_date":
+                values, target = self._valid_dates, _parse_datetime(raw)
+            elif raw.startswith("'"):
+                values, target = self._column(field, str), raw[1:-1].replace("''", "'")
+            else:
+                values, target = self._column(field, float), float(raw)
+            mask &= ops[op](values, target).astype(bool)
+        return mask
+
+    def _text_ranking(self, search_text: str, search_fields: list[str], mask) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        """BM25によるテキスト検索。完全一致（"..."）の場合は語句を含む文書に限定する"""
+        query = search_text.strip()
+        fields = search_fields or TEXT_FIELDS
+        if query in ("", "*"):
+            ids = np.arange(len(self.documents)) if mask is None else np.flatnonzero(mask)
+            return ids, np.ones(len(ids), dtype=np.float32), []
+        phrase = query[1:-1] if len(query) > 1 and query.startswith('"') and query.endswith('"') else None
+        terms = [t for t, _, _ in tokenize(phrase if phrase is not None else query)]
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for field in fields:
+            scores += self.text_fields[field].score(terms)
+        hit = scores > 0
+        if mask is not None:
+            hit &= mask
+        ids = np.flatnonzero(hit)
+        if phrase is not None:
+            folded = phrase.casefold()
+            ids = ids[[any(folded in (self.documents[i].get(f) or "").casefold() for f in fields) for i in ids]] if len(ids) else ids
+        ids = ids[np.argsort(-scores[ids], kind="stable")]
+        return ids, scores[ids], terms
+
+    def _highlight(self, text: str, terms: set, pre_tag: str, post_tag: str):
+        marked = [(start, end) for term, start, end in tokenize(text) if term in terms]
+        if not marked:
+            return None
+        spans = []
+        for start, end in sorted(marked):
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+        out, pos = [], 0
+        for start, end in spans:
+            out.append(f"{text[pos:start]}{pre_tag}{text[start:end]}{post_tag}")
+            pos = end
+        return "".join(out) + text[pos:]
+
+    def _facets(self, facets: list[str], ids: list[int]) -> dict:
+        result = {}
+        for facet in facets or []:
+            field, *params = facet.split(",")
+            limit = next((int(p.split(":")[1]) for p in params if p.startswith("count:")), 10)
+            counts = {}
+            for i in ids:
+                value = self.documents[i].get(field)
+                counts[value] = counts.get(value, 0) + 1
+            result[field] = [{"value": v, "count": c} for v, c in sorted(counts.items(), key=lambda x: -x[1])[:limit]]
+        return result
+
+    def search(self, search_text: str = None, search_fields: list[str] = None, vector_queries: list = None, filter: str = None,
+               select: list[str] = None, top: int = 50, order_by=None, include_total_count: bool = False,
+               highlight_fields: str = None, highlight_pre_tag: str = "<em>", highlight_post_tag: str = "</em>",
+               facets: list[str] = None, **kwargs) -> _Results:
+        mask = self._filter_mask(filter)
+        top = 50 if top is None else top
+        rankings, terms = [], []
+        if search_text is not None:
+            ids, scores, terms = self._text_ranking(search_text, search_fields, mask)
+            rankings.append((ids, scores))
+        for vq in vector_queries or []:
+            k = getattr(vq, "k_nearest_neighbors", None) or top
+            for field in str(getattr(vq, "fields", "")).split(","):
+                if field.strip() in self.vector_fields:
+                    rankings.append(self.vector_fields[field.strip()].knn(vq.vector, k, mask))
+
+        if not rankings:
+            rankings.append((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)))
+        if len(rankings) == 1:
+            ids, scores = rankings[0]
+            count = len(ids)
+        else:
+            # ハイブリッド検索はAzure AI Searchと同様に各ランキングの上位をReciprocal Rank Fusionで統合する
+            count = len(np.unique(np.concatenate([r[0] for r in rankings])))
+            ids, scores = reciprocal_rank_fusion([r[0] for r in rankings], window=max(top, RRF_WINDOW))
+        fused = list(zip(ids.tolist(), scores.tolist())) if order_by or facets else list(zip(ids[:top].tolist(), scores[:top].tolist()))
+
+        if order_by:
+            for clause in reversed([order_by] if isinstance(order_by, str) else list(order_by)):
+                field, _, direction = clause.partition(" ")
+                fused = sorted(fused, key=lambda x: (self.documents[x[0]].get(field) is None, self.documents[x[0]].get(field)), reverse=direction.strip() == "desc")
+
+        highlight = [f.strip() for f in highlight_fields.split(",")] if highlight_fields else []
+        term_set = set(terms)
+        items = []
+        for doc_id, score in fused[:top]:
+            doc = self.documents[doc_id]
+            item = {k: doc.get(k) for k in select} if select else dict(doc)
+            item["@search.score"] = score
+            if highlight:
+                snippets = {f: [h] for f in highlight if (h := self._highlight(doc.get(f) or "", term_set, highlight_pre_tag, highlight_post_tag))}
+                item["@search.highlights"] = snippets or None
+            items.append(item)
+        return _Results(items, count if include_total_count else None, self._facets(facets, [d for d, _ in fused]) if facets else None)
+
+class _AsyncResults:
+    """azure.search.documents.aio の検索結果と同じく非同期に反復できる結果"""
+
+    def __init__(self, results: _Results):
+        self._results = results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self._results:
+            yield item
+
+    async def get_count(self):
+        return self._results.get_count()
+
+    async def get_facets(self):
+        return self._results.get_facets()
+
+class AsyncLocalSearchClient:
+    """LocalSearchClient を azure.search.documents.aio.SearchClient と同じ非同期インターフェースで公開する"""
+
+    def __init__(self, client: LocalSearchClient):
+        self._client = client
+
+    async def search(self, search_text: str = None, **kwargs) -> _AsyncResults:
+        return _AsyncResults(self._client.search(search_text=search_text, **kwargs))
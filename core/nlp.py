@@ -1,39 +1,208 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from functools import lru_cache
 import streamlit as st
-import spacy
-import stanza
-import torch
-import pysbd
-from spacy.language import Language
+from core.cache import get_parse_cache
 from utils import is_japanese
 
-@Language.component("pysbd_sentencizer")
+# spaCy・Stanza・torch はインポートだけで数秒かかるため、実際にモデルを使う時点で読み込む
+# 文分割では学習済みモデルを使わず、空のspaCyパイプライン（トークナイザーのみ）とpysbdで分割する
+SEGMENT_BATCH_SIZE = int(os.getenv("SEGMENT_BATCH_SIZE", "64"))
+
+# Stanzaのモデルは実行時にダウンロードせず、このディレクトリに配置済みのものを使う（treatysearcher.py download-stanza で取得）
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STANZA_RESOURCES_DIR = os.getenv("STANZA_RESOURCES_DIR") or os.path.join(PROJECT_ROOT, "stanza_resources")
+STANZA_LANG = "en"
+# 係り受け解析ページで使うプロセッサーのみ。トークン化は自前の分割結果を渡すため、モデルを使わない
+STANZA_PROCESSORS = "tokenize,pos,lemma,depparse"
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t\u3000]*\n")
+# 日本語は空白で区切られないため、文末の句読点でもトークンを区切り、pysbdの文境界とトークン境界を一致させる
+_JA_SENTENCE_END_INFIX = r"[。！？]"
+
+_load_lock = threading.Lock()
+_warm_up_started = threading.Event()
+_thread_state = threading.local()
+
+logger = logging.getLogger(__name__)
+
+def _get_segmenter(lang_code: str):
+    """pysbdのSegmenterを言語ごとに再利用する（segment() は呼び出し中の状態を保持するため、スレッドごとに持つ）"""
+    segmenters = getattr(_thread_state, "segmenters", None)
+    if segmenters is None:
+        segmenters = _thread_state.segmenters = {}
+    if lang_code not in segmenters:
+        import pysbd
+        segmenters[lang_code] = pysbd.Segmenter(language=lang_code, clean=False, char_span=True)
+    return segmenters[lang_code]
+
 def pysbd_sentence_boundaries(doc):
     lang_code = "ja" if is_japanese(doc.text) else "en"
-    seg = pysbd.Segmenter(language=lang_code, clean=False, char_span=True)
-    sents_char_spans = seg.segment(doc.text)
+    sents_char_spans = _get_segmenter(lang_code).segment(doc.text)
     start_char_indices = {s.start for s in sents_char_spans}
     for token in doc:
         token.is_sent_start = True if token.i == 0 or token.idx in start_char_indices else False
     return doc
 
+@lru_cache(maxsize=None)
+def _register_components():
+    from spacy.language import Language
+    Language.component("pysbd_sentencizer", func=pysbd_sentence_boundaries)
+
+@lru_cache(maxsize=None)
+def _load_sentence_splitter():
+    import spacy
+    from spacy.util import compile_infix_regex
+    _register_components()
+    nlp = spacy.blank("xx")
+    nlp.tokenizer.infix_finditer = compile_infix_regex([*nlp.Defaults.infixes, _JA_SENTENCE_END_INFIX]).finditer
+    nlp.add_pipe("pysbd_sentencizer")
+    return nlp
+
+def get_sentence_splitter():
+    """文分割用の空のspaCyパイプラインを返す（バックグラウンドでの事前読み込みと同時に呼ばれた場合は完了を待つ）"""
+    with _load_lock:
+        return _load_sentence_splitter()
+
+def _paragraph_spans(text: str):
+    """空行で区切られた段落の (開始, 終了) を返す。文は段落をまたがないものとして扱う"""
+    start = 0
+    for m in _PARAGRAPH_BREAK.finditer(text):
+        if text[start:m.start()].strip():
+            yield start, m.start()
+        start = m.end()
+    if text[start:].strip():
+        yield start, len(text)
+
+def iter_sentence_spans(text: str, batch_size: int = SEGMENT_BATCH_SIZE):
+    """
+    テキストを文に分割し、各文の (開始, 終了) の文字位置を順に返すジェネレーター。
+    段落ごとに nlp.pipe へ流すため、長い文書でも全体を1つのDocとして保持しない。
+    """
+    paragraphs = list(_paragraph_spans(text))
+    docs = get_sentence_splitter().pipe((text[s:e] for s, e in paragraphs), batch_size=batch_size)
+    for (offset, _), doc in zip(paragraphs, docs):
+        for sent in doc.sents:
+            yield offset + sent.start_char, offset + sent.end_char
+
 @st.cache_resource
-def load_nlp_model(model_name="en_core_web_lg"):
-    """spaCyモデルをロードする"""
+def load_sentence_splitter():
+    """文分割エンジンをロードする（失敗時はNone）"""
     try:
-        nlp = spacy.load(model_name)
-        nlp.add_pipe("pysbd_sentencizer", before="parser")
-        return nlp
-    except OSError:
-        st.warning(f"spaCyモデル '{model_name}' のロードに失敗しました。")
+        return get_sentence_splitter()
+    except (ImportError, OSError) as e:
+        st.warning(f"文分割エンジンのロードに失敗しました: {e}")
         return None
 
+def missing_stanza_models(model_dir: str = STANZA_RESOURCES_DIR, lang: str = STANZA_LANG, processors: str = STANZA_PROCESSORS) -> list[str]:
+    """
+    モデルディレクトリに見つからないStanzaのリソースを返す。
+    resources.json の既定パッケージ一覧から、各プロセッサーのモデルと依存モデル（pretrain・charlm）のファイルを確認する。
+    """
+    try:
+        with open(os.path.join(model_dir, "resources.json"), encoding="utf-8") as f:
+            lang_resources = json.load(f).get(lang, {})
+    except (OSError, ValueError):
+        return ["resources.json"]
+    defaults = lang_resources.get("default_processors", {})
+    default_dependencies = lang_resources.get("default_dependencies", {})
+    required = []
+    for processor in processors.split(","):
+        if processor == "tokenize":
+            continue
+        package = defaults.get(processor)
+        if package is None:
+            # 既定パッケージが分からない場合はディレクトリの有無だけを確認する
+            required += [processor, "pretrain"]
+            continue
+        required.append(os.path.join(processor, f"{package}.pt"))
+        dependencies = default_dependencies.get(processor) or lang_resources.get(processor, {}).get(package, {}).get("dependencies", [])
+        required += [os.path.join(dep["model"], f"{dep['package']}.pt") for dep in dependencies]
+    return [path for path in dict.fromkeys(required) if not os.path.exists(os.path.join(model_dir, lang, path))]
+
+def download_stanza_models(model_dir: str = STANZA_RESOURCES_DIR, lang: str = STANZA_LANG, processors: str = STANZA_PROCESSORS):
+    """必要なプロセッサーのStanzaモデルだけをモデルディレクトリにダウンロードする（管理コマンド用）"""
+    import stanza
+    stanza.download(lang, model_dir=model_dir, processors=processors)
+
 @st.cache_resource
 def load_stanza_model():
-    """Stanzaモデルをロードする"""
+    """配置済みのStanzaモデルから、必要なプロセッサーのみのパイプラインをオフラインで構築する"""
+    missing = missing_stanza_models()
+    if missing:
+        st.error(f"Stanzaモデルが {STANZA_RESOURCES_DIR} に見つかりません（{', '.join(missing)}）。`python treatysearcher.py download-stanza` を実行してください。")
+        return None
     try:
+        import stanza
+        import torch
         use_gpu = torch.cuda.is_available()
-        stanza.download('en')
-        return stanza.Pipeline('en', use_gpu=use_gpu)
+        return stanza.Pipeline(
+            STANZA_LANG, dir=STANZA_RESOURCES_DIR, processors=STANZA_PROCESSORS,
+            tokenize_pretokenized=True, download_method=None, use_gpu=use_gpu,
+        )
     except Exception as e:
         st.error(f"Stanzaモデルのロード中にエラーが発生しました: {e}")
-        return None
\ No newline at end of file
+        return None
+
+@lru_cache(maxsize=None)
+def _get_pretokenizer():
+    """空のspaCy英語パイプラインにpysbdの文分割のみを加えたもの（Stanzaへ渡す文・トークンの分割用）"""
+    import spacy
+    _register_components()
+    nlp = spacy.blank("en")
+    nlp.add_pipe("pysbd_sentencizer")
+    return nlp
+
+def pretokenize(text: str) -> list[list[str]]:
+    """テキストを文ごとのトークン列に分割する"""
+    doc = _get_pretokenizer()(text)
+    sentences = [[token.text for token in sent if not token.is_space] for sent in doc.sents]
+    return [tokens for tokens in sentences if tokens]
+
+def _sentence_hash(tokens: list[str]) -> str:
+    return hashlib.sha256("\x1f".join([STANZA_PROCESSORS, *tokens]).encode("utf-8")).hexdigest()
+
+def parse_dependencies(text: str) -> list[list[dict]]:
+    """
+    テキストを自前で文・トークンに分割し、文ごとの係り受け解析結果（単語の辞書のリスト）を返す。
+    解析結果は文のハッシュをキーとしてディスクにキャッシュし、未解析の文だけを1回のStanza呼び出しでまとめて解析する。
+    すべての文がキャッシュ済みの場合はStanzaモデルを読み込まない。
+    """
+    sentences = pretokenize(text)
+    keys = [_sentence_hash(tokens) for tokens in sentences]
+    cache = get_parse_cache()
+    parses = cache.get_many(keys)
+    missing = {key: tokens for key, tokens in zip(keys, sentences) if key not in parses}
+    if missing:
+        stanza_nlp = load_stanza_model()
+        if stanza_nlp is None:
+            raise RuntimeError("Stanzaモデルがロードされていません。")
+        doc = stanza_nlp(list(missing.values()))
+        parsed = {
+            key: [{"id": word.id, "text": word.text, "lemma": word.lemma, "upos": word.upos, "head": word.head, "deprel": word.deprel} for word in sent.words]
+            for key, sent in zip(missing, doc.sentences)
+        }
+        cache.put_many(parsed)
+        parses.update(parsed)
+    return [parses[key] for key in keys]
+
+def warm_up_nlp():
+    """
+    初回描画の後に文分割エンジン（spaCy・pysbd）をバックグラウンドスレッドで読み込んでおく（プロセス内で1回のみ）。
+    ワーカースレッドからは Streamlit の API を呼び出さず、読み込みに失敗した場合はログに記録し、利用時に改めて報告する。
+    """
+    if _warm_up_started.is_set():
+        return
+    _warm_up_started.set()
+
+    def _load():
+        try:
+            get_sentence_splitter()
+        except Exception:
+            logger.exception("文分割エンジンの事前読み込みに失敗しました")
+
+    threading.Thread(target=_load, name="nlp-warm-up", daemon=True).start()
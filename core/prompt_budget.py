@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+from collections import deque
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "o200k_base")
+# tiktoken は語彙ファイルを初回利用時にダウンロードするため、プロジェクト内のディレクトリにキャッシュする。
+# オフライン環境では treatysearcher.py download-tokenizer で取得したディレクトリを配置しておく
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIKTOKEN_CACHE_DIR = os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(PROJECT_ROOT, "tiktoken_cache"))
+TRANSLATION_CONTEXT_TOKEN_BUDGET = int(os.getenv("TRANSLATION_CONTEXT_TOKEN_BUDGET", "6000"))
+REVIEW_REFERENCE_TOKEN_BUDGET = int(os.getenv("REVIEW_REFERENCE_TOKEN_BUDGET", "12000"))
+REPORT_TOKEN_BUDGET = int(os.getenv("REPORT_TOKEN_BUDGET", "24000"))
+USAGE_HISTORY_SIZE = 200
+TRUNCATION_MARKER = "\n…（以下省略）"
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+@lru_cache(maxsize=None)
+def _get_encoding(name: str = PROMPT_TOKENIZER):
+    """tiktoken のエンコーディングを返す。未インストールまたは語彙ファイルを取得できない場合はNone（文字数による概算に切り替える）"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+def download_tokenizer(name: str = PROMPT_TOKENIZER) -> bool:
+    """語彙ファイルを TIKTOKEN_CACHE_DIR に取得する（管理コマンド用）。取得できた場合はTrueを返す"""
+    _get_encoding.cache_clear()
+    return _get_encoding(name) is not None
+
+def count_tokens(text: str) -> int:
+    """
+    テキストのトークン数をローカルで数える。
+    tiktoken が使えない場合は、非ASCII文字（日本語）を1文字1トークン、ASCII文字を4文字1トークンとして概算する。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    non_ascii = len(_NON_ASCII.findall(text))
+    return non_ascii + -(-(len(text) - non_ascii) // 4)
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """テキストが予算を超える場合、可能なら行の区切りで切り詰めて省略記号を付ける"""
+    if count_tokens(text) <= budget:
+        return text
+    budget -= count_tokens(TRUNCATION_MARKER)
+    if budget <= 0:
+        return ""
+    # トークン数が予算に収まる最長の先頭部分を二分探索する
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text.rfind("\n", 0, lo)
+    if cut < lo // 2:
+        cut = lo
+    return text[:cut].rstrip() + TRUNCATION_MARKER
+
+def fit_references(references: list[dict], budget: int = TRANSLATION_CONTEXT_TOKEN_BUDGET, fields: tuple = ("en_text", "jp_text")) -> tuple[list[dict], int]:
+    """
+    参照文を先頭（上位）から順に予算へ詰め込み、(採用した参照文, 除外した件数) を返す。
+    予算を超えた時点で打ち切るため、除外されるのは常に下位の参照文になる。
+    1件も収まらない場合は最上位の参照文を切り詰めて採用する。
+    """
+    kept, used = [], 0
+    for ref in references:
+        cost = sum(count_tokens(ref.get(field) or "") for field in fields)
+        if used + cost > budget:
+            break
+        kept.append(ref)
+        used += cost
+    if not kept and references:
+        share = budget // len(fields)
+        kept = [{**references[0], **{field: truncate_to_tokens(references[0].get(field) or "", share) for field in fields}}]
+    return kept, len(references) - len(kept)
+
+def fit_sections(sections: list[str], budget: int = REPORT_TOKEN_BUDGET) -> list[str]:
+    """
+    複数のテキストを合計が予算に収まるように切り詰める。
+    短いテキストはそのまま残し、残りの予算を長いテキストで均等に分け合う。
+    """
+    costs = [count_tokens(s) for s in sections]
+    if sum(costs) <= budget:
+        return list(sections)
+    allowance, remaining = {}, budget
+    order = sorted(range(len(sections)), key=lambda i: costs[i])
+    for n, i in enumerate(order):
+        allowance[i] = min(costs[i], remaining // (len(order) - n))
+        remaining -= allowance[i]
+    return [truncate_to_tokens(s, allowance[i]) for i, s in enumerate(sections)]
+
+_usage_history = deque(maxlen=USAGE_HISTORY_SIZE)
+_usage_totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+_usage_lock = threading.Lock()
+
+def record_usage(label: str, usage) -> dict:
+    """
+    APIレスポンスの usage から入力・出力・キャッシュ済みトークン数を記録し、その値を返す。
+    usage がない場合（ストリーミングで使用量を受け取れなかった場合など）は空の辞書を返す。
+    """
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    entry = {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
+    with _usage_lock:
+        _usage_history.append({"label": label, **entry})
+        _usage_totals["calls"] += 1
+        for key, value in entry.items():
+            _usage_totals[key] += value
+    return entry
+
+def get_usage_stats() -> dict:
+    """記録したトークン使用量の累計と直近の呼び出し履歴を返す"""
+    with _usage_lock:
+        return {**_usage_totals, "recent": list(_usage_history)}
+
+def format_usage(entry: dict) -> str:
+    """トークン使用量を表示用の文字列にする"""
+    if not entry or "prompt_tokens" not in entry:
+        return ""
+    cached = f" (キャッシュ {entry['cached_tokens']})" if entry.get("cached_tokens") else ""
+    return f"入力 {entry['prompt_tokens']}{cached} / 出力 {entry['completion_tokens']} トークン"
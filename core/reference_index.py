@@ -0,0 +1,161 @@
+import os
+import glob
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+import streamlit as st
+from core.prompt_budget import count_tokens
+from core.resilience import execute, ENDPOINT_EMBEDDINGS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_DOC_DIR = os.path.join(PROJECT_ROOT, "ref_docs")
+REFERENCE_INDEX_DIR = os.getenv("REFERENCE_INDEX_DIR") or os.path.join(PROJECT_ROOT, "ref_index")
+REFERENCE_CHUNK_CHARS = int(os.getenv("REFERENCE_CHUNK_CHARS", "800"))
+REFERENCE_EMBED_BATCH_SIZE = int(os.getenv("REFERENCE_EMBED_BATCH_SIZE", "64"))
+REFERENCE_TOP_K = int(os.getenv("REFERENCE_TOP_K", "20"))
+REFERENCE_DOC_PATTERN = "ref_doc_*.txt"
+
+logger = logging.getLogger(__name__)
+
+def list_reference_docs(doc_dir: str = REFERENCE_DOC_DIR) -> list[str]:
+    """インデックスの対象となる参照資料のファイル名の一覧を返す"""
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(doc_dir, REFERENCE_DOC_PATTERN)))
+
+def chunk_reference_text(text: str, max_chars: int = REFERENCE_CHUNK_CHARS) -> list[str]:
+    """参照資料を行単位でまとめ、max_chars 程度のチャンクに分割する"""
+    chunks, current = [], ""
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line.strip():
+            continue
+        # 1行が長すぎる場合はその行自体を分割する
+        while len(line) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+class ReferenceIndex:
+    """参照資料のチャンクと埋め込みをディスクに保持し、関連箇所を検索するインデックス"""
+
+    def __init__(self, doc_dir: str = REFERENCE_DOC_DIR, index_dir: str = REFERENCE_INDEX_DIR):
+        self.doc_dir = doc_dir
+        self.index_dir = index_dir
+        self._loaded = {}
+        self._building = set()
+        self._lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _paths(self, filename: str) -> tuple[str, str]:
+        stem = os.path.splitext(filename)[0]
+        return os.path.join(self.index_dir, f"{stem}.json"), os.path.join(self.index_dir, f"{stem}.npy")
+
+    def _read(self, filename: str) -> tuple[bytes, str]:
+        with open(os.path.join(self.doc_dir, filename), "rb") as f:
+            raw = f.read()
+        return raw, hashlib.sha256(raw).hexdigest()
+
+    def _load_built(self, embed_model: str, filename: str, file_hash: str) -> bool:
+        """メモリまたはディスクに最新のインデックスがあれば読み込んでTrueを返す（呼び出し側でロックを取得する）"""
+        loaded = self._loaded.get(filename)
+        if loaded and loaded["sha256"] == file_hash and loaded["embed_model"] == embed_model:
+            return True
+        meta_path, vec_path = self._paths(filename)
+        if os.path.exists(meta_path) and os.path.exists(vec_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("sha256") == file_hash and meta.get("embed_model") == embed_model:
+                self._loaded[filename] = {**meta, "vectors": np.load(vec_path, mmap_mode="r")}
+                return True
+        return False
+
+    def load(self, embed_model: str, filename: str) -> bool:
+        """構築済みで最新のインデックスがあれば読み込んでTrueを返す。埋め込みAPIは呼び出さない"""
+        _, file_hash = self._read(filename)
+        with self._lock:
+            return self._load_built(embed_model, filename, file_hash)
+
+    def ensure(self, aoai_client, embed_model: str, filename: str):
+        """インデックスを読み込む。参照資料のハッシュが変わっている場合のみ再構築する"""
+        raw, file_hash = self._read(filename)
+        with self._lock:
+            if self._load_built(embed_model, filename, file_hash):
+                return
+
+        # 埋め込みの作成中も他の資料の読み込み・検索を妨げないよう、ロックの外で構築する
+        chunks = chunk_reference_text(raw.decode("utf-8"))
+        vectors = []
+        for start in range(0, len(chunks), REFERENCE_EMBED_BATCH_SIZE):
+            batch = chunks[start:start + REFERENCE_EMBED_BATCH_SIZE]
+            response = execute(lambda: aoai_client.embeddings.create(model=embed_model, input=batch), ENDPOINT_EMBEDDINGS)
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        meta = {"sha256": file_hash, "embed_model": embed_model, "chunks": chunks}
+        meta_path, vec_path = self._paths(filename)
+        with self._lock:
+            np.save(vec_path, matrix)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            self._loaded[filename] = {**meta, "vectors": matrix}
+
+    def build_in_background(self, aoai_client, embed_model: str, filenames: list[str]):
+        """
+        読み込み済みでないインデックスをバックグラウンドスレッドで順に構築する（構築中の資料は重複して構築しない）。
+        ワーカースレッドからは Streamlit の API を呼び出さず、失敗はログに記録して次回のレビュー時に再試行する。
+        """
+        with self._lock:
+            pending = [f for f in filenames if f not in self._building and f not in self._loaded]
+            self._building.update(pending)
+        if not pending:
+            return
+
+        def _build():
+            for filename in pending:
+                try:
+                    self.ensure(aoai_client, embed_model, filename)
+                except Exception:
+                    logger.exception("参照資料 %s のインデックスの構築に失敗しました", filename)
+                finally:
+                    with self._lock:
+                        self._building.discard(filename)
+
+        threading.Thread(target=_build, name="reference-index-build", daemon=True).start()
+
+    def retrieve(self, filename: str, query_vector: list[float], top_k: int = REFERENCE_TOP_K, max_tokens: int = None) -> str:
+        """
+        クエリに関連する上位 top_k 件のチャンクを、資料内の出現順に連結して返す。
+        max_tokens を指定すると、関連度の高いチャンクから順に予算内に収まるものだけを使う。
+        """
+        loaded = self._loaded[filename]
+        vectors = loaded["vectors"]
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        k = min(top_k, len(scores))
+        top_indices = np.argpartition(-scores, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+        if max_tokens is not None:
+            selected, used = [], 0
+            for i in top_indices[np.argsort(-scores[top_indices])]:
+                cost = count_tokens(loaded["chunks"][i])
+                if used + cost <= max_tokens:
+                    selected.append(i)
+                    used += cost
+            top_indices = np.asarray(selected, dtype=np.int64)
+        top_indices = np.sort(top_indices)
+        return "\n...\n".join(loaded["chunks"][i] for i in top_indices)
+
+@st.cache_resource
+def get_reference_index() -> ReferenceIndex:
+    """参照資料インデックスを初期化して返す"""
+    return ReferenceIndex()
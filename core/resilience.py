@@ -0,0 +1,285 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+RESILIENCE_MAX_RETRIES = int(os.getenv("RESILIENCE_MAX_RETRIES", "4"))
+RESILIENCE_BASE_DELAY = float(os.getenv("RESILIENCE_BASE_DELAY", "0.5"))
+RESILIENCE_MAX_DELAY = float(os.getenv("RESILIENCE_MAX_DELAY", "30"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+# 一括検索の各ワーカーは融合時に2件の取得を並列に行い、それぞれがヘッジを1件送りうるため、既定では検索の同時実行数の4倍とする
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS") or 4 * int(os.getenv("SEARCH_MAX_CONCURRENCY", "8")))
+
+ENDPOINT_SEARCH = "search"
+# 条約全文のページ取得など、ヘッジしない一括取得（検索のp95に影響させないため別に計測する）
+ENDPOINT_SEARCH_EXPORT = "search-export"
+ENDPOINT_CHAT = "aoai-chat"
+ENDPOINT_EMBEDDINGS = "aoai-embeddings"
+ENDPOINT_INDEXING = "search-indexing"
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# ネットワーク層の一時的なエラー（openai / azure-core の例外クラス名）
+_TRANSIENT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ServiceRequestError", "ServiceResponseError", "ServiceRequestTimeoutError", "ServiceResponseTimeoutError"}
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため、呼び出しを行わずに失敗させたことを示す例外"""
+
+def status_code_of(error: Exception):
+    """例外からHTTPステータスコードを取得する"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def retry_after_seconds(error: Exception):
+    """例外のレスポンスヘッダーから Retry-After の秒数を取得する"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error: Exception) -> bool:
+    """429・5xx・タイムアウト・接続エラーなど、再試行で回復しうるエラーかを判定する"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if status_code_of(error) in RETRYABLE_STATUS:
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError)) or any(cls.__name__ in _TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+def backoff_delay(attempt: int, error: Exception = None, base_delay: float = RESILIENCE_BASE_DELAY, max_delay: float = RESILIENCE_MAX_DELAY) -> float:
+    """Retry-After があればそれに従い、なければ指数バックオフ（フルジッター）で待機時間を決める"""
+    retry_after = retry_after_seconds(error) if error is not None else None
+    if retry_after is not None:
+        return min(max_delay, retry_after) + random.uniform(0, 0.1 * max(retry_after, base_delay))
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+class CircuitBreaker:
+    """連続失敗が閾値に達すると一定時間呼び出しを遮断し、その後1件の試行で回復を確認するサーキットブレーカー"""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self) -> bool:
+        """失敗を記録し、この失敗でブレーカーが開いた場合はTrueを返す"""
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+class Endpoint:
+    """エンドポイントごとのサーキットブレーカー・レイテンシー履歴・カウンター"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0, "short_circuits": 0, "circuit_opens": 0}
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self):
+        """成功した呼び出しのレイテンシーのパーセンタイル（サンプル不足の場合はNone）"""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "state": self.breaker.state, "p95_ms": self._percentile_ms(95)}
+
+    def _percentile_ms(self, percentile: float):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))] * 1000
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+# プールの空きスレッド数。呼び出しはここで空きを待ってから投入するため、プールのキューには滞留しない
+_hedge_slots = threading.BoundedSemaphore(HEDGE_MAX_WORKERS)
+
+def get_endpoint(name: str) -> Endpoint:
+    with _endpoints_lock:
+        if name not in _endpoints:
+            _endpoints[name] = Endpoint(name)
+        return _endpoints[name]
+
+def get_resilience_stats() -> dict:
+    """エンドポイントごとのカウンターとブレーカーの状態を返す"""
+    with _endpoints_lock:
+        endpoints = list(_endpoints.values())
+    return {endpoint.name: endpoint.stats() for endpoint in endpoints}
+
+def _timed(fn):
+    """関数を呼び出し、(結果, 所要時間) を返す"""
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+def _submit_hedged(fn, started: threading.Event):
+    """空きを確保済みのプールで関数を実行する。所要時間は実行を開始した時点から計る"""
+    def run():
+        try:
+            started.set()
+            return _timed(fn)
+        finally:
+            _hedge_slots.release()
+    return _hedge_executor.submit(run)
+
+def _call_hedged(fn, endpoint: Endpoint):
+    """
+    p95の時間内に応答がなければ同じリクエストをもう1件送り、先に成功した方の (結果, 所要時間) を返す。
+    待ち時間と所要時間はリクエストの実行開始から計るため、空きを待った時間はヘッジの判定にもp95にも含めない。
+    プールに空きがない場合は、待たされるだけのヘッジは送らない。
+    """
+    delay = endpoint.hedge_delay()
+    if delay is None:
+        return _timed(fn)
+    _hedge_slots.acquire()
+    started = threading.Event()
+    primary = _submit_hedged(fn, started)
+    started.wait()
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    if not _hedge_slots.acquire(blocking=False):
+        endpoint.count("hedges_skipped")
+        return primary.result()
+    endpoint.count("hedges")
+    hedge = _submit_hedged(fn, threading.Event())
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    endpoint.count("hedge_wins")
+                return future.result()
+            error = future.exception()
+    raise error
+
+def execute(fn, endpoint: str, limiter=None, hedge: bool = False, max_retries: int = RESILIENCE_MAX_RETRIES, base_delay: float = RESILIENCE_BASE_DELAY, max_delay: float = RESILIENCE_MAX_DELAY):
+    """
+    共通のリクエスト実行層。エンドポイントのサーキットブレーカーを確認してから関数を呼び出し、
+    一時的なエラーは Retry-After または指数バックオフ＋ジッターで再試行する。
+    hedge=True は冪等な呼び出し（検索）専用で、p95を超えて応答がない場合に2件目のリクエストを送る。
+    """
+    ep = get_endpoint(endpoint)
+    for attempt in range(max_retries + 1):
+        if not ep.breaker.allow():
+            ep.count("short_circuits")
+            raise CircuitOpenError(f"{endpoint} へのリクエストが連続して失敗したため、一時的に停止しています。")
+        if limiter:
+            limiter.acquire()
+        ep.count("calls")
+        try:
+            result, elapsed = _call_hedged(fn, ep) if hedge else _timed(fn)
+        except Exception as e:
+            ep.count("failures")
+            retryable = is_retryable(e)
+            if not retryable:
+                # 400番台などの応答はサービス自体が応答している証拠として扱う
+                ep.breaker.record_success()
+            elif ep.breaker.record_failure():
+                ep.count("circuit_opens")
+            if not retryable or attempt == max_retries:
+                raise
+            ep.count("retries")
+            time.sleep(backoff_delay(attempt, e, base_delay, max_delay))
+            continue
+        ep.observe(elapsed)
+        ep.count("successes")
+        ep.breaker.record_success()
+        return result
+
+async def execute_async(coro_fn, endpoint: str, hedge: bool = False, max_retries: int = RESILIENCE_MAX_RETRIES, base_delay: float = RESILIENCE_BASE_DELAY, max_delay: float = RESILIENCE_MAX_DELAY):
+    """execute の非同期版。coro_fn は呼び出すたびに新しいコルーチンを返す関数を渡す"""
+    ep = get_endpoint(endpoint)
+    for attempt in range(max_retries + 1):
+        if not ep.breaker.allow():
+            ep.count("short_circuits")
+            raise CircuitOpenError(f"{endpoint} へのリクエストが連続して失敗したため、一時的に停止しています。")
+        ep.count("calls")
+        t0 = time.perf_counter()
+        try:
+            result = await _call_hedged_async(coro_fn, ep) if hedge else await coro_fn()
+        except Exception as e:
+            ep.count("failures")
+            retryable = is_retryable(e)
+            if not retryable:
+                # 400番台などの応答はサービス自体が応答している証拠として扱う
+                ep.breaker.record_success()
+            elif ep.breaker.record_failure():
+                ep.count("circuit_opens")
+            if not retryable or attempt == max_retries:
+                raise
+            ep.count("retries")
+            await asyncio.sleep(backoff_delay(attempt, e, base_delay, max_delay))
+            continue
+        ep.observe(time.perf_counter() - t0)
+        ep.count("successes")
+        ep.breaker.record_success()
+        return result
+
+async def _call_hedged_async(coro_fn, endpoint: Endpoint):
+    delay = endpoint.hedge_delay()
+    if delay is None:
+        return await coro_fn()
+    primary = asyncio.ensure_future(coro_fn())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    endpoint.count("hedges")
+    hedge = asyncio.ensure_future(coro_fn())
+    pending, error = {primary, hedge}, None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                if task is hedge:
+                    endpoint.count("hedge_wins")
+                return task.result()
+            error = task.exception()
+    raise error
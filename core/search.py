@@ -1,28 +1,41 @@
+import os
 import time
+import asyncio
 import streamlit as st
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from azure.search.documents.models import VectorizedQuery
+from core.cache import get_embedding, get_embeddings
+from core.concurrency import submit_async
+from core.resilience import execute, execute_async, ENDPOINT_SEARCH
+from core.fusion import fuse_results, get_cross_encoder, rerank
+from core.treaty_store import get_treaty_store, fetch_treaty_from_index
 from utils import is_japanese
 
-def perform_search(search_client, aoai_client, embed_model, query_text: str, enable_title_search: bool, mode_override: str = None, match_type_override: str = None, lang_mode_override: str = None) -> tuple[list, str]:
-    """Azure Search を実行する"""
-    t0 = time.perf_counter()
-    
-    mode_now = mode_override if mode_override is not None else st.session_state.get("mode_radio")
-    match_type_now = match_type_override if match_type_override is not None else st.session_state.get("match_type_radio")
-    lang_mode = lang_mode_override if lang_mode_override is not None else st.session_state.get("lang_mode_radio")
-        
+HYBRID_MODE = "ハイブリッド (文字列検索 + あいまい検索)"
+TEXT_MODES = [HYBRID_MODE, "文字列検索のみ"]
+VECTOR_MODES = [HYBRID_MODE, "あいまい検索のみ"]
+BATCH_SEARCH_MAX_WORKERS = int(os.getenv("SEARCH_MAX_CONCURRENCY", "8"))
+FUSION_CANDIDATES = int(os.getenv("SEARCH_FUSION_CANDIDATES", "50"))
+
+def _resolve_search_options(enable_title_search: bool, mode_override: str = None, match_type_override: str = None, lang_mode_override: str = None) -> dict:
+    """サイドバーの設定（session_state）から検索条件を解決する"""
+    options = {
+        "mode": mode_override if mode_override is not None else st.session_state.get("mode_radio"),
+        "match_type": match_type_override if match_type_override is not None else st.session_state.get("match_type_radio"),
+        "lang_mode": lang_mode_override if lang_mode_override is not None else st.session_state.get("lang_mode_radio"),
+        "top": st.session_state.get("topk_slider", 10),
+        "k_nearest": st.session_state.get("kvec_slider", 30),
+        "enable_title_search": enable_title_search,
+        "filter": None,
+        "client_fusion": st.session_state.get("client_fusion_enabled", False),
+        "candidates": st.session_state.get("fusion_candidates_slider", FUSION_CANDIDATES),
+        "weights": [st.session_state.get("text_weight_slider", 1.0), st.session_state.get("vector_weight_slider", 1.0)],
+        "rerank": st.session_state.get("rerank_enabled", False),
+    }
     if enable_title_search:
-        is_ja_q, text_fields, vec_field, mode_now = True, ["jp_title"], "japaneseVector", "文字列検索のみ"
-    else:
-        is_ja_q = is_japanese(query_text) if lang_mode == "言語自動判定" else (lang_mode == "日本語")
-        text_fields, vec_field = (["jp_text"], "japaneseVector") if is_ja_q else (["en_text"], "englishVector")
-    
-    search_q = f'"{query_text.strip()}"' if match_type_now == "完全一致 (Phrase)" else query_text.strip()
-    
-    common_kwargs = dict(select=["en_text", "jp_text", "sourceFile", "line_number", "jp_title", "valid_date"], top=st.session_state.get("topk_slider", 10), include_total_count=True)
-
-    # (日付フィルターのロジックは変更なし)
+        options["mode"] = "文字列検索のみ"
+
     odata_filters = []
     if st.session_state.get("date_filter_enabled", False):
         start_date = st.session_state.get("start_date")
@@ -33,48 +46,234 @@ def perform_search(search_client, aoai_client, embed_model, query_text: str, ena
             date_filter_query = f"valid_date ge {start_date_str} and valid_date le {end_date_str}"
             odata_filters.append(date_filter_query)
     if odata_filters:
-        common_kwargs['filter'] = " and ".join(odata_filters)
-
-    if enable_title_search: 
-        common_kwargs["order_by"] = "line_number asc"
-    
-    search_args = {}
-    if mode_now in ["ハイブリッド (文字列検索 + あいまい検索)", "文字列検索のみ"]:
-        search_args.update({'search_text': search_q, 'search_fields': text_fields, 'highlight_fields': ",".join(text_fields), 'highlight_pre_tag': "<em>", 'highlight_post_tag': "</em>"})
-    
-    if mode_now in ["ハイブリッド (文字列検索 + あいまい検索)", "あいまい検索のみ"]:
+        options["filter"] = " and ".join(odata_filters)
+    return options
+
+def _query_language(query_text: str, options: dict) -> tuple[bool, list, str]:
+    """クエリの言語と検索対象フィールドを判定する"""
+    if options["enable_title_search"]:
+        return True, ["jp_title"], "japaneseVector"
+    lang_mode = options["lang_mode"]
+    is_ja_q = is_japanese(query_text) if lang_mode == "言語自動判定" else (lang_mode == "日本語")
+    text_fields, vec_field = (["jp_text"], "japaneseVector") if is_ja_q else (["en_text"], "englishVector")
+    return is_ja_q, text_fields, vec_field
+
+def _build_search_kwargs(query_text: str, options: dict, emb: list = None) -> dict:
+    """Azure Searchへ渡す引数を組み立てる"""
+    _, text_fields, vec_field = _query_language(query_text, options)
+    mode_now = options["mode"]
+    search_q = f'"{query_text.strip()}"' if options["match_type"] == "完全一致 (Phrase)" else query_text.strip()
+
+    search_kwargs = dict(select=["en_text", "jp_text", "sourceFile", "line_number", "jp_title", "valid_date"], top=options["top"], include_total_count=True)
+    if options["filter"]:
+        search_kwargs['filter'] = options["filter"]
+    if options["enable_title_search"]:
+        search_kwargs["order_by"] = "line_number asc"
+
+    if mode_now in TEXT_MODES:
+        search_kwargs.update({'search_text': search_q, 'search_fields': text_fields, 'highlight_fields': ",".join(text_fields), 'highlight_pre_tag': "<em>", 'highlight_post_tag': "</em>"})
+    if mode_now in VECTOR_MODES and emb is not None:
+        search_kwargs['vector_queries'] = [VectorizedQuery(vector=emb, fields=vec_field, k_nearest_neighbors=options["k_nearest"])]
+    return search_kwargs
+
+def _format_metadata(options: dict, elapsed_ms: float, hits, timings: dict = None) -> str:
+    display_match_type = "完全一致" if options["match_type"] == "完全一致 (Phrase)" else "部分一致"
+    stages = f" ({' / '.join(f'{name} {ms:.1f}' for name, ms in timings.items())})" if timings else ""
+    return f"検索モード: **{options['mode']} ({display_match_type})** | 言語: {options['lang_mode']} | Top={options['top']} | Time: {elapsed_ms:.1f} ms{stages} | Hits: {hits}"
+
+def _uses_client_fusion(options: dict, search_kwargs: dict) -> bool:
+    return options["client_fusion"] and "search_text" in search_kwargs and "vector_queries" in search_kwargs
+
+def _plan_requests(query_text: str, options: dict, emb: list) -> tuple[list[dict], bool]:
+    """
+    検索リクエストの引数のリストと、クライアント側で融合するかを返す。
+    クライアント側融合が有効なハイブリッド検索では、テキスト検索とベクトル検索の候補を別々に多めに取得する。
+    """
+    search_kwargs = _build_search_kwargs(query_text, options, emb)
+    if "search_text" not in search_kwargs and "vector_queries" not in search_kwargs:
+        raise ValueError("検索引数を構築できませんでした。")
+    if not _uses_client_fusion(options, search_kwargs):
+        return [search_kwargs], False
+
+    candidates = max(options["candidates"], options["top"])
+    vector_query = search_kwargs.pop("vector_queries")[0]
+    text_kwargs = dict(search_kwargs, top=candidates)
+    vector_kwargs = {k: v for k, v in search_kwargs.items() if not k.startswith(("search_", "highlight_"))}
+    vector_kwargs.update(top=candidates, vector_queries=[VectorizedQuery(vector=vector_query.vector, fields=vector_query.fields, k_nearest_neighbors=candidates)])
+    return [text_kwargs, vector_kwargs], True
+
+def _finish_search(query_text: str, options: dict, fetched: list[tuple[list, int]], timings: dict, cross_encoder=None) -> tuple[list, int]:
+    """取得した (結果リスト, 総件数) を重み付きRRFで統合し、必要に応じてクロスエンコーダーで並べ替える"""
+    (text_results, text_count), (vector_results, _) = fetched
+    t = time.perf_counter()
+    fused = fuse_results([text_results, vector_results], options["weights"])
+    timings["fuse"] = (time.perf_counter() - t) * 1000
+
+    if cross_encoder is not None:
+        t = time.perf_counter()
+        _, text_fields, _ = _query_language(query_text, options)
+        fused = rerank(cross_encoder, query_text, fused, text_fields[0])
+        timings["rerank"] = (time.perf_counter() - t) * 1000
+
+    # 総件数はテキスト検索の一致件数に、ベクトル検索のみで得られた候補数を加えた概数とする
+    text_keys = {(r.get("sourceFile"), r.get("line_number")) for r in text_results}
+    vector_only = sum(1 for r in vector_results if (r.get("sourceFile"), r.get("line_number")) not in text_keys)
+    return fused[:options["top"]], (text_count or 0) + vector_only
+
+def _run_search(search_client, query_text: str, options: dict, emb: list, timings: dict, cross_encoder=None) -> tuple[list, int]:
+    """検索を実行して (結果リスト, 総件数) を返す。融合する場合は2つの検索を並列に実行する"""
+    requests, fused = _plan_requests(query_text, options, emb)
+
+    def _fetch_once(kwargs):
+        results = search_client.search(**kwargs)
+        return list(results), results.get_count()
+
+    def _fetch(kwargs):
+        # 検索は冪等なため、応答が遅い場合はヘッジリクエストを送る
+        return execute(lambda: _fetch_once(kwargs), ENDPOINT_SEARCH, hedge=True)
+
+    t = time.perf_counter()
+    if not fused:
+        fetched = _fetch(requests[0])
+        timings["search"] = (time.perf_counter() - t) * 1000
+        return fetched
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        fetched = list(executor.map(_fetch, requests))
+    timings["retrieve"] = (time.perf_counter() - t) * 1000
+    return _finish_search(query_text, options, fetched, timings, cross_encoder)
+
+async def _run_search_async(async_search_client, query_text: str, options: dict, emb: list, timings: dict, cross_encoder=None) -> tuple[list, int]:
+    """_run_search の非同期版。azure.search.documents.aio のクライアントで検索を同時に実行する"""
+    requests, fused = _plan_requests(query_text, options, emb)
+
+    async def _fetch_once(kwargs):
+        results = await async_search_client.search(**kwargs)
+        return [r async for r in results], await results.get_count()
+
+    async def _fetch(kwargs):
+        return await execute_async(lambda: _fetch_once(kwargs), ENDPOINT_SEARCH, hedge=True)
+
+    t = time.perf_counter()
+    fetched = await asyncio.gather(*(_fetch(kwargs) for kwargs in requests))
+    timings["retrieve" if fused else "search"] = (time.perf_counter() - t) * 1000
+    if not fused:
+        return fetched[0]
+    # 再ランキングはCPUを使うため、イベントループを塞がないよう別スレッドで実行する
+    return await asyncio.to_thread(_finish_search, query_text, options, fetched, timings, cross_encoder)
+
+def _get_reranker(options: dict):
+    """並べ替えが有効な場合にクロスエンコーダーを取得する（未インストールの場合は警告してNone）"""
+    if not (options["client_fusion"] and options["rerank"]):
+        return None
+    cross_encoder = get_cross_encoder()
+    if cross_encoder is None:
+        st.warning("sentence-transformers がインストールされていないため、再ランキングをスキップしました。")
+    return cross_encoder
+
+def perform_search(search_client, aoai_client, embed_model, query_text: str, enable_title_search: bool, mode_override: str = None, match_type_override: str = None, lang_mode_override: str = None) -> tuple[list, str]:
+    """Azure Search を実行する"""
+    t0 = time.perf_counter()
+    options = _resolve_search_options(enable_title_search, mode_override, match_type_override, lang_mode_override)
+    is_ja_q, _, _ = _query_language(query_text, options)
+
+    timings = {}
+    emb = None
+    if options["mode"] in VECTOR_MODES:
+        t = time.perf_counter()
         try:
-            emb = aoai_client.embeddings.create(model=embed_model, input=[query_text]).data[0].embedding
-            search_args['vector_queries'] = [VectorizedQuery(vector=emb, fields=vec_field, k_nearest_neighbors=st.session_state.get("kvec_slider", 30))]
+            emb = get_embedding(aoai_client, embed_model, query_text)
         except Exception as e: st.warning(f"Embeddingの作成に失敗しました: {e}")
-    
-    if not search_args:
-        st.error("検索引数を構築できませんでした。")
+        timings["embed"] = (time.perf_counter() - t) * 1000
+
+    try:
+        result_list, count = _run_search(search_client, query_text, options, emb, timings, _get_reranker(options))
+    except ValueError as e:
+        st.error(str(e))
         return [], ""
-    
-    results = search_client.search(**common_kwargs, **search_args)
-    result_list = list(results)
-    
-    display_match_type = "完全一致" if match_type_now == "完全一致 (Phrase)" else "部分一致"
-    metadata = f"検索モード: **{mode_now} ({display_match_type})** | 言語: {lang_mode} | Top={common_kwargs['top']} | Time: {(time.perf_counter() - t0) * 1000:.1f} ms | Hits: {results.get_count()}"
-    
+
+    metadata = _format_metadata(options, (time.perf_counter() - t0) * 1000, count, timings)
     st.session_state.is_last_query_ja = is_ja_q
     return result_list, metadata
 
-@st.cache_data(show_spinner="条約全文を取得中...")
-def fetch_full_treaty_text(_search_client, source_file: str) -> list:
-    """指定されたsourceFileの全チャンクを行番号順に取得する"""
+def _prepare_batch_search(aoai_client, embed_model, query_texts: list[str]) -> tuple[dict, object, float, list]:
+    """一括検索の共通準備として、検索条件・クロスエンコーダー・埋め込み（1回のバッチAPI呼び出し）を用意する"""
+    # session_stateはワーカースレッドから参照できないため、条件は呼び出し元スレッドで解決しておく
+    options = _resolve_search_options(enable_title_search=False)
+    cross_encoder = _get_reranker(options)
+    # ハイライト・翻訳ボタンの表示に使う言語は、一括検索では過半数の文の言語とする
+    ja_count = sum(_query_language(text, options)[0] for text in query_texts)
+    st.session_state.is_last_query_ja = ja_count * 2 > len(query_texts)
+
+    embed_ms = 0.0
+    embeddings = [None] * len(query_texts)
+    if options["mode"] in VECTOR_MODES and query_texts:
+        t = time.perf_counter()
+        try:
+            embeddings = get_embeddings(aoai_client, embed_model, query_texts)
+        except Exception as e: st.warning(f"Embeddingの作成に失敗しました: {e}")
+        embed_ms = (time.perf_counter() - t) * 1000
+    return options, cross_encoder, embed_ms, embeddings
+
+def _yield_completed(futures: dict):
+    """完了した順に (インデックス, 結果リスト, メタデータ, エラー) を返す"""
+    for future in as_completed(futures):
+        idx = futures[future]
+        try:
+            result_list, metadata = future.result()
+            yield idx, result_list, metadata, None
+        except Exception as e:
+            yield idx, None, "", e
+
+def perform_batch_search(search_client, aoai_client, embed_model, query_texts: list[str], max_workers: int = BATCH_SEARCH_MAX_WORKERS):
+    """
+    複数の文をまとめて検索し、完了した順に (インデックス, 結果リスト, メタデータ, エラー) を返すジェネレーター。
+    埋め込みは1回のバッチAPI呼び出しで作成し、検索はスレッドプールで並列に実行する。
+    """
+    t0 = time.perf_counter()
+    options, cross_encoder, embed_ms, embeddings = _prepare_batch_search(aoai_client, embed_model, query_texts)
+
+    def _run(query_text: str, emb: list) -> tuple[list, str]:
+        timings = {"embed": embed_ms} if embed_ms else {}
+        result_list, count = _run_search(search_client, query_text, options, emb, timings, cross_encoder)
+        return result_list, _format_metadata(options, (time.perf_counter() - t0) * 1000, count, timings)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(_run, text, emb): idx for idx, (text, emb) in enumerate(zip(query_texts, embeddings))}
+        yield from _yield_completed(futures)
+
+def perform_batch_search_async(async_search_client, aoai_client, embed_model, query_texts: list[str], max_concurrency: int = BATCH_SEARCH_MAX_WORKERS):
+    """
+    perform_batch_search の非同期クライアント版。検索は共有イベントループ上で同時実行数を制限して実行し、
+    リクエストごとにスレッドを使わない。戻り値の形式は perform_batch_search と同じ。
+    """
+    t0 = time.perf_counter()
+    options, cross_encoder, embed_ms, embeddings = _prepare_batch_search(aoai_client, embed_model, query_texts)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(query_text: str, emb: list) -> tuple[list, str]:
+        async with semaphore:
+            timings = {"embed": embed_ms} if embed_ms else {}
+            result_list, count = await _run_search_async(async_search_client, query_text, options, emb, timings, cross_encoder)
+            return result_list, _format_metadata(options, (time.perf_counter() - t0) * 1000, count, timings)
+
+    futures = {submit_async(_run(text, emb)): idx for idx, (text, emb) in enumerate(zip(query_texts, embeddings))}
+    yield from _yield_completed(futures)
+
+def fetch_full_treaty_text(search_client, source_file: str) -> list:
+    """
+    指定されたsourceFileの全行を行番号順に取得する。
+    ローカルの条約ストアにあればそこから読み込み、なければ検索インデックスから取得してストアに保存する。
+    """
+    store = get_treaty_store()
     try:
-        escaped_source_file = source_file.replace("'", "''")
-        odata_filter = f"sourceFile eq '{escaped_source_file}'"
-        results = _search_client.search(
-            search_text="*",
-            filter=odata_filter,
-            order_by=["line_number asc"],
-            select=["en_text", "jp_text", "line_number"],
-            top=2000
-        )
-        return list(results)
+        if store.get_treaty(source_file) is None:
+            with st.spinner("条約全文を取得中..."):
+                meta, lines = fetch_treaty_from_index(search_client, source_file)
+            if not lines:
+                return []
+            store.replace_treaty(meta, lines)
+        return list(store.iter_lines(source_file))
     except Exception as e:
         st.error(f"条約全文の取得中にエラーが発生しました: {e}")
         return []
\ No newline at end of file
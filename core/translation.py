@@ -1,8 +1,34 @@
+import os
 import re
+import time
+from functools import lru_cache
 import streamlit as st
+from core.cache import TranslationCache, get_translation_cache
+from core.concurrency import TokenBucket, run_concurrently, AOAI_MAX_CONCURRENCY, AOAI_REQUESTS_PER_MINUTE
+from core.resilience import execute, ENDPOINT_CHAT
+from core.prompt_budget import fit_references, record_usage, format_usage, TRANSLATION_CONTEXT_TOKEN_BUDGET
+
+MAX_RETRIES = 3
+SCORE_THRESHOLD = 0.9
+BEST_OF_N_CANDIDATES = int(os.getenv("TRANSLATION_BEST_OF_N", "3"))
+BEST_OF_N_TEMPERATURES = [0.0, 0.3, 0.6, 0.9]
+# ストリーミング時に最終チャンクでトークン使用量を受け取るか（stream_options に未対応のAPIバージョンでは無効にする）
+STREAM_INCLUDE_USAGE = os.getenv("AOAI_STREAM_USAGE", "true").lower() in ("1", "true", "yes")
+
+EMPTY_TRANSLATION = "翻訳結果を取得できませんでした。"
+
+STRATEGY_SEQUENTIAL = "逐次再試行"
+STRATEGY_BEST_OF_N = "ベストオブN (並列生成)"
 
 def evaluate_translation(aoai_client, gpt_model, original_text: str, translated_text: str) -> float:
     """翻訳の品質を評価し、0.0から1.0のスコアを返す。"""
+    score, message = _score_translation(aoai_client, gpt_model, original_text, translated_text)
+    if message:
+        st.warning(message)
+    return score
+
+def _score_translation(aoai_client, gpt_model, original_text: str, translated_text: str, limiter: TokenBucket = None) -> tuple[float, str]:
+    """翻訳の品質を評価し、(スコア, 警告メッセージ) を返す内部関数。画面には何も出力しない。"""
     system_prompt = "あなたは、翻訳品質を厳格に評価する専門家です。与えられた指示に従い、評価スコアのみを出力してください。"
     user_prompt = f"""以下の英語原文と日本語訳を比較し、翻訳の品質を評価してください。
 
@@ -26,7 +52,7 @@ def evaluate_translation(aoai_client, gpt_model, original_text: str, translated_
 Score:
 """
     try:
-        response = aoai_client.chat.completions.create(
+        response = execute(lambda: aoai_client.chat.completions.create(
             model=gpt_model,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -34,51 +60,39 @@ Score:
             ],
             temperature=0.0,
             max_tokens=10,
-        )
+        ), ENDPOINT_CHAT, limiter=limiter)
+        record_usage("翻訳評価", getattr(response, "usage", None))
         result_text = response.choices[0].message.content or ""
         match = re.search(r"([0-9.]+)", result_text)
         if match:
-            return float(match.group(1))
-        st.warning(f"翻訳スコアの解析に失敗しました。レスポンス: '{result_text}'")
-        return 0.0
+            return float(match.group(1)), None
+        return 0.0, f"翻訳スコアの解析に失敗しました。レスポンス: '{result_text}'"
     except Exception as e:
-        st.error(f"翻訳評価中にエラーが発生しました: {e}")
-        return 0.0
+        return 0.0, f"翻訳評価中にエラーが発生しました: {e}"
 
 
-def _get_single_translation(aoai_client, gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, previous_translation: str = None) -> str:
-    """指定された英文を翻訳する内部関数。"""
-    system_prompt = "あなたは、外務省の優秀な翻訳官です。条約のような、法的拘束力を持つ厳格な文書の翻訳を専門としています。与えられた指示に一字一句正確に従ってください。"
-    
-    glossary_instruction = ""
-    if glossary:
-        glossary_items = "\n".join([f"- `{en}` -> `{ja}`" for en, ja in glossary.items()])
-        glossary_instruction = f"""## 用語集（最優先）
-下記の用語集を**必ず**使用し、指定通りの日本語訳を適用してください。
-{glossary_items}
+@lru_cache(maxsize=1)
+def _translation_system_prompt() -> str:
+    """
+    翻訳プロンプトの静的な先頭部分（役割・指示・例文）を組み立てる。
+    毎回同一の文字列を先頭に置くことで、プロバイダー側のプロンプトキャッシュが効くようにする。
+    """
+    role = "あなたは、外務省の優秀な翻訳官です。条約のような、法的拘束力を持つ厳格な文書の翻訳を専門としています。与えられた指示に一字一句正確に従ってください。"
+    syntax_example_en = "RECOGNISING the previous activities carried out by the GIF under the Framework Agreement for International Collaboration on Research and Development of Generation IV Nuclear Energy Systems, done at Washington on 28 February 2005, as extended by the Agreement to Extend the Framework Agreement, which entered into force on 26 February 2015 (hereinafter referred to as the ‘2005 GIF Framework Agreement’), which expires on 28 February 2025..."
+    syntax_example_jp = "二千二十五年二月二十八日に期間満了する、二千五年二月二十八日にワシントンで作成された第4世代原子力システムの研究開発に関する国際協力のための枠組み協定であって、二千十五年二月二十六日に発効した同協定を延長する協定により延長されたもの（以下「二千五年GIF枠組み協定」という。）の下でGIFが実施したこれまでの活動...を認識し、"
+    format_example_en = "The total amount of the Debts will be five hundred and thirty-eight million nine hundred and seven thousand one hundred and forty-two yen (\\7,933,321,265) on December 8, 2025."
+    format_example_jp = "債務の総額は、二千二十五年十二月八日に、七十九億三千三百三十二万千二百六十五円（七、九三三、三二一、二六五円）になる。"
+    return f"""{role}
 
-"""
-    
-    instruction = f"""{glossary_instruction}1.  下記の各例文を**最優先の模範**とし、その構造と書式を厳密に模倣してください。
+あなたは、提供された参照情報に基づき、指定された英文を翻訳する任務を負っています。
+## 指示
+1.  下記の各例文を**最優先の模範**とし、その構造と書式を厳密に模倣してください。ただし、用語集が指定された場合は用語集を最優先します。
 2.  **最重要**: 複雑な修飾語句がどの名詞に係るのか（係り受け）を正確に反映してください。
 3.  **書式ルール**:
     - **日付**: `2005年`は`二千〇五年`ではなく`二千五年`のように、公文書として一般的な漢数字で表記してください。`2000年`は`二千年`とします。
     - **金額**: `七十九億...円（七、九三三、...円）`のように、**位取りを含んだ漢数字**と、括弧書きで**カンマ区切りのアラビア数字**を必ず併記してください。
 4.  参照情報（英語原文と現在の日本語訳）の文体や用語を最大限に尊重し、`<translate_this>`内の英文のみを翻訳します。
-5.  最終的な翻訳結果の**本文のみ**を出力してください。解説や`<answer>`のようなタグは一切含めないでください。"""
-    
-    if previous_translation:
-        instruction = f"""以前の翻訳には誤りがありました。
-<previous_bad_translation>{previous_translation}</previous_bad_translation>
-この誤りを厳密に修正し、下記の指示と例文に合致する、より正確で自然な翻訳を生成してください。\n\n""" + instruction
-    
-    syntax_example_en = "RECOGNISING the previous activities carried out by the GIF under the Framework Agreement for International Collaboration on Research and Development of Generation IV Nuclear Energy Systems, done at Washington on 28 February 2005, as extended by the Agreement to Extend the Framework Agreement, which entered into force on 26 February 2015 (hereinafter referred to as the ‘2005 GIF Framework Agreement’), which expires on 28 February 2025..."
-    syntax_example_jp = "二千二十五年二月二十八日に期間満了する、二千五年二月二十八日にワシントンで作成された第4世代原子力システムの研究開発に関する国際協力のための枠組み協定であって、二千十五年二月二十六日に発効した同協定を延長する協定により延長されたもの（以下「二千五年GIF枠組み協定」という。）の下でGIFが実施したこれまでの活動...を認識し、"
-    format_example_en = "The total amount of the Debts will be five hundred and thirty-eight million nine hundred and seven thousand one hundred and forty-two yen (\\7,933,321,265) on December 8, 2025."
-    format_example_jp = "債務の総額は、二千二十五年十二月八日に、七十九億三千三百三十二万千二百六十五円（七、九三三、三二一、二六五円）になる。"
-    user_prompt = f"""あなたは、提供された参照情報に基づき、指定された英文を翻訳する任務を負っています。
-## 指示
-{instruction}
+5.  最終的な翻訳結果の**本文のみ**を出力してください。解説や`<answer>`のようなタグは一切含めないでください。
 ---
 ## 例文1: 複雑な構文
 <example>
@@ -93,44 +107,191 @@ def _get_single_translation(aoai_client, gpt_model, text_to_translate: str, cont
     <context_jp>{format_example_jp}</context_jp>
     <translate_this>The total amount will be five hundred and thirty-eight million yen (\\538,000,000).</translate_this>
     <answer>債務の総額は、五億三千八百万円（五三八、〇〇〇、〇〇〇円）になる。</answer>
-</example>
----
-## あなたのタスク (Your Task)
+</example>"""
+
+def _build_translation_messages(text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, previous_translation: str = None) -> list[dict]:
+    """翻訳用のプロンプト（メッセージ列）を組み立てる内部関数。呼び出しごとに変わる部分はユーザーメッセージにまとめる。"""
+    sections = []
+    if glossary:
+        glossary_items = "\n".join([f"- `{en}` -> `{ja}`" for en, ja in glossary.items()])
+        sections.append(f"""## 用語集（最優先）
+下記の用語集を**必ず**使用し、指定通りの日本語訳を適用してください。
+{glossary_items}""")
+    if previous_translation:
+        sections.append(f"""## 以前の翻訳の修正
+以前の翻訳には誤りがありました。
+<previous_bad_translation>{previous_translation}</previous_bad_translation>
+この誤りを厳密に修正し、指示と例文に合致する、より正確で自然な翻訳を生成してください。""")
+    sections.append(f"""## あなたのタスク (Your Task)
 <task>
     <context_en>{context_english}</context_en>
     <context_jp>{context_japanese}</context_jp>
     <translate_this>{text_to_translate}</translate_this>
     <answer>
 </task>
-"""
+""")
+    return [{"role": "system", "content": _translation_system_prompt()}, {"role": "user", "content": "\n\n".join(sections)}]
+
+def build_translation_context(references: list[dict], budget: int = TRANSLATION_CONTEXT_TOKEN_BUDGET) -> tuple[str, str, int]:
+    """
+    選択された参照文をトークン予算内に収めて翻訳の参照情報を作り、(英語, 日本語, 除外した件数) を返す。
+    参照文は選択時の並び順（検索順位）を優先度として扱う。
+    """
+    kept, dropped = fit_references(references, budget)
+    context_english = "\\n\\n---\\n\\n".join([r.get("en_text", "") for r in kept])
+    context_japanese = "\\n\\n---\\n\\n".join([r.get("jp_text", "") for r in kept])
+    return context_english, context_japanese, dropped
+
+def _get_single_translation(aoai_client, gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, previous_translation: str = None, temperature: float = 0.0, usage: dict = None, limiter: TokenBucket = None) -> str:
+    """指定された英文を翻訳する内部関数。usage を指定すると、この呼び出しのトークン使用量を書き込む。"""
+    messages = _build_translation_messages(text_to_translate, context_english, context_japanese, glossary, previous_translation)
     try:
-        response = aoai_client.chat.completions.create(model=gpt_model, messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}], temperature=0.0, stop=["</answer>"])
-        return (response.choices[0].message.content or "翻訳結果を取得できませんでした。").strip()
+        response = execute(lambda: aoai_client.chat.completions.create(model=gpt_model, messages=messages, temperature=temperature, stop=["</answer>"]), ENDPOINT_CHAT, limiter=limiter)
+        entry = record_usage("翻訳", getattr(response, "usage", None))
+        if usage is not None:
+            usage.update(entry)
+        return (response.choices[0].message.content or EMPTY_TRANSLATION).strip()
     except Exception as e:
         return f"翻訳中にエラーが発生しました: {e}"
 
-@st.cache_data(show_spinner=False)
-def get_translation_with_retry(_aoai_client, _gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict) -> tuple[str, float]:
-    """自己評価と再試行を伴う翻訳処理"""
-    MAX_RETRIES, SCORE_THRESHOLD, best_translation, best_score = 3, 0.9, "", -1.0
+def _stream_single_translation(aoai_client, gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, previous_translation: str = None, timings: dict = None):
+    """指定された英文の翻訳をストリーミングで受け取り、トークンを順次返すジェネレーター。"""
+    timings = timings if timings is not None else {}
+    messages = _build_translation_messages(text_to_translate, context_english, context_japanese, glossary, previous_translation)
+    t0 = time.perf_counter()
+    try:
+        # 再試行できるのはストリームの開始までで、受信途中のエラーはそのまま失敗として扱う
+        stream_options = {"stream_options": {"include_usage": True}} if STREAM_INCLUDE_USAGE else {}
+        stream = execute(lambda: aoai_client.chat.completions.create(model=gpt_model, messages=messages, temperature=0.0, stop=["</answer>"], stream=True, **stream_options), ENDPOINT_CHAT)
+        for chunk in stream:
+            # include_usage を指定すると、最後に choices が空で usage のみを含むチャンクが届く
+            if getattr(chunk, "usage", None):
+                timings.update(record_usage("翻訳", chunk.usage))
+            # Azureではコンテンツフィルター結果のみのチャンク（choicesが空）が届くことがある
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            timings.setdefault("ttft_ms", (time.perf_counter() - t0) * 1000)
+            yield chunk.choices[0].delta.content
+    except Exception as e:
+        timings["error"] = f"翻訳中にエラーが発生しました: {e}"
+    finally:
+        timings["total_ms"] = (time.perf_counter() - t0) * 1000
+
+def _run_streaming_attempt(aoai_client, gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, previous_translation: str, container) -> tuple[str, dict]:
+    """1回分の翻訳をコンテナにストリーミング表示し、(翻訳, 計測値) を返す。"""
+    timings = {}
+    with container:
+        streamed = st.write_stream(_stream_single_translation(aoai_client, gpt_model, text_to_translate, context_english, context_japanese, glossary, previous_translation, timings))
+    if "error" in timings:
+        return timings["error"], timings
+    translation = (streamed if isinstance(streamed, str) else "".join(map(str, streamed))).strip()
+    return translation or EMPTY_TRANSLATION, timings
+
+def _translate_with_corrective_retry(aoai_client, gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, stream_container=None, attempt_log: list = None, best_translation: str = "", best_score: float = -1.0) -> tuple[str, float, bool]:
+    """前回の翻訳を修正させながら順番に再試行する。(翻訳, スコア, 成功したか) を返す"""
+    for i in range(MAX_RETRIES):
+        previous_translation = best_translation or None
+        if stream_container is not None:
+            stream_container.caption(f"試行 {i+1}/{MAX_RETRIES}")
+            current_translation, timings = _run_streaming_attempt(aoai_client, gpt_model, text_to_translate, context_english, context_japanese, glossary, previous_translation, stream_container)
+        else:
+            with st.spinner(f"翻訳を生成中... (試行 {i+1}/{MAX_RETRIES})"):
+                t0 = time.perf_counter()
+                usage = {}
+                current_translation = _get_single_translation(aoai_client, gpt_model, text_to_translate, context_english, context_japanese, glossary, previous_translation, usage=usage)
+                timings = {"total_ms": (time.perf_counter() - t0) * 1000, **usage}
+        if "翻訳中にエラーが発生しました" in current_translation:
+            return current_translation, 0.0, False
+
+        # ストリームが閉じた直後に評価を開始する
+        current_score = evaluate_translation(aoai_client, gpt_model, text_to_translate, current_translation)
+        attempt = {"attempt": i + 1, "score": current_score, **{k: v for k, v in timings.items() if k != "error"}}
+        if attempt_log is not None:
+            attempt_log.append(attempt)
+        if stream_container is not None:
+            stream_container.caption(format_attempt_metrics(attempt))
+        else:
+            st.write(f"試行 {i+1}: スコア = {current_score:.2f}, 翻訳 = '{current_translation}'")
+
+        if current_score > best_score:
+            best_score, best_translation = current_score, current_translation
+        if best_score >= SCORE_THRESHOLD:
+            st.write(f"品質基準 ({SCORE_THRESHOLD}) を満たしました。")
+            break
+    return best_translation, best_score, True
+
+def _translate_best_of_n(aoai_client, gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, n_candidates: int, attempt_log: list = None) -> tuple[str, float, bool]:
+    """温度を変えた候補を並列に生成・評価し、最もスコアの高い候補を返す。(翻訳, スコア, 成功したか) を返す"""
+    temperatures = [BEST_OF_N_TEMPERATURES[k % len(BEST_OF_N_TEMPERATURES)] for k in range(max(1, n_candidates))]
+    # 生成と評価の呼び出しを共通のレートリミッターで平準化し、並列実行時のスロットリングを避ける
+    limiter = TokenBucket(AOAI_REQUESTS_PER_MINUTE / 60.0, capacity=AOAI_MAX_CONCURRENCY)
+
+    def _generate_and_score(temperature: float) -> dict:
+        t0 = time.perf_counter()
+        usage = {}
+        translation = _get_single_translation(aoai_client, gpt_model, text_to_translate, context_english, context_japanese, glossary, temperature=temperature, usage=usage, limiter=limiter)
+        if "翻訳中にエラーが発生しました" in translation:
+            return {"translation": translation, "score": 0.0, "error": translation}
+        score, message = _score_translation(aoai_client, gpt_model, text_to_translate, translation, limiter=limiter)
+        return {"translation": translation, "score": score, "message": message, "total_ms": (time.perf_counter() - t0) * 1000, "usage": usage}
+
+    candidates = [None] * len(temperatures)
+    with st.spinner(f"翻訳候補を{len(temperatures)}件並列に生成中..."):
+        for k, candidate in run_concurrently(_generate_and_score, temperatures, max_workers=min(len(temperatures), AOAI_MAX_CONCURRENCY)):
+            candidates[k] = candidate
+
+    valid = [(k, c) for k, c in enumerate(candidates) if "error" not in c]
+    if not valid:
+        return candidates[0]["error"], 0.0, False
+    for k, c in valid:
+        if c.get("message"):
+            st.warning(c["message"])
+        attempt = {"attempt": k + 1, "label": f"候補 {k+1} (temperature={temperatures[k]})", "score": c["score"], "total_ms": c["total_ms"], **c["usage"]}
+        if attempt_log is not None:
+            attempt_log.append(attempt)
+        st.write(f"{attempt['label']}: スコア = {c['score']:.2f}, 翻訳 = '{c['translation']}'")
+    _, best = max(valid, key=lambda item: item[1]["score"])
+    return best["translation"], best["score"], True
+
+def get_translation_with_retry(_aoai_client, _gpt_model, text_to_translate: str, context_english: str, context_japanese: str, glossary: dict, stream_container=None, attempt_log: list = None, strategy: str = STRATEGY_SEQUENTIAL, n_candidates: int = BEST_OF_N_CANDIDATES) -> tuple[str, float]:
+    """
+    自己評価と再試行を伴う翻訳処理。
+    stream_container を指定すると、各試行の翻訳をトークン単位でストリーミング表示する。
+    attempt_log を指定すると、試行ごとのスコアと所要時間 (TTFT・合計) を追記する。
+    strategy に STRATEGY_BEST_OF_N を指定すると、n_candidates 件の候補を並列に生成・評価し、
+    全候補が SCORE_THRESHOLD を下回った場合のみ最良候補を起点に修正再試行を行う。
+    """
     if not _gpt_model: 
         return "翻訳機能に必要なGPTモデルのデプロイ名が設定されていません。", 0.0
 
     if glossary:
         st.info(f"選択された用語を適用します: {glossary}")
 
-    for i in range(MAX_RETRIES):
-        with st.spinner(f"翻訳を生成中... (試行 {i+1}/{MAX_RETRIES})"):
-            current_translation = _get_single_translation(_aoai_client, _gpt_model, text_to_translate, context_english, context_japanese, glossary, best_translation if i > 0 else None)
-            if "翻訳中にエラーが発生しました" in current_translation: 
-                return current_translation, 0.0
-            
-            current_score = evaluate_translation(_aoai_client, _gpt_model, text_to_translate, current_translation)
-            st.write(f"試行 {i+1}: スコア = {current_score:.2f}, 翻訳 = '{current_translation}'")
-            
-            if current_score > best_score:
-                best_score, best_translation = current_score, current_translation
-            if best_score >= SCORE_THRESHOLD:
-                st.write(f"品質基準 ({SCORE_THRESHOLD}) を満たしました。")
-                break
-    return best_translation, best_score
\ No newline at end of file
+    # 同じ原文・参照文・用語集での翻訳結果は永続キャッシュから返す
+    translation_cache = get_translation_cache()
+    cache_key = TranslationCache.make_key(_gpt_model, text_to_translate, context_english, context_japanese, glossary)
+    if cached := translation_cache.get(cache_key):
+        st.write(f"キャッシュ済みの翻訳結果を使用します (スコア = {cached[1]:.2f})")
+        return cached
+
+    if strategy == STRATEGY_BEST_OF_N:
+        best_translation, best_score, ok = _translate_best_of_n(_aoai_client, _gpt_model, text_to_translate, context_english, context_japanese, glossary, n_candidates, attempt_log)
+        if ok and best_score < SCORE_THRESHOLD:
+            st.write(f"全ての候補が品質基準 ({SCORE_THRESHOLD}) を下回ったため、最良の候補を修正します。")
+            best_translation, best_score, ok = _translate_with_corrective_retry(_aoai_client, _gpt_model, text_to_translate, context_english, context_japanese, glossary, stream_container, attempt_log, best_translation, best_score)
+    else:
+        best_translation, best_score, ok = _translate_with_corrective_retry(_aoai_client, _gpt_model, text_to_translate, context_english, context_japanese, glossary, stream_container, attempt_log)
+    if not ok:
+        return best_translation, 0.0
+
+    # 評価に失敗した結果（スコア0.0）や空の応答はキャッシュしない
+    if best_translation and best_translation != EMPTY_TRANSLATION and best_score > 0:
+        translation_cache.put(cache_key, _gpt_model, best_translation, best_score)
+    return best_translation, best_score
+
+def format_attempt_metrics(attempt: dict) -> str:
+    """試行ごとのスコアと所要時間を表示用の文字列にする"""
+    ttft = f" | TTFT: {attempt['ttft_ms']:.0f} ms" if "ttft_ms" in attempt else ""
+    label = attempt.get("label") or f"試行 {attempt['attempt']}"
+    usage = f" | {format_usage(attempt)}" if "prompt_tokens" in attempt else ""
+    return f"{label}: スコア = {attempt['score']:.2f}{ttft} | 合計: {attempt.get('total_ms', 0):.0f} ms{usage}"
\ No newline at end of file
@@ -0,0 +1,171 @@
+import os
+import time
+import sqlite3
+import threading
+import streamlit as st
+from core.resilience import execute, ENDPOINT_SEARCH_EXPORT
+
+TREATY_STORE_PATH = os.getenv("TREATY_STORE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(os.getenv("DATABASE_PATH") or "glossary.db")), "treaties.db"
+)
+TREATY_PAGE_SIZE = int(os.getenv("TREATY_PAGE_SIZE", "1000"))
+
+class TreatyStore:
+    """条約本文を (sourceFile, line_number) をキーとしてローカルのSQLiteに保持するストア"""
+
+    def __init__(self, db_path: str = TREATY_STORE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS treaties (
+                source_file TEXT PRIMARY KEY,
+                jp_title TEXT,
+                valid_date TEXT,
+                line_count INTEGER NOT NULL,
+                synced_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS treaty_lines (
+                source_file TEXT NOT NULL,
+                line_number INTEGER NOT NULL,
+                en_text TEXT,
+                jp_text TEXT,
+                PRIMARY KEY (source_file, line_number)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS line_alignments (
+                source_file TEXT NOT NULL,
+                line_number INTEGER NOT NULL,
+                spans BLOB NOT NULL,
+                PRIMARY KEY (source_file, line_number)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    def list_treaties(self) -> list[str]:
+        """同期済みの sourceFile の一覧を返す"""
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT source_file FROM treaties ORDER BY source_file")]
+
+    def get_treaty(self, source_file: str):
+        """条約のメタデータ（条約名・効力発生日・行数）を返す。未同期の場合はNoneを返す"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_file, jp_title, valid_date, line_count FROM treaties WHERE source_file = ?", (source_file,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"sourceFile": row[0], "jp_title": row[1], "valid_date": row[2], "line_count": row[3]}
+
+    def fetch_lines(self, source_file: str, after_line: int = None, limit: int = TREATY_PAGE_SIZE) -> list[dict]:
+        """行番号順に1ページ分の行を返す（after_line より後の行から）"""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT line_number, en_text, jp_text FROM treaty_lines
+                   WHERE source_file = ? AND line_number > ? ORDER BY line_number LIMIT ?""",
+                (source_file, after_line if after_line is not None else -1, limit)
+            ).fetchall()
+        return [{"line_number": r[0], "en_text": r[1], "jp_text": r[2]} for r in rows]
+
+    def iter_lines(self, source_file: str, page_size: int = TREATY_PAGE_SIZE):
+        """条約の全行をページ単位で読み出すジェネレーター"""
+        after_line = None
+        while page := self.fetch_lines(source_file, after_line, page_size):
+            yield from page
+            after_line = page[-1]["line_number"]
+
+    def replace_treaty(self, meta: dict, lines: list[dict]):
+        """条約1件分のメタデータと全行を置き換える"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM treaty_lines WHERE source_file = ?", (meta["sourceFile"],))
+            # 本文が変わると句の対応も無効になるため合わせて削除する
+            self._conn.execute("DELETE FROM line_alignments WHERE source_file = ?", (meta["sourceFile"],))
+            self._conn.executemany(
+                "INSERT INTO treaty_lines (source_file, line_number, en_text, jp_text) VALUES (?, ?, ?, ?)",
+                [(meta["sourceFile"], line["line_number"], line.get("en_text", ""), line.get("jp_text", "")) for line in lines]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO treaties (source_file, jp_title, valid_date, line_count, synced_at) VALUES (?, ?, ?, ?, ?)",
+                (meta["sourceFile"], meta.get("jp_title", ""), meta.get("valid_date"), len(lines), time.time())
+            )
+
+    def invalidate(self, source_files: list[str]) -> int:
+        """
+        条約のメタデータ・全行・句の対応を削除し、削除した条約数を返す。
+        再インデックスで内容が変わった条約は、次に表示するときに検索インデックスから取得し直される。
+        """
+        keys = [(source_file,) for source_file in source_files]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM treaty_lines WHERE source_file = ?", keys)
+            self._conn.executemany("DELETE FROM line_alignments WHERE source_file = ?", keys)
+            return self._conn.executemany("DELETE FROM treaties WHERE source_file = ?", keys).rowcount
+
+    def put_alignments(self, source_file: str, alignments: list[tuple[int, bytes]]):
+        """条約1件分の行ごとの句の対応（pack_alignment で変換したバイト列）を置き換える"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM line_alignments WHERE source_file = ?", (source_file,))
+            self._conn.executemany(
+                "INSERT INTO line_alignments (source_file, line_number, spans) VALUES (?, ?, ?)",
+                [(source_file, line_number, spans) for line_number, spans in alignments]
+            )
+
+    def get_alignments(self, keys: list[tuple[str, int]]) -> dict:
+        """(sourceFile, line_number) の組に対する句の対応のバイト列をまとめて取得する"""
+        keys = [k for k in dict.fromkeys(keys) if k[0] and k[1] is not None]
+        if not keys:
+            return {}
+        placeholders = ",".join(["(?, ?)"] * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source_file, line_number, spans FROM line_alignments WHERE (source_file, line_number) IN (VALUES {placeholders})",
+                [v for key in keys for v in key]
+            ).fetchall()
+        return {(r[0], r[1]): r[2] for r in rows}
+
+@st.cache_resource
+def get_treaty_store() -> TreatyStore:
+    """条約ストアを初期化して返す"""
+    return TreatyStore()
+
+def fetch_treaty_from_index(search_client, source_file: str, page_size: int = TREATY_PAGE_SIZE) -> tuple[dict, list[dict]]:
+    """検索インデックスから条約の全行を行番号のキーセットページングで取得する（行数の上限なし）"""
+    escaped_source_file = source_file.replace("'", "''")
+    meta, lines, last_line = {"sourceFile": source_file}, [], None
+    while True:
+        odata_filter = f"sourceFile eq '{escaped_source_file}'"
+        if last_line is not None:
+            odata_filter += f" and line_number gt {last_line}"
+        page = execute(lambda: list(search_client.search(
+            search_text="*",
+            filter=odata_filter,
+            order_by=["line_number asc"],
+            select=["en_text", "jp_text", "line_number", "jp_title", "valid_date"],
+            top=page_size
+        )), ENDPOINT_SEARCH_EXPORT)
+        if not page:
+            break
+        if last_line is None:
+            meta.update(jp_title=page[0].get("jp_title", ""), valid_date=page[0].get("valid_date"))
+        lines.extend({"line_number": r["line_number"], "en_text": r.get("en_text", ""), "jp_text": r.get("jp_text", "")} for r in page)
+        last_line = page[-1]["line_number"]
+        if len(page) < page_size:
+            break
+    return meta, lines
+
+def list_source_files(search_client) -> list[str]:
+    """検索インデックスに含まれる sourceFile の一覧をファセットで取得する"""
+    results = execute(lambda: search_client.search(search_text="*", facets=["sourceFile,count:100000"], top=0), ENDPOINT_SEARCH_EXPORT)
+    return sorted(f["value"] for f in (results.get_facets() or {}).get("sourceFile", []))
+
+def sync_treaty_store(search_client, store: TreatyStore, source_files: list[str] = None, on_progress=None) -> int:
+    """検索インデックスの条約本文をローカルストアへ同期し、同期した条約数を返す"""
+    source_files = source_files or list_source_files(search_client)
+    for i, source_file in enumerate(source_files, start=1):
+        meta, lines = fetch_treaty_from_index(search_client, source_file)
+        if lines:
+            store.replace_treaty(meta, lines)
+        if on_progress:
+            on_progress(i, len(source_files), source_file, len(lines))
+    return len(source_files)
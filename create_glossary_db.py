@@ -1,4 +1,5 @@
 import sqlite3
+from core.glossary_schema import migrate_glossary_schema
 
 # データベースに接続（ファイルが存在しない場合は新規作成される）
 conn = sqlite3.connect('glossary.db')
@@ -13,6 +14,12 @@ CREATE TABLE IF NOT EXISTS terms (
 )
 ''')
 
+# インデックスと全文検索用テーブルを作成
+if migrate_glossary_schema(conn):
+    print("インデックスと全文検索テーブル (FTS5) を作成しました。")
+else:
+    print("FTS5 が利用できないため、インデックスのみ作成しました。")
+
 # 例として対訳データを挿入
 try:
     cursor.execute("INSERT INTO terms (english_term, japanese_term) VALUES (?, ?)",
@@ -0,0 +1,40 @@
+import os
+import numpy as np
+import pytest
+import core.local_search as local_search
+from core.local_search import _VectorField, build_local_index
+
+NUM_DOCS, DIM, NLIST = 300, 16, 4
+
+@pytest.fixture
+def ivf_index_dir(tmp_path, monkeypatch):
+    """IVFを作成する件数の閾値を下げて、小さなコーパスでIVF付きのインデックスを作る"""
+    monkeypatch.setattr(local_search, "LOCAL_SEARCH_IVF_MIN_DOCS", 1)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(NUM_DOCS, DIM)).astype(np.float32)
+    documents = ({"sourceFile": "a.csv", "line_number": i + 1, "englishVector": v.tolist()} for i, v in enumerate(vectors))
+    build_local_index(documents, str(tmp_path), nlist=NLIST)
+    assert os.path.exists(tmp_path / "englishVector.ivf.npz")
+    return str(tmp_path)
+
+def _brute_force(field: _VectorField, query: np.ndarray, k: int) -> list[int]:
+    q = query / np.linalg.norm(query)
+    return np.argsort(-(np.asarray(field.matrix) @ q))[:k].tolist()
+
+@pytest.mark.parametrize("nprobe", [NLIST, NLIST + 3])
+def test_knn_full_probe_matches_brute_force(ivf_index_dir, nprobe):
+    field = _VectorField(ivf_index_dir, "englishVector", quantized=False)
+    for doc_id in (0, 10, 123, NUM_DOCS - 1):
+        query = np.asarray(field.matrix[doc_id], dtype=np.float32)
+        ids, _ = field.knn(query.tolist(), 3, nprobe=nprobe)
+        assert ids[0] == doc_id
+        assert ids.tolist() == _brute_force(field, query, 3)
+
+def test_knn_full_probe_with_mask(ivf_index_dir):
+    field = _VectorField(ivf_index_dir, "englishVector", quantized=False)
+    mask = np.zeros(NUM_DOCS, dtype=bool)
+    mask[::2] = True
+    query = np.asarray(field.matrix[10], dtype=np.float32)
+    ids, _ = field.knn(query.tolist(), 5, mask=mask, nprobe=NLIST)
+    assert ids[0] == 10
+    assert all(mask[ids])
@@ -0,0 +1,178 @@
+import os
+import glob
+import argparse
+
+def _collect_csv_paths(paths: list[str]) -> list[str]:
+    """ファイルまたはディレクトリの指定から対訳CSVの一覧を作成する"""
+    csv_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            csv_paths.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        else:
+            csv_paths.append(path)
+    return csv_paths
+
+def command_index(args):
+    """対訳CSVを分割・埋め込みし、検索インデックスへ一括アップロードする"""
+    from core.azure_clients import get_clients
+    from core.indexer import Checkpoint, LocalIndexClient, iter_documents, load_metadata_csv, run_indexer
+
+    search_client, aoai_client, _, embed_model = get_clients()
+    upload_client = LocalIndexClient(args.local_index) if args.local_index else search_client
+    metadata = load_metadata_csv(args.metadata) if args.metadata else {}
+    csv_paths = _collect_csv_paths(args.paths)
+
+    documents = iter_documents(csv_paths, metadata, en_column=args.en_column, jp_column=args.jp_column)
+    stats = run_indexer(
+        documents, upload_client, aoai_client, embed_model, Checkpoint(args.checkpoint),
+        batch_size=args.batch_size, concurrency=args.concurrency, prune_all=args.prune_all,
+        on_progress=lambda s: print(f"アップロード {s['uploaded']}件 / スキップ {s['skipped']}件 / 失敗 {s['failed']}件 / 削除 {s['deleted']}件", flush=True)
+    )
+    print(f"完了: {len(csv_paths)}ファイル, アップロード {stats['uploaded']}件, スキップ {stats['skipped']}件, 失敗 {stats['failed']}件, 削除 {stats['deleted']}件")
+    if not args.local_index and stats["changed_files"]:
+        # 内容が変わった条約は条約ストアから削除し、次に表示するときに検索インデックスから取得し直す
+        from core.treaty_store import TreatyStore
+        invalidated = TreatyStore().invalidate(stats["changed_files"])
+        print(f"条約ストアから{invalidated}件の条約を削除しました（次回の表示時に再取得します）。")
+
+def command_sync_store(args):
+    """検索インデックスの条約本文をローカルの条約ストアへ同期する"""
+    from core.azure_clients import get_clients
+    from core.treaty_store import TreatyStore, sync_treaty_store
+
+    search_client, _, _, _ = get_clients()
+    count = sync_treaty_store(
+        search_client, TreatyStore(), args.source_files,
+        on_progress=lambda i, n, name, num_lines: print(f"[{i}/{n}] {name}: {num_lines}行", flush=True)
+    )
+    print(f"{count}件の条約を同期しました。")
+
+def command_align(args):
+    """条約ストアの各行について英語と日本語の句の対応を作成し、条約ストアに保存する"""
+    from core.azure_clients import get_clients
+    from core.alignment import build_line_alignments, pack_alignment
+    from core.treaty_store import TreatyStore
+
+    _, aoai_client, _, embed_model = get_clients()
+    store = TreatyStore()
+    source_files = args.source_files or store.list_treaties()
+    for i, source_file in enumerate(source_files, start=1):
+        alignments = build_line_alignments(aoai_client, embed_model, list(store.iter_lines(source_file)))
+        store.put_alignments(source_file, [(line_number, pack_alignment(pairs)) for line_number, pairs in alignments if pairs])
+        print(f"[{i}/{len(source_files)}] {source_file}: {len(alignments)}行", flush=True)
+
+def command_build_reference_index(args):
+    """レビューで使う参照資料の埋め込みインデックスを作成する（未作成の場合、アプリはバックグラウンドで作成する）"""
+    from core.azure_clients import get_clients
+    from core.reference_index import ReferenceIndex, list_reference_docs
+
+    _, aoai_client, _, embed_model = get_clients()
+    index = ReferenceIndex()
+    filenames = args.filenames or list_reference_docs()
+    for i, filename in enumerate(filenames, start=1):
+        index.ensure(aoai_client, embed_model, filename)
+        print(f"[{i}/{len(filenames)}] {filename}", flush=True)
+
+def command_build_local(args):
+    """ローカルインデックスの文書からローカル検索エンジン用のインデックスを作成する"""
+    from core.indexer import LocalIndexClient
+    from core.local_search import build_local_index
+
+    count = build_local_index(LocalIndexClient(args.local_index).iter_documents(), args.out, quantize=args.quantize, nlist=args.nlist)
+    print(f"{count}件の文書から {args.out} にローカル検索インデックスを作成しました。")
+
+def command_download_stanza(args):
+    """係り受け解析に必要なStanzaモデルをモデルディレクトリにダウンロードする（アプリは実行時にダウンロードしない）"""
+    from core.nlp import download_stanza_models, missing_stanza_models
+
+    download_stanza_models(args.dir)
+    missing = missing_stanza_models(args.dir)
+    print(f"{args.dir} にStanzaモデルを配置しました。" if not missing else f"不足しているモデルがあります: {', '.join(missing)}")
+
+def command_download_tokenizer(args):
+    """トークン数の計算に使う tiktoken の語彙ファイルをキャッシュディレクトリに取得する"""
+    from core.prompt_budget import download_tokenizer, TIKTOKEN_CACHE_DIR
+
+    if download_tokenizer(args.encoding):
+        print(f"{TIKTOKEN_CACHE_DIR} に {args.encoding} の語彙ファイルを配置しました。")
+    else:
+        print(f"{args.encoding} の語彙ファイルを取得できませんでした（tiktoken のインストールとネットワーク接続を確認してください）。")
+
+def command_audit_kanji(args):
+    """条約ストアの日本語訳に含まれる常用漢字以外の漢字を一括で検出し、出現回数の多い順に表示する"""
+    from core.kanji_audit import audit_kanji_batch, merge_frequencies
+    from core.treaty_store import TreatyStore
+
+    store = TreatyStore()
+    source_files = args.source_files or store.list_treaties()
+    texts = ["\n".join(line.get("jp_text") or "" for line in store.iter_lines(source_file)) for source_file in source_files]
+    audits = audit_kanji_batch(texts)
+    if audits is None:
+        print("常用漢字の一覧を読み込めませんでした。")
+        return
+    for source_file, audit in zip(source_files, audits):
+        if audit["non_joyo"]:
+            print(f"{source_file}: {len(audit['non_joyo'])}字・{audit['non_joyo_count']}箇所 (漢字 {audit['total_kanji']}字中)")
+    frequencies = merge_frequencies(audits)
+    print(f"合計: {len(source_files)}件の条約で常用漢字以外の漢字 {len(frequencies)}字")
+    for char, count in list(frequencies.items())[:args.top]:
+        print(f"  {char}: {count}回")
+
+def main():
+    from core.indexer import INDEX_BATCH_SIZE, INDEX_CONCURRENCY
+    from core.local_search import LOCAL_SEARCH_INDEX_DIR
+    from core.nlp import STANZA_RESOURCES_DIR
+    from core.prompt_budget import PROMPT_TOKENIZER
+
+    parser = argparse.ArgumentParser(prog="treatysearcher", description="条約文検索システムの管理コマンド")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser("index", help="対訳CSVを検索インデックスへ登録する")
+    index_parser.add_argument("paths", nargs="+", help="対訳CSVファイル、またはCSVを含むディレクトリ")
+    index_parser.add_argument("--metadata", help="sourceFile, jp_title, valid_date, country_area 列を持つメタデータCSV")
+    index_parser.add_argument("--en-column", default="en_text", help="英語本文の列名")
+    index_parser.add_argument("--jp-column", default="jp_text", help="日本語訳の列名")
+    index_parser.add_argument("--batch-size", type=int, default=INDEX_BATCH_SIZE, help="1回の埋め込み・アップロードで扱う文書数")
+    index_parser.add_argument("--concurrency", type=int, default=INDEX_CONCURRENCY, help="同時に処理するバッチ数")
+    index_parser.add_argument("--checkpoint", default=".index_checkpoint.json", help="再開用チェックポイントファイル")
+    index_parser.add_argument("--local-index", help="Azure Searchの代わりにアップロードするローカルインデックスのディレクトリ")
+    index_parser.add_argument("--prune-all", action="store_true", help="今回指定したCSVに含まれない条約の文書もインデックスから削除する")
+    index_parser.set_defaults(func=command_index)
+
+    sync_parser = subparsers.add_parser("sync-store", help="検索インデックスの条約本文をローカルの条約ストアへ同期する")
+    sync_parser.add_argument("source_files", nargs="*", help="同期する sourceFile（省略時は全件）")
+    sync_parser.set_defaults(func=command_sync_store)
+
+    align_parser = subparsers.add_parser("align", help="条約ストアの各行について英語と日本語の句の対応を作成する（sync-store の後に実行）")
+    align_parser.add_argument("source_files", nargs="*", help="対象の sourceFile（省略時は条約ストアの全件）")
+    align_parser.set_defaults(func=command_align)
+
+    reference_parser = subparsers.add_parser("build-reference-index", help="レビュー用の参照資料の埋め込みインデックスを作成する")
+    reference_parser.add_argument("filenames", nargs="*", help="ref_docs 内の参照資料のファイル名（省略時は ref_doc_*.txt の全件）")
+    reference_parser.set_defaults(func=command_build_reference_index)
+
+    local_parser = subparsers.add_parser("build-local", help="ローカル検索エンジン（SEARCH_BACKEND=local）用のインデックスを作成する")
+    local_parser.add_argument("local_index", help="index --local-index で作成したローカルインデックスのディレクトリ")
+    local_parser.add_argument("--out", default=LOCAL_SEARCH_INDEX_DIR, help="出力先ディレクトリ（LOCAL_SEARCH_INDEX_DIR）")
+    local_parser.add_argument("--quantize", action="store_true", help="埋め込みをint8に量子化して保存する")
+    local_parser.add_argument("--nlist", type=int, help="IVFのリスト数（省略時は文書数の平方根）")
+    local_parser.set_defaults(func=command_build_local)
+
+    stanza_parser = subparsers.add_parser("download-stanza", help="係り受け解析用のStanzaモデルをダウンロードする")
+    stanza_parser.add_argument("--dir", default=STANZA_RESOURCES_DIR, help="モデルの保存先（STANZA_RESOURCES_DIR）")
+    stanza_parser.set_defaults(func=command_download_stanza)
+
+    tokenizer_parser = subparsers.add_parser("download-tokenizer", help="トークン数の計算に使う tiktoken の語彙ファイルを取得する（オフライン環境への配置用）")
+    tokenizer_parser.add_argument("--encoding", default=PROMPT_TOKENIZER, help="エンコーディング名（PROMPT_TOKENIZER）")
+    tokenizer_parser.set_defaults(func=command_download_tokenizer)
+
+    kanji_parser = subparsers.add_parser("audit-kanji", help="条約ストアの日本語訳に含まれる常用漢字以外の漢字を一括で検出する（sync-store の後に実行）")
+    kanji_parser.add_argument("source_files", nargs="*", help="対象の sourceFile（省略時は条約ストアの全件）")
+    kanji_parser.add_argument("--top", type=int, default=50, help="表示する頻出文字の数")
+    kanji_parser.set_defaults(func=command_audit_kanji)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
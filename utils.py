@@ -3,62 +3,83 @@ import re
 import html
 import streamlit as st
 from pathlib import Path
+from functools import lru_cache
+from datetime import datetime
 
 def is_japanese(text: str) -> bool:
     """テキストに日本語が含まれるかを判定する"""
     return re.search(r"[\u3040-\u30ff\u3400-\u9fff]", text) is not None
 
-def mask_list_markers(text: str) -> str:
-    """pysbdが誤認識する可能性のある箇条書きマーカーを一時的に置換する"""
-    replacements = {
-        '(a)': '__PAREN_A__', '(b)': '__PAREN_B__', '(c)': '__PAREN_C__',
-        '(d)': '__PAREN_D__', '(e)': '__PAREN_E__', '(f)': '__PAREN_F__',
-        '(i)': '__PAREN_I__', '(ii)': '__PAREN_II__', '(iii)': '__PAREN_III__',
-        '(iv)': '__PAREN_IV__',
-    }
-    for old, new in replacements.items():
-        text = re.sub(r'(\s|^)' + re.escape(old) + r'(\s|$|\,)', r'\1' + new + r'\2', text)
-    return text
+# 条約の箇条書きマーカー: (a)〜(z)、任意の長さのローマ数字 (iv)・(xii)、条項番号 Article 3(1)(b)、全角の（a）
+_LIST_MARKER_PATTERN = re.compile(r"""
+    (?<![^\s\d])(?:\((?:[ivxlcdm]+|[IVXLCDM]+|[a-zA-Z]|\d{1,3})\))+(?=[\s,;:.]|$)
+  | （(?:[ivxlcdm]+|[a-zａ-ｚ]|\d{1,3}|[０-９]{1,3})）
+""", re.VERBOSE)
+# 括弧を私用領域の文字に置き換える。文字数が変わらないため、マスク後の文字位置は元のテキストの位置と一致する
+_MASK_TABLE = str.maketrans({"(": "\ue000", ")": "\ue001", "（": "\ue002", "）": "\ue003"})
 
-def unmask_list_markers(text: str) -> str:
-    """マスキングした文字列を元に戻す"""
-    replacements = {
-        '__PAREN_A__': '(a)', '__PAREN_B__': '(b)', '__PAREN_C__': '(c)',
-        '__PAREN_D__': '(d)', '__PAREN_E__': '(e)', '__PAREN_F__': '(f)',
-        '__PAREN_I__': '(i)', '__PAREN_II__': '(ii)', '__PAREN_III__': '(iii)',
-        '__PAREN_IV__': '(iv)',
-    }
-    for new, old in replacements.items():
-        text = text.replace(new, old)
-    return text
+def mask_list_markers(text: str) -> str:
+    """
+    pysbdが文境界と誤認識する可能性のある箇条書きマーカーの括弧を、1回の走査で私用領域の文字に置き換える。
+    置換は文字数を変えないため、マスク後のテキストで求めた文の位置で元のテキストをそのまま切り出せる。
+    """
+    return _LIST_MARKER_PATTERN.sub(lambda m: m.group().translate(_MASK_TABLE), text)
 
 def _escape_html(s: str) -> str:
     """HTMLエスケープを行う"""
     return html.escape(s, quote=False)
 
+_EM_PATTERN = re.compile(r"<em>(.+?)</em>")
+HIGHLIGHT_CACHE_SIZE = int(os.getenv("HIGHLIGHT_CACHE_SIZE", "4096"))
+
+@lru_cache(maxsize=256)
+def _compile_highlight_pattern(terms: tuple[str, ...], ignore_case: bool) -> re.Pattern:
+    """ハイライト語を長い順に並べた1つのパターンにまとめる（各位置で最長の語に一致する）"""
+    alternation = "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+    return re.compile(alternation, re.IGNORECASE if ignore_case else 0)
+
+@lru_cache(maxsize=HIGHLIGHT_CACHE_SIZE)
+def _highlight_terms(full_text: str, terms: tuple[str, ...], ignore_case: bool) -> str:
+    pattern = _compile_highlight_pattern(terms, ignore_case)
+    out, pos = [], 0
+    for m in pattern.finditer(full_text):
+        out.append(_escape_html(full_text[pos:m.start()]))
+        out.append(f"<em>{_escape_html(m.group(0))}</em>")
+        pos = m.end()
+    out.append(_escape_html(full_text[pos:]))
+    return "".join(out)
+
+def highlight_terms(full_text: str, terms, ignore_case: bool = False) -> str:
+    """
+    本文を1回走査して、指定した語の一致箇所を重なりなく <em> で囲んだHTMLを返す。
+    結果は (本文, 語の集合) ごとにメモ化され、再描画時はキャッシュから返す。
+    """
+    terms = tuple(sorted({t for t in terms if t and t.strip()}))
+    if not full_text or not terms:
+        return _escape_html(full_text or "")
+    return _highlight_terms(full_text, terms, ignore_case)
+
 def merge_server_highlights(full_text: str, highlight_snippets: list[str]) -> str:
     """Azure Searchのハイライト結果を全文にマージする"""
     if not full_text or not highlight_snippets:
         return _escape_html(full_text)
-    text = _escape_html(full_text)
-    em_pat = re.compile(r"<em>(.+?)</em>")
-    hits = sorted(set(m.group(1) for snip in highlight_snippets for m in em_pat.finditer(snip)), key=len, reverse=True)
-    for h in hits:
-        if h.strip():
-            text = text.replace(_escape_html(h), f"<em>{_escape_html(h)}</em>")
-    return text
+    return highlight_terms(full_text, (m.group(1) for snip in highlight_snippets for m in _EM_PATTERN.finditer(snip)))
 
 def client_side_highlight(full_text: str, query: str) -> str:
     """クライアント側で文字列をハイライトする"""
     if not full_text or not query:
         return _escape_html(full_text)
-    text = _escape_html(full_text)
-    clean_query = query.strip().strip('"')
-    q_esc = _escape_html(clean_query)
-    if q_esc:
-        pattern = re.compile(re.escape(q_esc), re.IGNORECASE)
-        text = pattern.sub(lambda m: f"<em>{m.group(0)}</em>", text)
-    return text
+    return highlight_terms(full_text, [query.strip().strip('"')], ignore_case=True)
+
+@lru_cache(maxsize=4096)
+def format_valid_date(valid_date_str: str) -> str:
+    """効力発生日（ISO 8601）を「YYYY年MM月DD日」形式に整形する。解釈できない場合はそのまま返す"""
+    if not valid_date_str:
+        return ""
+    try:
+        return datetime.fromisoformat(valid_date_str.replace('Z', '+00:00')).strftime('%Y年%m月%d日')
+    except (ValueError, TypeError):
+        return valid_date_str
 
 def _clear_title_tab_results():
     """タブ「条約名検索」の結果をクリアする"""
@@ -108,27 +129,4 @@ def load_joyo_kanji():
     except FileNotFoundError:
         # エラーメッセージも正しいパスを表示するように修正
         st.error(f"常用漢字ファイルが見つかりません: {joyo_kanji_path}")
-        return set()
-
-def find_non_joyo_kanji(text: str) -> list[str]:
-    """
-    与えられたテキストから常用漢字以外の漢字を抽出し、リストとして返します。
-
-    Args:
-        text (str): チェック対象のテキスト。
-
-    Returns:
-        list[str]: テキストに含まれる常用漢字以外の漢字のリスト。
-                   見つからない場合は空のリストを返します。
-    """
-    joyo_kanji_set = load_joyo_kanji()
-    if not joyo_kanji_set:
-        return []
-
-    # テキストから全ての漢字を重複なく抽出
-    kanji_in_text = set(re.findall(r'[\u4e00-\u9FFF]', text))
-
-    # 常用漢字セットに含まれていない漢字を特定
-    non_joyo_kanji = [kanji for kanji in kanji_in_text if kanji not in joyo_kanji_set]
-
-    return sorted(non_joyo_kanji)
\ No newline at end of file
+        return set()
\ No newline at end of file
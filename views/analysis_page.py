@@ -1,6 +1,6 @@
 import streamlit as st
 import graphviz
-from core.nlp import load_stanza_model
+from core.nlp import parse_dependencies
 from constants import pos_tag_japanese, deprel_japanese
 
 def display_analysis_page(text_to_analyze: str):
@@ -11,24 +11,21 @@ def display_analysis_page(text_to_analyze: str):
     st.markdown(f"> {text_to_analyze.replace(chr(10), chr(10) + '> ')}")
     st.markdown("---")
     
-    stanza_nlp = load_stanza_model()
-    if not stanza_nlp:
-        st.error("Stanzaモデルがロードされていません。")
-        return
-        
     try:
-        doc = stanza_nlp(text_to_analyze)
+        # 解析結果は文ごとにディスクへキャッシュされるため、解析済みの文はStanzaモデルを読み込まずに表示する
+        with st.spinner("係り受けを解析しています..."):
+            sentences = parse_dependencies(text_to_analyze)
         dot = graphviz.Digraph(graph_attr={'rankdir': 'TB'}, node_attr={'shape': 'record', 'fontname': 'sans-serif'}, edge_attr={'fontsize': '10', 'fontname': 'sans-serif'})
-        for sent in doc.sentences:
-            for word in sent.words:
-                node_id = f"{sent.index+1}_{word.id}"
-                pos_ja = pos_tag_japanese.get(word.upos, word.upos)
-                dot.node(node_id, label=f"{{{word.text}|{pos_ja}}}")
-            for word in sent.words:
-                if word.head > 0:
-                    head_id = f"{sent.index+1}_{word.head}"
-                    node_id = f"{sent.index+1}_{word.id}"
-                    deprel_ja = deprel_japanese.get(word.deprel, word.deprel)
+        for sent_index, words in enumerate(sentences, start=1):
+            for word in words:
+                node_id = f"{sent_index}_{word['id']}"
+                pos_ja = pos_tag_japanese.get(word["upos"], word["upos"])
+                dot.node(node_id, label=f"{{{word['text']}|{pos_ja}}}")
+            for word in words:
+                if word["head"] > 0:
+                    head_id = f"{sent_index}_{word['head']}"
+                    node_id = f"{sent_index}_{word['id']}"
+                    deprel_ja = deprel_japanese.get(word["deprel"], word["deprel"])
                     dot.edge(head_id, node_id, label=deprel_ja)
         st.write("### 解析結果")
         st.graphviz_chart(dot)
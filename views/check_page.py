@@ -1,9 +1,14 @@
 import streamlit as st
 import os
-import time
 import urllib.parse
 from core.azure_clients import get_clients
-from utils import find_non_joyo_kanji, _escape_html
+from core.cache import get_embedding
+from core.reference_index import get_reference_index, REFERENCE_TOP_K
+from core.resilience import execute, ENDPOINT_CHAT
+from core.prompt_budget import truncate_to_tokens, fit_sections, record_usage, get_usage_stats, REVIEW_REFERENCE_TOKEN_BUDGET, REPORT_TOKEN_BUDGET
+from core.concurrency import TokenBucket, call_with_rate_limit, run_concurrently, AOAI_MAX_CONCURRENCY, AOAI_REQUESTS_PER_MINUTE
+from core.kanji_audit import audit_kanji, format_kanji_audit
+from utils import _escape_html
 
 # --- データ読み込み（共通関数） ---
 @st.cache_data
@@ -23,21 +28,48 @@ def load_reference_doc(file_name: str):
         st.error(f"参照資料ファイルが見つかりません: {file_path}")
         return None
 
+def load_relevant_references(aoai_client, embed_model: str, document_text: str, review_definitions: list) -> dict:
+    """
+    各参照資料からレビュー対象テキストに関連する箇所だけをトークン予算内で抽出する。
+    インデックスが構築済みでない資料（バックグラウンドで構築中）と、抽出に失敗した場合は全文を切り詰めて使用する。
+    """
+    reference_docs = {}
+    index = get_reference_index()
+    filenames = [d["filename"] for d in review_definitions]
+    try:
+        ready = [filename for filename in filenames if index.load(embed_model, filename)]
+        if ready:
+            query_vector = get_embedding(aoai_client, embed_model, document_text)
+            for filename in ready:
+                reference_docs[filename] = index.retrieve(filename, query_vector, REFERENCE_TOP_K, max_tokens=REVIEW_REFERENCE_TOKEN_BUDGET)
+    except Exception as e:
+        st.warning(f"参照資料の関連箇所の抽出に失敗したため、全文を使用します: {e}")
+        reference_docs = {}
+    pending = [filename for filename in filenames if filename not in reference_docs]
+    if pending:
+        index.build_in_background(aoai_client, embed_model, pending)
+        st.write(f"参照資料のインデックスを準備中のため、{len(pending)}件の資料は全文を切り詰めて使用します。")
+        for filename in pending:
+            reference_docs[filename] = truncate_to_tokens(load_reference_doc(filename) or "", REVIEW_REFERENCE_TOKEN_BUDGET)
+    return reference_docs
+
 # --- 個別レビュー実行関数 ---
-def perform_individual_review(document_text: str, definition: dict):
+def perform_individual_review(document_text: str, definition: dict, reference_data: str = None, aoai_client=None, gpt_model: str = None, limiter: TokenBucket = None):
     """指定された参照資料に基づきレビューを実行し、結果を返す"""
     reference_name = definition["tab_name"]
-    reference_data = load_reference_doc(definition["filename"])
+    if reference_data is None:
+        reference_data = load_reference_doc(definition["filename"])
     if not reference_data:
         return None, f"参照資料ファイル {definition['filename']} が見つかりませんでした。"
 
     try:
-        _, aoai_client, gpt_model, _ = get_clients()
+        if aoai_client is None:
+            _, aoai_client, gpt_model, _ = get_clients()
         system_prompt = f"""# 命令書
 ## あなたの役割
 {definition["role"]}
 ## 参照資料
-レビューの唯一の基準は、以下に提供する『{reference_name}』の全文です。
+レビューの唯一の基準は、以下に提供する『{reference_name}』の記載内容です。
 ## 実行タスク
 以下の【レビュー対象テキスト】を読み、【参照資料】に照らして、規則からの逸脱がないかを確認してください。逸脱箇所を発見した場合、その箇所、問題点、根拠、修正案を具体的に示してください。
 ## 出力形式
@@ -50,10 +82,11 @@ def perform_individual_review(document_text: str, definition: dict):
 上記の形式で、問題点を一つずつリストアップしてください。問題がない場合は、「指摘事項はありません。」とだけ記述してください。"""
         user_prompt = f"# 参照資料『{reference_name}』\n{reference_data}\n\n# レビュー対象テキスト\n{document_text}"
         
-        response = aoai_client.chat.completions.create(
+        response = call_with_rate_limit(lambda: aoai_client.chat.completions.create(
             model=gpt_model, messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
             temperature=0.0, max_tokens=4000,
-        )
+        ), limiter=limiter)
+        record_usage(f"レビュー: {reference_name}", getattr(response, "usage", None))
         return response.choices[0].message.content, None
     except Exception as e:
         return None, f"レビュー実行中にエラーが発生しました: {e}"
@@ -64,11 +97,13 @@ def generate_consolidated_report(document_text: str, non_joyo_report: str, indiv
     try:
         _, aoai_client, gpt_model, _ = get_clients()
 
+        # 個別レビューの合計がトークン予算を超える場合は、各レビューを均等に切り詰める
+        names = [name for name in review_order if name in individual_reports]
+        reviews = fit_sections([individual_reports[name] for name in names], REPORT_TOKEN_BUDGET)
         report_text = f"--- 常用漢字の確認結果 ---\n{non_joyo_report}"
-        for name in review_order:
-            if name in individual_reports:
-                report_text += f"\n\n--- 以下の指摘は『{name}』に基づいています ---\n"
-                report_text += individual_reports[name]
+        for name, review in zip(names, reviews):
+            report_text += f"\n\n--- 以下の指摘は『{name}』に基づいています ---\n"
+            report_text += review
 
         system_prompt = f"""# 命令書
 ## あなたの役割
@@ -101,10 +136,11 @@ def generate_consolidated_report(document_text: str, non_joyo_report: str, indiv
 """
         user_prompt = f"# 個別のレビュー結果（優先度順）\n{report_text}\n\n# レビュー対象の原文\n{document_text}"
         
-        response = aoai_client.chat.completions.create(
+        response = execute(lambda: aoai_client.chat.completions.create(
             model=gpt_model, messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
             temperature=0.0, max_tokens=4000,
-        )
+        ), ENDPOINT_CHAT)
+        record_usage("統合レポート", getattr(response, "usage", None))
         return response.choices[0].message.content, None
     except Exception as e:
         return None, f"統合レポート生成中にエラーが発生しました: {e}"
@@ -131,6 +167,12 @@ def display_check_page(text_to_check: str, original_text: str, reference_treatie
         label_visibility="collapsed"
     )
 
+    # 常用漢字の確認は参照表による一括判定で即座に終わるため、LLMによるレビューの前に常に表示する
+    kanji_audit = audit_kanji(edited_text)
+    if kanji_audit and kanji_audit["non_joyo"]:
+        with st.expander(f"⚠️ 常用漢字以外の漢字: {len(kanji_audit['non_joyo'])}字・{kanji_audit['non_joyo_count']}箇所"):
+            st.text(format_kanji_audit(edited_text, kanji_audit))
+
     # 類似文参照データの表示
     if reference_treaties:
         st.markdown("---")
@@ -159,8 +201,13 @@ def display_check_page(text_to_check: str, original_text: str, reference_treatie
 
     review_order = [d["tab_name"] for d in review_definitions]
 
+    # 参照資料のインデックスはレビューの実行を待たずにバックグラウンドで構築しておく（構築済みの場合は何もしない）
+    _, aoai_client, _, embed_model = get_clients()
+    if aoai_client and embed_model:
+        get_reference_index().build_in_background(aoai_client, embed_model, [d["filename"] for d in review_definitions])
+
     st.header("📚用字・用語統合確認")
-    st.info("下のボタンを押すと、常用漢字チェックと全ての参照資料に基づいたレビューが順番に実行され、最後に単一の最終レポートが生成されます。処理には数分かかることがあります。")
+    st.info("下のボタンを押すと、常用漢字チェックと全ての参照資料に基づいたレビューが並列に実行され、最後に単一の最終レポートが生成されます。処理には数分かかることがあります。")
 
     if st.button("統合レポートを生成する", type="primary"):
         if not edited_text.strip():
@@ -175,25 +222,27 @@ def display_check_page(text_to_check: str, original_text: str, reference_treatie
             with st.status("レビュー処理を実行中...", expanded=True) as status:
                 # 1. 常用漢字チェック
                 st.write("ステップ1/8: 常用漢字を確認しています...")
-                non_joyo_list = find_non_joyo_kanji(edited_text)
-                if non_joyo_list:
-                    non_joyo_report = f"常用漢字以外の漢字が見つかりました ({len(non_joyo_list)}字): {', '.join(non_joyo_list)}"
-                else:
-                    non_joyo_report = "常用漢字以外の漢字は見つかりませんでした。"
+                non_joyo_report = format_kanji_audit(edited_text, kanji_audit)
                 st.write("✅ ステップ1/8: 常用漢字の確認が完了しました。")
                 
-                # 2. 個別レビューを順番に実行
+                # 2. 個別レビューを並列に実行（結果の統合順は review_definitions の優先順位に従う）
+                _, aoai_client, gpt_model, embed_model = get_clients()
+                reference_docs = load_relevant_references(aoai_client, embed_model, edited_text, review_definitions)
+                limiter = TokenBucket(AOAI_REQUESTS_PER_MINUTE / 60.0, capacity=AOAI_MAX_CONCURRENCY)
                 for i, definition in enumerate(review_definitions):
-                    doc_name = definition["tab_name"]
-                    st.write(f"ステップ{i+2}/8: 『{doc_name}』でレビューを実行しています...")
-                    result, error = perform_individual_review(edited_text, definition)
+                    st.write(f"ステップ{i+2}/8: 『{definition['tab_name']}』でレビューを実行しています...")
+
+                def _review(definition):
+                    return perform_individual_review(edited_text, definition, reference_docs[definition["filename"]], aoai_client, gpt_model, limiter)
+
+                for i, (result, error) in run_concurrently(_review, review_definitions):
+                    doc_name = review_definitions[i]["tab_name"]
                     if error:
                         st.error(f"『{doc_name}』のレビュー中にエラーが発生しました: {error}")
                         error_occurred = True
-                        break
+                        continue
                     individual_reports[doc_name] = result
-                    st.write(f"✅ ステップ{i+2}/8: 『{doc_name}』のレビューが完了しました。")
-                    time.sleep(1) # APIレート制限を避けるための短い待機
+                    st.write(f"✅ ステップ{i+2}/8: 『{doc_name}』のレビューが完了しました。({len(individual_reports)}/{len(review_definitions)})")
 
                 if not error_occurred:
                     # 3. 最終レポートを生成
@@ -219,4 +268,7 @@ def display_check_page(text_to_check: str, original_text: str, reference_treatie
     if 'final_report' in st.session_state and st.session_state.final_report:
         st.subheader("✅ 最終統合レポート")
         with st.container(border=True):
-            st.markdown(st.session_state.final_report.replace('\n', '  \n'))
\ No newline at end of file
+            st.markdown(st.session_state.final_report.replace('\n', '  \n'))
+        usage = get_usage_stats()
+        if usage["calls"]:
+            st.caption(f"トークン使用量（累計 {usage['calls']}回）: 入力 {usage['prompt_tokens']} (キャッシュ {usage['cached_tokens']}) / 出力 {usage['completion_tokens']}")
\ No newline at end of file
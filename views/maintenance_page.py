@@ -1,31 +1,51 @@
 import streamlit as st
-import pandas as pd
-from core.database import init_db, update_glossary_db
+from core.database import init_db, update_glossary_db, count_terms, fetch_terms_page
+
+PAGE_SIZE_OPTIONS = [50, 100, 200, 500]
+
+def _reset_glossary_page():
+    """検索条件やページサイズが変わったときに1ページ目へ戻す"""
+    st.session_state.glossary_page = 1
 
 def display_maintenance_page():
     """辞書データの編集ページの描画と機能"""
     st.subheader("翻訳辞書データの編集")
-    st.info("テーブルを直接編集し、「変更を保存」ボタンを押してください。行の追加・削除も可能です。")
-    
+    st.info("テーブルを直接編集し、「変更を保存」ボタンを押してください。行の追加・削除も可能です。変更はページごとに保存されます。")
+
     conn = init_db()
-    
+    if "glossary_page" not in st.session_state:
+        st.session_state.glossary_page = 1
+
     try:
-        db_df = pd.read_sql_query("SELECT id, english_term, japanese_term FROM terms ORDER BY english_term", conn)
-        
-        edited_df = st.data_editor(
-            db_df,
+        search_col, size_col = st.columns([4, 1])
+        with search_col:
+            query = st.text_input("英語原文・日本語訳で絞り込み", key="glossary_search", on_change=_reset_glossary_page)
+        with size_col:
+            page_size = st.selectbox("表示件数", PAGE_SIZE_OPTIONS, index=1, key="glossary_page_size", on_change=_reset_glossary_page)
+
+        total = count_terms(conn, query)
+        num_pages = max(1, -(-total // page_size))
+        st.session_state.glossary_page = min(st.session_state.glossary_page, num_pages)
+        page = st.number_input(f"ページ (全{num_pages}ページ / {total}件)", min_value=1, max_value=num_pages, key="glossary_page")
+
+        page_df = fetch_terms_page(conn, query, limit=page_size, offset=(page - 1) * page_size)
+        # 表示中のページが変わったときに編集状態を引き継がないよう、キーにページ情報を含める
+        editor_key = f"glossary_editor_{query}_{page_size}_{page}"
+        st.data_editor(
+            page_df,
             column_config={
                 "id": st.column_config.NumberColumn("ID", disabled=True),
                 "english_term": "英語原文",
                 "japanese_term": "日本語訳",
             },
             num_rows="dynamic",
-            key="glossary_editor",
+            key=editor_key,
             width='stretch'
         )
 
         if st.button("変更を保存 💾", type="primary"):
-            update_glossary_db(conn, edited_df, db_df)
+            update_glossary_db(conn, st.session_state[editor_key], page_df)
+            del st.session_state[editor_key]
             st.success("データベースの変更が正常に保存されました！")
             st.rerun()
 
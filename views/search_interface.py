@@ -1,32 +1,138 @@
 import streamlit as st
+import time
 import urllib.parse
 from datetime import datetime
 import json
 
 # 必要な関数を各モジュールからインポート
-from core.azure_clients import get_clients
+from core.azure_clients import get_clients, USE_ASYNC_CLIENTS
+from core.alignment import load_alignments, find_hit_spans, aligned_highlight_html
+from core.cache import get_embedding_cache
+from core.resilience import get_resilience_stats
 from core.database import init_db, find_glossary_terms
-from core.nlp import load_nlp_model
-from core.search import perform_search
-from core.translation import get_translation_with_retry
+from core.nlp import load_sentence_splitter, iter_sentence_spans, warm_up_nlp
+from core.search import perform_search, perform_batch_search, perform_batch_search_async, FUSION_CANDIDATES
+from core.treaty_store import get_treaty_store
+from core.translation import get_translation_with_retry, build_translation_context, format_attempt_metrics, STRATEGY_SEQUENTIAL, STRATEGY_BEST_OF_N
+from core.prompt_budget import get_usage_stats, TRANSLATION_CONTEXT_TOKEN_BUDGET
 from utils import (
     _clear_title_tab_results,
     _clear_analysis_tab_results,
     mask_list_markers,
-    unmask_list_markers,
     is_japanese,
     merge_server_highlights,
     client_side_highlight,
-    _escape_html
+    format_valid_date
 )
 from .maintenance_page import display_maintenance_page
 
+def _treaty_link(source_file: str, label: str) -> str:
+    return f'<a href="?view_treaty={urllib.parse.quote(source_file)}" target="_blank" rel="noopener noreferrer">{label}</a>'
+
+def _date_display(result: dict) -> str:
+    formatted_date = format_valid_date(result.get("valid_date", ""))
+    return f" | 効力発生日: **{formatted_date}**" if formatted_date else ""
+
+def _title_result_view(result: dict, query: str) -> dict:
+    """条約名検索の結果1件分の表示内容を作成し、結果に保持して再描画時に再利用する"""
+    if (result.get("_view") or {}).get("key") == ("title", query):
+        return result["_view"]
+    source_file = result.get("sourceFile", "")
+    highlighted_snippets = (result.get("@search.highlights") or {}).get("jp_title", [])
+    result["_view"] = {
+        "key": ("title", query),
+        "title_html": " ... ".join(highlighted_snippets) if highlighted_snippets else client_side_highlight(result.get("jp_title", ""), query),
+        "file_line": f"**ファイル名:** {source_file.replace('.csv', '.pdf')}{_date_display(result)}",
+        "link": _treaty_link(source_file, "条約全文を別タブで開く"),
+    }
+    return result["_view"]
+
+def _build_result_view(result: dict, style: str, highlight_query: str, is_ja_q: bool, pairs: list) -> dict:
+    """類似文検索（style="sentence"）またはフリーワード検索（style="fw"）の結果1件分の表示内容を作成する"""
+    res_en, res_ja, source_file = result.get("en_text", ""), result.get("jp_text", ""), result.get("sourceFile", "")
+    highlights = result.get("@search.highlights") or {}
+    en_snips, ja_snips, title_snips = highlights.get("en_text", []), highlights.get("jp_text", []), highlights.get("jp_title", [])
+    jp_title = result.get("jp_title", "")
+    country_area = result.get("country_area", "")
+    country_area_display = f" | 国・地域名: **{country_area}**" if country_area else ""
+
+    if style == "fw":
+        if title_snips:
+            title_prefix = f"**{' ... '.join(title_snips)}**"
+        else:
+            title_prefix = f"**{client_side_highlight(jp_title, highlight_query)}**" if jp_title else ""
+        en_html = merge_server_highlights(res_en, en_snips) if en_snips else client_side_highlight(res_en, highlight_query)
+        ja_html = merge_server_highlights(res_ja, ja_snips) if ja_snips else client_side_highlight(res_ja, highlight_query)
+        # 一方の言語だけが一致した場合は、句の対応からもう一方の言語の該当箇所を示す
+        if pairs and "<em>" in en_html and "<em>" not in ja_html:
+            ja_html = aligned_highlight_html(find_hit_spans(res_en, en_snips, highlight_query), res_ja, pairs, source_is_en=True)
+        elif pairs and "<em>" in ja_html and "<em>" not in en_html:
+            en_html = aligned_highlight_html(find_hit_spans(res_ja, ja_snips, highlight_query), res_en, pairs, source_is_en=False)
+    else:
+        title_prefix = f"**{jp_title}**" if jp_title else ""
+        if is_ja_q:
+            ja_html = merge_server_highlights(res_ja, ja_snips) if ja_snips else client_side_highlight(res_ja, highlight_query)
+            en_html = aligned_highlight_html(find_hit_spans(res_ja, ja_snips, highlight_query), res_en, pairs, source_is_en=False)
+        else:
+            en_html = merge_server_highlights(res_en, en_snips) if en_snips else client_side_highlight(res_en, highlight_query)
+            ja_html = aligned_highlight_html(find_hit_spans(res_en, en_snips, highlight_query), res_ja, pairs, source_is_en=True)
+
+    return {
+        "key": (style, highlight_query),
+        "metadata": f"{title_prefix}{_date_display(result)}{country_area_display} | Source: **{source_file.replace('.csv', '.pdf')}#{result['line_number']}** | Score: {result['@search.score']:.4f}",
+        "link": _treaty_link(source_file, "条約全文を開く"),
+        "en_html": en_html,
+        "ja_html": ja_html,
+    }
+
+def _ensure_result_views(results: list[dict], style: str, highlight_query: str):
+    """
+    表示内容が未作成、またはハイライト条件が変わった結果についてのみ表示内容を作成して結果に保持する。
+    再描画時は保持済みの内容をそのまま出力するため、日付の解析やハイライトをやり直さない。
+    """
+    stale = [r for r in results if (r.get("_view") or {}).get("key") != (style, highlight_query)]
+    if not stale:
+        return
+    alignments = load_alignments(get_treaty_store(), stale)
+    is_ja_q = is_japanese(highlight_query)
+    for r in stale:
+        r["_view"] = _build_result_view(r, style, highlight_query, is_ja_q, alignments.get((r.get("sourceFile"), r.get("line_number"))))
+
+def _render_result_card(view: dict, checkbox_key: str, checked: bool, metadata_html: bool, help_text: str = None) -> bool:
+    """結果1件をチェックボックス付きで表示し、チェック状態を返す"""
+    with st.container(border=True):
+        check_col, content_col = st.columns([0.08, 0.92])
+        with check_col:
+            is_checked = st.checkbox(" ", value=checked, key=checkbox_key, label_visibility="collapsed", help=help_text)
+        with content_col:
+            res_col1, res_col2 = st.columns([0.8, 0.2])
+            with res_col1: st.markdown(view["metadata"], unsafe_allow_html=metadata_html)
+            with res_col2: st.markdown(view["link"], unsafe_allow_html=True)
+            st.markdown(f"**英語原文:**<br>{view['en_html']}", unsafe_allow_html=True)
+            st.markdown(f"**日本語訳:**<br>{view['ja_html']}", unsafe_allow_html=True)
+    return is_checked
+
+@st.fragment
+def _render_sentence_results(i: int):
+    """類似文検索結果の一覧。チェックボックスの操作ではこのフラグメントだけが再実行される"""
+    results = st.session_state.segmented_sentences[i]["search_results"]
+    _ensure_result_views(results, "sentence", st.session_state.get(f"highlight_query_{i}", ""))
+    for j, result_item in enumerate(results):
+        result_item["checked"] = _render_result_card(result_item["_view"], f"res_check_{i}_{j}", result_item.get("checked", False), False, help_text="この行を翻訳の参照に含める")
+
+@st.fragment
+def _render_fw_results(i: int):
+    """フリーワード検索結果の一覧。チェックボックスの操作ではこのフラグメントだけが再実行される"""
+    results = st.session_state[f"fw_search_results_{i}"]
+    _ensure_result_views(results, "fw", st.session_state.get(f"highlight_query_{i}", ""))
+    for fw_idx, fw_res in enumerate(results):
+        fw_res["checked"] = _render_result_card(fw_res["_view"], f"fw_res_check_{i}_{fw_idx}", fw_res.get("checked", False), True)
+
 def display_search_interface():
     """メインの検索インターフェースを描画"""
     # --- 初期化処理 ---
     search_client, aoai_client, gpt_model, embed_model = get_clients()
     db_conn = init_db()
-    nlp = load_nlp_model()
 
     # --- UI描画 ---
     if "query_input_title" not in st.session_state:
@@ -42,6 +148,11 @@ def display_search_interface():
         st.radio("一致方法", ["部分一致 (OR)", "完全一致 (Phrase)"], key="match_type_radio")
         st.slider("上位 (表示件数)", 1, 50, 10, key="topk_slider")
         st.slider("k (あいまい検索 近接度)", 1, 200, 30, key="kvec_slider")
+        if st.toggle("ハイブリッド結果をアプリ側で統合", key="client_fusion_enabled", help="文字列検索とあいまい検索の候補を別々に取得し、重み付きRRFで統合します。"):
+            st.slider("候補数 (各検索)", 10, 200, FUSION_CANDIDATES, key="fusion_candidates_slider")
+            st.slider("文字列検索の重み", 0.0, 2.0, 1.0, 0.1, key="text_weight_slider")
+            st.slider("あいまい検索の重み", 0.0, 2.0, 1.0, 0.1, key="vector_weight_slider")
+            st.toggle("クロスエンコーダーで再ランキング (CPU)", key="rerank_enabled", help="sentence-transformers が必要です。")
 
         st.divider()
         st.subheader("日付フィルター")
@@ -71,6 +182,24 @@ def display_search_interface():
             if start_date > end_date:
                 st.error("エラー: 終了日は開始日以降に設定してください。")
 
+        st.divider()
+        st.subheader("翻訳オプション")
+        st.radio("翻訳戦略", [STRATEGY_SEQUENTIAL, STRATEGY_BEST_OF_N], key="translation_strategy", help="ベストオブNは複数の候補を並列に生成・評価します。")
+        st.toggle("翻訳結果をストリーミング表示", value=True, key="stream_translation", help="ベストオブNでは修正再試行時のみストリーミング表示されます。")
+
+        st.divider()
+        cache_stats = get_embedding_cache().stats()
+        st.caption(f"埋め込みキャッシュ: ヒット {cache_stats['hits']} (ディスク {cache_stats['disk_hits']}) / ミス {cache_stats['misses']}")
+        for endpoint, ep_stats in get_resilience_stats().items():
+            p95 = f"{ep_stats['p95_ms']:.0f} ms" if ep_stats["p95_ms"] is not None else "-"
+            st.caption(
+                f"{endpoint}: 成功 {ep_stats['successes']} / 失敗 {ep_stats['failures']} / 再試行 {ep_stats['retries']} / "
+                f"ヘッジ {ep_stats['hedges']} (勝ち {ep_stats['hedge_wins']}・見送り {ep_stats['hedges_skipped']}) / 遮断 {ep_stats['short_circuits']} | p95 {p95} | 状態: {ep_stats['state']}"
+            )
+        usage = get_usage_stats()
+        if usage["calls"]:
+            st.caption(f"トークン使用量: {usage['calls']}回 | 入力 {usage['prompt_tokens']} (キャッシュ {usage['cached_tokens']}) / 出力 {usage['completion_tokens']}")
+
     tab_text_search, tab_title_search, tab_maintenance = st.tabs(["✍️ 条約本文検索", "📜 条約名検索", "📖 翻訳辞書データの編集"])
 
     with tab_title_search:
@@ -108,31 +237,13 @@ def display_search_interface():
                 if source_file in displayed_files:
                     continue
                 displayed_files.add(source_file)
-                jp_title = r.get("jp_title", "")
-                source_file_display = source_file.replace(".csv", ".pdf")
-                highlights = r.get("@search.highlights", {})
-                highlighted_snippets = highlights.get("jp_title", [])
-
-                if highlighted_snippets:
-                    highlighted_title = " ... ".join(highlighted_snippets)
-                else:
-                    query_to_display = st.session_state.last_query_title
-                    highlighted_title = client_side_highlight(jp_title, query_to_display)
-
-                st.markdown(f"##### {highlighted_title}", unsafe_allow_html=True)
+                view = _title_result_view(r, st.session_state.last_query_title)
+                st.markdown(f"##### {view['title_html']}", unsafe_allow_html=True)
                 res_col1, res_col2 = st.columns([0.75, 0.25])
                 with res_col1:
-                    valid_date_str = r.get("valid_date", "")
-                    date_display = ""
-                    if valid_date_str:
-                        try:
-                            formatted_date = datetime.fromisoformat(valid_date_str.replace('Z', '+00:00')).strftime('%Y年%m月%d日')
-                            date_display = f" | 効力発生日: **{formatted_date}**"
-                        except (ValueError, TypeError):
-                            date_display = f" | 効力発生日: **{valid_date_str}**"
-                    st.markdown(f"**ファイル名:** {source_file_display}{date_display}")
+                    st.markdown(view["file_line"])
                 with res_col2:
-                    st.markdown(f'<a href="?view_treaty={urllib.parse.quote(source_file)}" target="_blank" rel="noopener noreferrer">条約全文を別タブで開く</a>', unsafe_allow_html=True)
+                    st.markdown(view["link"], unsafe_allow_html=True)
                 st.markdown("---")
 
     with tab_text_search:
@@ -147,17 +258,21 @@ def display_search_interface():
         with col3_tab2:
             st.button("🧹入力消去　　　", key="clear_button_analysis", on_click=_clear_analysis_tab_results)
 
+        splitter = None
+        if start_analysis_clicked and pasted_text.strip():
+            with st.spinner("文分割エンジンを読み込んでいます..."):
+                splitter = load_sentence_splitter()
         if start_analysis_clicked or no_split_clicked:
             if not pasted_text.strip():
                 st.warning("テキストを入力してください。")
-            elif not nlp and start_analysis_clicked:
-                st.error("NLPモデルのロードに失敗しました。")
+            elif not splitter and start_analysis_clicked:
+                st.error("文分割エンジンのロードに失敗しました。")
             else:
                 st.session_state.segmented_sentences = []
                 if start_analysis_clicked:
-                    doc = nlp(mask_list_markers(pasted_text))
-                    for sent in doc.sents:
-                        if original_sent_text := unmask_list_markers(sent.text).strip():
+                    # マスクは文字数を変えないため、マスク後のテキストで求めた文の位置で原文をそのまま切り出す
+                    for start, end in iter_sentence_spans(mask_list_markers(pasted_text)):
+                        if original_sent_text := pasted_text[start:end].strip():
                             st.session_state.segmented_sentences.append({"text": original_sent_text, "search_results": None})
                 elif no_split_clicked:
                     st.session_state.segmented_sentences.append({"text": pasted_text.strip(), "search_results": None})
@@ -172,6 +287,29 @@ def display_search_interface():
             num_sents = len(st.session_state.segmented_sentences)
             st.write(f"▼ {num_sents} 件の文に分割されました ▼" if num_sents > 1 else "▼ 1 件の文として処理します ▼")
 
+            if num_sents > 1 and st.button("🔍全ての文で類似条約文検索", key="search_all_button"):
+                progress = st.progress(0.0, text="一括検索を実行中...")
+                sentences = st.session_state.segmented_sentences
+                failed = 0
+                query_texts = [s["text"] for s in sentences]
+                if USE_ASYNC_CLIENTS:
+                    async_search_client = get_clients(async_mode=True)[0]
+                    batch_results = perform_batch_search_async(async_search_client, aoai_client, embed_model, query_texts)
+                else:
+                    batch_results = perform_batch_search(search_client, aoai_client, embed_model, query_texts)
+                for done, (i, results, _, error) in enumerate(batch_results, start=1):
+                    if error:
+                        failed += 1
+                    else:
+                        sentences[i]["search_results"] = [{"checked": False, **res} for res in results]
+                        sentences[i].pop("ai_translation", None)
+                        st.session_state[f"highlight_query_{i}"] = sentences[i]["text"]
+                    progress.progress(done / num_sents, text=f"一括検索を実行中... ({done}/{num_sents})")
+                if failed:
+                    st.error(f"{failed} 件の文で検索中にエラーが発生しました。")
+                else:
+                    st.rerun()
+
             for i, sentence_data in enumerate(st.session_state.segmented_sentences):
                 # フリーワード検索用の状態を初期化
                 if f"fw_search_results_{i}" not in st.session_state:
@@ -229,26 +367,38 @@ def display_search_interface():
                                 st.session_state[f"fw_search_results_{i}"] = None
                                 st.session_state[f"fw_query_{i}"] = ""
                             st.rerun()
+                    translate_clicked = False
                     with c4:
                         if sentence_data.get("search_results"):
-                            if st.button("🔤参照して日本語訳", key=f"translate_all_{i}"):
-                                selected_results = [res for res in sentence_data["search_results"] if res.get("checked", False)]
-                                if not selected_results:
-                                    st.warning("翻訳の参照として使用する行を少なくとも1つ選択してください。")
-                                else:
-                                    context_english = "\\n\\n---\\n\\n".join([r.get("en_text", "") for r in selected_results])
-                                    context_japanese = "\\n\\n---\\n\\n".join([r.get("jp_text", "") for r in selected_results])
-                                    glossary_to_use = {}
-                                    if "found_terms" in sentence_data and sentence_data["found_terms"]:
-                                        for term_data in sentence_data["found_terms"]:
-                                            if term_data["checked"]:
-                                                glossary_to_use[term_data["en"]] = term_data["ja"]
-                                    translation, score = get_translation_with_retry(aoai_client, gpt_model, original_text, context_english, context_japanese, glossary_to_use)
-                                    st.session_state.segmented_sentences[i]["ai_translation"] = {"text": translation, "score": score}
-                                    st.rerun()
+                            translate_clicked = st.button("🔤参照して日本語訳", key=f"translate_all_{i}")
                         else:
                             st.button("🔤参照して日本語訳", disabled=True, key=f"translate_all_{i}_disabled", help="先に類似文検索を実行してください。")
 
+                    if translate_clicked:
+                        selected_results = [res for res in sentence_data["search_results"] if res.get("checked", False)]
+                        if not selected_results:
+                            st.warning("翻訳の参照として使用する行を少なくとも1つ選択してください。")
+                        else:
+                            context_english, context_japanese, dropped = build_translation_context(selected_results)
+                            if dropped:
+                                st.info(f"参照情報がトークン上限 ({TRANSLATION_CONTEXT_TOKEN_BUDGET}) を超えるため、下位の参照文{dropped}件を除外しました。")
+                            glossary_to_use = {}
+                            if "found_terms" in sentence_data and sentence_data["found_terms"]:
+                                for term_data in sentence_data["found_terms"]:
+                                    if term_data["checked"]:
+                                        glossary_to_use[term_data["en"]] = term_data["ja"]
+                            stream_container = None
+                            if st.session_state.get("stream_translation", True):
+                                st.markdown("---")
+                                st.markdown("🔤**AI翻訳結果:**")
+                                stream_container = st.container(border=True)
+                            attempts = []
+                            strategy = st.session_state.get("translation_strategy", STRATEGY_SEQUENTIAL)
+                            t0 = time.perf_counter()
+                            translation, score = get_translation_with_retry(aoai_client, gpt_model, original_text, context_english, context_japanese, glossary_to_use, stream_container=stream_container, attempt_log=attempts, strategy=strategy)
+                            st.session_state.segmented_sentences[i]["ai_translation"] = {"text": translation, "score": score, "attempts": attempts, "strategy": strategy, "elapsed_ms": (time.perf_counter() - t0) * 1000}
+                            st.rerun()
+
                     # 1. AI翻訳結果
                     if "ai_translation" in sentence_data and sentence_data["ai_translation"]:
                         st.markdown("---")
@@ -257,6 +407,10 @@ def display_search_interface():
                         with st.container(border=True):
                             display_text = f"{translation_data['text']} (翻訳スコア: {translation_data['score']:.2f})"
                             st.markdown(display_text.replace('\n', '  \n'))
+                            for attempt in translation_data.get("attempts", []):
+                                st.caption(format_attempt_metrics(attempt))
+                            if "elapsed_ms" in translation_data:
+                                st.caption(f"翻訳戦略: {translation_data['strategy']} | 所要時間: {translation_data['elapsed_ms']:.0f} ms")
                         translated_text = translation_data['text']
                         if st.button("📝 平仄確認処理", key=f"check_text_{i}"):
                             original_text_to_pass = sentence_data.get('text', '')
@@ -326,51 +480,7 @@ def display_search_interface():
                             if st.session_state[f"fw_search_results_{i}"] is not None:
                                 st.markdown("---")
                                 st.markdown("##### 検索結果")
-                                highlight_query = st.session_state.get(f"highlight_query_{i}", "")
-                                is_ja_q_for_highlight = is_japanese(highlight_query)
-
-                                for fw_idx, fw_res in enumerate(st.session_state[f"fw_search_results_{i}"]):
-                                    with st.container(border=True):
-                                        # ### 修正 ###
-                                        # この行が抜けていたため UnboundLocalError が発生していました
-                                        check_col, content_col = st.columns([0.08, 0.92])
-                                        with check_col:
-                                            is_checked = st.checkbox(" ", value=fw_res.get("checked", False), key=f"fw_res_check_{i}_{fw_idx}", label_visibility="collapsed")
-                                            st.session_state[f"fw_search_results_{i}"][fw_idx]["checked"] = is_checked
-
-                                        with content_col:
-                                            res_en, res_ja, source_file = fw_res.get("en_text", ""), fw_res.get("jp_text", ""), fw_res.get("sourceFile", "")
-                                            highlights = fw_res.get("@search.highlights") or {}
-                                            en_snips, ja_snips, title_snips = highlights.get("en_text", []), highlights.get("jp_text", []), highlights.get("jp_title", [])
-                                            jp_title = fw_res.get("jp_title", "")
-                                            
-                                            if title_snips:
-                                                title_prefix = f"**{' ... '.join(title_snips)}**"
-                                            else:
-                                                title_prefix = f"**{client_side_highlight(jp_title, highlight_query)}**" if jp_title else ""
-
-                                            source_file_display = source_file.replace(".csv", ".pdf")
-                                            valid_date_str = fw_res.get("valid_date", "")
-                                            date_display = ""
-                                            if valid_date_str:
-                                                try:
-                                                    formatted_date = datetime.fromisoformat(valid_date_str.replace('Z', '+00:00')).strftime('%Y年%m月%d日')
-                                                    date_display = f" | 効力発生日: **{formatted_date}**"
-                                                except (ValueError, TypeError):
-                                                    date_display = f" | 効力発生日: **{valid_date_str}**"
-
-                                            country_area = fw_res.get("country_area", "")
-                                            country_area_display = f" | 国・地域名: **{country_area}**" if country_area else ""
-                                            metadata_str = f"{title_prefix}{date_display}{country_area_display} | Source: **{source_file_display}#{fw_res['line_number']}** | Score: {fw_res['@search.score']:.4f}"
-                                            res_c1, res_c2 = st.columns([0.8, 0.2])
-                                            with res_c1: st.markdown(metadata_str, unsafe_allow_html=True)
-                                            with res_c2: st.markdown(f'<a href="?view_treaty={urllib.parse.quote(source_file)}" target="_blank" rel="noopener noreferrer">条約全文を開く</a>', unsafe_allow_html=True)
-
-                                            en_html_highlighted = merge_server_highlights(res_en, en_snips) if en_snips else client_side_highlight(res_en, highlight_query)
-                                            ja_html_highlighted = merge_server_highlights(res_ja, ja_snips) if ja_snips else client_side_highlight(res_ja, highlight_query)
- 
-                                            st.markdown(f"**英語原文:**<br>{en_html_highlighted}", unsafe_allow_html=True)
-                                            st.markdown(f"**日本語訳:**<br>{ja_html_highlighted}", unsafe_allow_html=True)
+                                _render_fw_results(i)
 
                     # 2. 適用する辞書用語
                     if "found_terms" in sentence_data:
@@ -410,43 +520,10 @@ def display_search_interface():
                     if sentence_data.get("search_results"):
                         st.markdown("---")
                         st.markdown("🔍**類似文検索結果:**（翻訳の参照として使用する行を選択してください）")
-                        highlight_query = st.session_state.get(f"highlight_query_{i}", "")
-                        is_ja_q_for_highlight = is_japanese(highlight_query)
-                        for j, result_item in enumerate(sentence_data["search_results"]):
-                            with st.container(border=True):
-                                check_col, content_col = st.columns([0.08, 0.92])
-                                with check_col:
-                                    is_checked = st.checkbox(" ", value=result_item.get("checked", False), key=f"res_check_{i}_{j}", label_visibility="collapsed", help="この行を翻訳の参照に含める")
-                                    st.session_state.segmented_sentences[i]["search_results"][j]["checked"] = is_checked
-                                with content_col:
-                                    res_en, res_ja, source_file = result_item.get("en_text", ""), result_item.get("jp_text", ""), result_item.get("sourceFile", "")
-                                    highlights = result_item.get("@search.highlights") or {}
-                                    en_snips, ja_snips = highlights.get("en_text", []), highlights.get("jp_text", [])
-                                    jp_title_tab2 = result_item.get("jp_title", "")
-                                    source_file_display_tab2 = source_file.replace(".csv", ".pdf")
-                                    title_prefix_tab2 = f"**{jp_title_tab2}**" if jp_title_tab2 else ""
-                                    valid_date_str = result_item.get("valid_date", "")
-                                    date_display_tab2 = ""
-                                    if valid_date_str:
-                                        try:
-                                            formatted_date = datetime.fromisoformat(valid_date_str.replace('Z', '+00:00')).strftime('%Y年%m月%d日')
-                                            date_display_tab2 = f" | 効力発生日: **{formatted_date}**"
-                                        except (ValueError, TypeError):
-                                            date_display_tab2 = f" | 効力発生日: **{valid_date_str}**"
-                                    country_area_tab2 = result_item.get("country_area", "")
-                                    country_area_display_tab2 = f" | 国・地域名: **{country_area_tab2}**" if country_area_tab2 else ""
-                                    metadata_str = f"{title_prefix_tab2}{date_display_tab2}{country_area_display_tab2} | Source: **{source_file_display_tab2}#{result_item['line_number']}** | Score: {result_item['@search.score']:.4f}"
-                                    res_col1_tab2, res_col2_tab2 = st.columns([0.8, 0.2])
-                                    with res_col1_tab2: st.markdown(metadata_str)
-                                    with res_col2_tab2: st.markdown(f'<a href="?view_treaty={urllib.parse.quote(source_file)}" target="_blank" rel="noopener noreferrer">条約全文を開く</a>', unsafe_allow_html=True)
-                                    if is_ja_q_for_highlight:
-                                        ja_html_highlighted = merge_server_highlights(res_ja, ja_snips) if ja_snips else client_side_highlight(res_ja, highlight_query)
-                                        en_html_highlighted = _escape_html(res_en)
-                                    else:
-                                        en_html_highlighted = merge_server_highlights(res_en, en_snips) if en_snips else client_side_highlight(res_en, highlight_query)
-                                        ja_html_highlighted = _escape_html(res_ja)
-                                    st.markdown(f"**英語原文:**<br>{en_html_highlighted}", unsafe_allow_html=True)
-                                    st.markdown(f"**日本語訳:**<br>{ja_html_highlighted}", unsafe_allow_html=True)
+                        _render_sentence_results(i)
 
     with tab_maintenance:
         display_maintenance_page()
+
+    # 画面の描画が終わってから、文章分割で使う文分割エンジンをバックグラウンドで読み込む
+    warm_up_nlp()
@@ -3,6 +3,7 @@ import urllib.parse
 from datetime import datetime
 
 from core.azure_clients import get_clients
+from core.database import init_db, lookup_terms, reverse_lookup_terms
 from core.search import perform_search
 from utils import is_japanese, _escape_html, client_side_highlight
 
@@ -22,6 +23,15 @@ def display_term_search_results_page(term: str):
         lang_mode_override="言語自動判定"
     )
 
+    conn = init_db()
+    try:
+        glossary_rows = reverse_lookup_terms(conn, term) if is_japanese(term) else lookup_terms(conn, term)
+    except Exception as e:
+        glossary_rows = []
+        st.warning(f"登録辞書の検索中にエラーが発生しました: {e}")
+    if glossary_rows:
+        st.markdown("📖**登録辞書:** " + " / ".join(f"{_escape_html(en)} → {_escape_html(ja)}" for _, en, ja in glossary_rows), unsafe_allow_html=True)
+
     st.caption(metadata)
     st.divider()
 